@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark of the wizard's own overhead, with stubbed system tools.
+
+Usage: python3 bench/install.py [--repeat N] [--plan] [--latency TOOL=SECS ...]
+                                [--record] [--baseline FILE] [--json OUT]
+
+Runs guhwizard.main() unattended (a scripted --profile answers every menu)
+in a throw-away sandbox: $HOME, $TMPDIR, the pacman database, pacman.conf,
+the mirrorlist and /sys/class/drm all live in a temp dir, and fake
+pacman, sudo, systemctl, git, makepkg, curl, pipx, magick, ... on PATH
+stand in for the real tools. Each fake sleeps for its configured latency
+(default 0), so what remains is the wizard's own cost. The AUR RPC and
+the mirrors are served by a local HTTP server.
+
+Reported per run: total wall time, processes spawned through run(),
+seconds spent in time.sleep (and in `sleep` inside child scripts), and
+the time of each phase. Each metric is compared with the baseline in
+bench/install-baseline.json; the script exits 1 if any of them got worse
+(spawns: any increase; times: guhwizard's REGRESSION_RATIO and
+REGRESSION_MIN_SECS). --record stores the current values as the baseline.
+
+The sandbox guards itself: the fake sudo refuses any real command that
+names a path outside it, so nothing on this machine is modified.
+"""
+
+import argparse
+import ast
+import inspect
+import io
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))   # guhwizard is imported late: it reads $HOME at import
+BASELINE = Path(__file__).resolve().parent / "install-baseline.json"
+SLEEP_SLACK = 0.05       # seconds of extra time.sleep tolerated before failing
+
+# Menus answered by the scripted run; exercises repo and AUR installs
+PROFILE = """\
+[options]
+plan = {plan}
+reboot = false
+remove_toolchain = true
+
+[menus]
+"AUR Helpers" = "yay"
+Terminals = "kitty"
+Browsers = ["firefox", "zen-browser-bin"]
+"File Managers" = "yazi"
+Editors = ["neovim"]
+Media = ["mpv", "imv"]
+Utilities = ["fastfetch", "htop", "uwufetch"]
+"""
+
+# Packages the fake AUR serves; everything else the wizard names is in the repos
+AUR_EXTRA = {"yay", "paru", "pikaur", "guhwall", "guhshot", "sublime-text-4", "uwufetch"}
+
+# ─── Fake tools ──────────────────────────────────────────────────────────────
+
+# Shared prologue: log the call, then sleep for BENCH_LATENCY_<TOOL>
+PROLOGUE = r"""#!/bin/bash
+tool=$(basename "$0")
+echo "$tool $*" >> "$BENCH_ROOT/calls.log"
+var="BENCH_LATENCY_${tool//-/_}"
+lat="${!var:-${BENCH_LATENCY:-0}}"
+[ "$lat" != 0 ] && "$REAL_SLEEP" "$lat"
+"""
+
+FAKES = {
+    "sudo": r"""
+while [[ $1 == -* ]]; do [ "$1" = -v ] && exit 0; shift; done
+[ $# = 0 ] && exit 0
+# Real commands may only touch the sandbox
+if [[ $(command -v "$1") != "$BENCH_ROOT"/bin/* ]]; then
+    for a in "${@:2}"; do
+        case $a in /dev/null|"$BENCH_ROOT"/*) ;; /*) echo "BLOCKED sudo $*" >> "$BENCH_ROOT/calls.log"; exit 1;; esac
+    done
+fi
+exec "$@"
+""",
+    "pacman": r"""
+op=""; pkgs=(); skip=0
+for a in "$@"; do
+    if [ $skip = 1 ]; then skip=0; continue; fi
+    case $a in
+        --root|--dbpath|--config|--cachedir) skip=1;;
+        --*) ;;
+        -*) [ -z "$op" ] && op=$a;;
+        *) pkgs+=("$a");;
+    esac
+done
+case $op in
+    -S*) for p in "${pkgs[@]}"; do mkdir -p "$BENCH_DB/local/$p-1.0-1"; done;;
+    -U*) for f in "${pkgs[@]}"; do
+             b=$(basename "$f"); mkdir -p "$BENCH_DB/local/${b%-*-*-*}-1.0-1"
+         done;;
+    -R*) for p in "${pkgs[@]}"; do rm -rf "$BENCH_DB/local/$p-1.0-1"; done;;
+esac
+exit 0
+""",
+    "systemctl": r"""
+units="$BENCH_ROOT/units"; mkdir -p "$units"
+args=(); for a in "$@"; do case $a in --*) ;; *) args+=("$a");; esac; done
+case ${args[0]} in
+    enable) for u in "${args[@]:1}"; do touch "$units/$u"; done;;
+    disable) for u in "${args[@]:1}"; do rm -f "$units/$u"; done;;
+    is-enabled) for u in "${args[@]:1}"; do [ -e "$units/$u" ] && echo enabled || echo disabled; done;;
+    is-active) for u in "${args[@]:1}"; do echo active; done;;
+    list-unit-files) for u in "${args[@]:1}"; do [[ $u == *@.service ]] || echo "$u disabled"; done;;
+esac
+exit 0
+""",
+    "git": r"""
+if [ "$1" != clone ]; then exec "$REAL_GIT" "$@"; fi
+dest="${@: -1}"; url="${@: -2:1}"; name=$(basename "$url" .git)
+mkdir -p "$dest"
+if [ "$name" = guhwm ]; then
+    cp -r "$BENCH_SRC/confs" "$BENCH_SRC/assets" "$dest/"
+else
+    name=${name,,}
+    printf 'pkgname=%s\npkgver=1.0\npkgrel=1\nsource=("%s.tar.gz")\nsha256sums=(%s)\n' \
+        "$name" "$name" "'0123456789abcdef0123456789abcdef0123456789abcdef0123456789abcdef'" \
+        > "$dest/PKGBUILD"
+fi
+exit 0
+""",
+    "makepkg": r"""
+name=$(sed -n 's/^pkgname=//p' PKGBUILD)
+pkg="$PWD/$name-1.0-1-$(uname -m)${PKGEXT:-.pkg.tar.zst}"
+case " $* " in
+    *" --packagelist "*) echo "$pkg";;
+    *) : > "$pkg";;
+esac
+exit 0
+""",
+    "yay": r"""
+tool=$(basename "$0")
+compgen -G "$BENCH_DB/local/$tool-*" > /dev/null || exit 127
+[ "$1" = -S ] && for p in "${@:2}"; do [[ $p == -* ]] || mkdir -p "$BENCH_DB/local/$p-1.0-1"; done
+exit 0
+""",
+    "magick": r"""
+out="${@: -1}"; : > "${out#*:}"
+exit 0
+""",
+    "sleep": r"""
+echo "$1" >> "$BENCH_ROOT/sleeps.log"
+exec "$REAL_SLEEP" "$@"
+""",
+    "swww": 'echo "HDMI-A-1: 1920x1080, scale: 1"\nexit 0\n',
+    "pipx": "exit 0\n",
+    "curl": "exit 0\n",
+    "pgrep": "exit 0\n",
+    "usermod": "exit 0\n",
+    "chsh": "exit 0\n",
+    "xdg-user-dirs-update": 'mkdir -p "$HOME/Public" "$HOME/Templates" "$HOME/Documents"\nexit 0\n',
+}
+FAKES["paru"] = FAKES["pikaur"] = FAKES["yay"]
+
+def write_fakes(bin_dir):
+    for name, body in FAKES.items():
+        path = bin_dir / name
+        path.write_text(PROLOGUE + body)
+        path.chmod(0o755)
+
+# ─── Sandbox ─────────────────────────────────────────────────────────────────
+
+def _desc(name):
+    return (f"%NAME%\n{name}\n\n%VERSION%\n1.0-1\n\n%CSIZE%\n{1 << 20}\n\n"
+            f"%ISIZE%\n{4 << 20}\n\n").encode()
+
+def package_names(guhwizard):
+    """Every package the wizard can ask for: base list, menus, build tools."""
+    base = inspect.getsource(guhwizard.install_base)
+    names = set(ast.literal_eval(re.search(r"base_pkgs = (\[.*?\])", base, re.S).group(1)))
+    menus = inspect.getsource(guhwizard.optional_software)
+    names |= set(re.findall(r'\(\w+,\s*"[^"]+",\s*"([^"]+)"', menus))
+    names |= {"base-devel", "git", "archlinux-keyring", "zsh", "zig"}
+    names |= set(guhwizard.HELPER_TOOLCHAINS.values()) | set(guhwizard.HELPER_BIN_PKGS.values())
+    return names
+
+def write_sync_db(path, names):
+    with tarfile.open(path, "w:gz") as tar:
+        for name in sorted(names):
+            info = tarfile.TarInfo(f"{name}-1.0-1/desc")
+            data = _desc(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+class FakeNet(BaseHTTPRequestHandler):
+    """AUR RPC under /rpc/, a small file for every other path (mirror probes)."""
+    aur = set()
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path.startswith("/rpc"):
+            query = urllib.parse.parse_qs(url.query)
+            names = query.get("arg[]", []) if query.get("type") == ["info"] else []
+            results = [{"Name": n, "PackageBase": n, "Version": "1.0-1", "Depends": [],
+                        "MakeDepends": []} for n in names if n in self.aur]
+            body = json.dumps({"type": "multiinfo", "results": results}).encode()
+        else:
+            body = b"\0" * (64 << 10)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# ─── One run (child process) ─────────────────────────────────────────────────
+
+def _tool(argv):
+    """The program a run() call started, looking through sudo and its flags."""
+    if argv[0] == "sudo":
+        argv = [a for a in argv[1:] if not a.startswith("-")] or argv
+    return os.path.basename(argv[0])
+
+def child(settings):
+    """Run guhwizard.main() once in a fresh sandbox; write its metrics as JSON."""
+    sandbox = Path(tempfile.mkdtemp(prefix="guhwizard-bench."))
+    bin_dir, db = sandbox / "bin", sandbox / "db"
+    for d in (bin_dir, db / "local", db / "sync", sandbox / "home", sandbox / "tmp",
+              sandbox / "etc" / "pacman.d", sandbox / "drm" / "card0-HDMI-A-1"):
+        d.mkdir(parents=True)
+    write_fakes(bin_dir)
+    (sandbox / "drm" / "card0-HDMI-A-1" / "status").write_text("connected\n")
+    (sandbox / "drm" / "card0-HDMI-A-1" / "modes").write_text("1920x1080\n")
+    profile = sandbox / "answers.toml"
+    profile.write_text(PROFILE.format(plan=str(settings["plan"]).lower()))
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeNet)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    net = f"http://127.0.0.1:{server.server_address[1]}"
+
+    tempfile.tempdir = str(sandbox / "tmp")
+    os.environ.update({
+        "HOME": str(sandbox / "home"), "TMPDIR": str(sandbox / "tmp"),
+        "PATH": f"{bin_dir}:{os.environ['PATH']}", "GUHWIZARD_AUR_URL": f"{net}/rpc/",
+        "BENCH_ROOT": str(sandbox), "BENCH_DB": str(db), "BENCH_SRC": str(ROOT),
+        "REAL_SLEEP": shutil.which("sleep"), "REAL_GIT": shutil.which("git") or "false",
+    })
+    for tool, secs in settings["latency"].items():
+        var = "BENCH_LATENCY" if tool == "all" else f"BENCH_LATENCY_{tool.replace('-', '_')}"
+        os.environ[var] = str(secs)
+
+    # Count every second the wizard spends in time.sleep, from any thread
+    slept = [0.0]
+    real_sleep = time.sleep
+    def counting_sleep(secs):
+        slept[0] += secs
+        real_sleep(secs)
+    time.sleep = counting_sleep
+
+    import guhwizard
+    aur = {n for n in package_names(guhwizard) if n.endswith(("-bin", "-git"))} | AUR_EXTRA
+    FakeNet.aur = aur | {"yay-bin", "paru-bin"}
+    write_sync_db(db / "sync" / "core.db", package_names(guhwizard) - aur)
+    guhwizard.PACMAN_CONF = sandbox / "etc" / "pacman.conf"
+    guhwizard.PACMAN_CONF.write_text("[options]\nArchitecture = auto\n\n[core]\n"
+                                     "Include = /etc/pacman.d/mirrorlist\n")
+    guhwizard.MIRRORLIST = sandbox / "etc" / "pacman.d" / "mirrorlist"
+    guhwizard.MIRRORLIST.write_text("".join(f"Server = {net}/m{i}/$repo/os/$arch\n"
+                                            for i in range(3)))
+    guhwizard.MAKEPKG_DROPIN = sandbox / "etc" / "makepkg.conf.d" / "guhwizard.conf"
+    guhwizard.DRM_CLASS = sandbox / "drm"
+    guhwizard.AUR_PROBE_URL = f"{net}/"
+    guhwizard.PKG_INDEX = guhwizard.HOST_PKG_INDEX = guhwizard.PackageIndex(db)
+    guhwizard.check_root = lambda: None     # nothing outside the sandbox is touched
+
+    sys.argv = ["guhwizard.py", "--profile", str(profile)] + (["--plan"] if settings["plan"] else [])
+    # The wizard's own output (and its children's) goes to wizard.out
+    with open(sandbox / "wizard.out", "w") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+    exit_code = 0
+    start = time.monotonic()
+    try:
+        guhwizard.main()
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+    wall = time.monotonic() - start
+    sys.stdout.flush()
+
+    calls = (sandbox / "calls.log").read_text().splitlines()
+    sleeps = (sandbox / "sleeps.log").read_text().split() if (sandbox / "sleeps.log").exists() else []
+    tools = Counter(_tool(c["argv"]) for c in guhwizard.RUN_LOG["commands"])
+    Path(settings["out"]).write_text(json.dumps({
+        "exit": exit_code,
+        "wall": round(wall, 3),
+        "spawns": len(guhwizard.RUN_LOG["commands"]),
+        "sleep": round(slept[0], 3),
+        "script_sleep": round(sum(float(s) for s in sleeps if s.replace(".", "", 1).isdigit()), 3),
+        "phases": guhwizard.RUN_LOG["phases"],
+        "tools": dict(tools.most_common()),
+        "blocked": [c for c in calls if c.startswith("BLOCKED")],
+        "sandbox": str(sandbox),
+    }))
+    server.shutdown()
+    if exit_code == 0 and not settings["keep"]:
+        shutil.rmtree(sandbox, ignore_errors=True)
+
+# ─── Report ──────────────────────────────────────────────────────────────────
+
+def flatten(metrics):
+    flat = {k: metrics[k] for k in ("wall", "spawns", "sleep", "script_sleep")}
+    flat.update({f"phase:{p}": s for p, s in metrics["phases"].items()})
+    return flat
+
+def aggregate(runs):
+    """Median of every time metric, the maximum spawn count."""
+    flats = [flatten(r) for r in runs]
+    keys = dict.fromkeys(k for f in flats for k in f)
+    return {k: (max if k == "spawns" else statistics.median)([f.get(k, 0) for f in flats])
+            for k in keys}
+
+def regressed(key, value, base):
+    import guhwizard
+    if key == "spawns":
+        return value > base
+    if key.endswith("sleep"):
+        return value > base + SLEEP_SLACK
+    return value > base * guhwizard.REGRESSION_RATIO and value - base > guhwizard.REGRESSION_MIN_SECS
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--plan", action="store_true", help="answer the menus in --plan mode")
+    parser.add_argument("--latency", metavar="TOOL=SECS", nargs="+", default=[],
+                        help="latency of a fake tool, e.g. pacman=0.2 (all=... for every tool)")
+    parser.add_argument("--baseline", default=str(BASELINE))
+    parser.add_argument("--record", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--json", metavar="OUT", help="also write the runs and summary as JSON")
+    parser.add_argument("--keep", action="store_true", help="keep the sandboxes for inspection")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(json.loads(args.child))
+
+    latency = {k: float(v) for k, v in (item.split("=", 1) for item in args.latency)}
+    settings = {"plan": args.plan, "keep": args.keep, "latency": latency}
+    runs = []
+    for i in range(args.repeat):
+        with tempfile.NamedTemporaryFile(suffix=".json") as out:
+            settings["out"] = out.name
+            result = subprocess.run([sys.executable, __file__, "--child", json.dumps(settings)],
+                                    capture_output=True, text=True)
+            text = Path(out.name).read_text()
+        if result.returncode != 0 or not text:
+            sys.exit(f"run {i + 1} crashed:\n{result.stderr}")
+        run = json.loads(text)
+        if run["exit"] != 0 or run["blocked"]:
+            sys.exit(f"run {i + 1} failed (exit {run['exit']}, blocked: {run['blocked']}); "
+                     f"see {run['sandbox']}/wizard.out")
+        runs.append(run)
+
+    summary = aggregate(runs)
+    scenario = "plan" if args.plan else "default"
+    if args.latency:
+        scenario += " " + " ".join(sorted(args.latency))
+    path = Path(args.baseline)
+    baselines = json.loads(path.read_text()) if path.is_file() else {}
+    base = baselines.get(scenario, {})
+
+    print(f"{'metric':<36} {'value':>9} {'baseline':>9}")
+    failed = []
+    for key, value in summary.items():
+        old = base.get(key)
+        bad = old is not None and regressed(key, value, old)
+        failed += [key] if bad else []
+        fmt = (lambda v: f"{v:9d}") if key == "spawns" else (lambda v: f"{v:9.3f}")
+        print(f"{key:<36} {fmt(value)} {fmt(old) if old is not None else '        -'}"
+              f"{'  REGRESSED' if bad else ''}")
+    print("spawns by tool: " + ", ".join(f"{t} {n}" for t, n in runs[-1]["tools"].items()))
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"runs": runs, "summary": summary}, indent=1))
+    if args.record:
+        baselines[scenario] = summary
+        path.write_text(json.dumps(baselines, indent=1, sort_keys=True) + "\n")
+        print(f"baseline for '{scenario}' recorded in {path}")
+    elif not base:
+        print(f"(no baseline for '{scenario}' yet: run with --record)")
+    if failed:
+        sys.exit(f"regressed: {', '.join(failed)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Compare the built-in NumPy palette extractor with pywal16.
+
+Usage: python3 bench/palette.py [--repeat N] [DIR]
+
+DIR defaults to the bundled assets/Wallpapers. pywal runs with an empty
+PYWAL_CACHE_DIR each time so its scheme cache never answers for it.
+Needs python-numpy, ImageMagick and (for the comparison) `wal` on PATH.
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import guhwizard  # noqa: E402
+
+def time_builtin(img):
+    start = time.perf_counter()
+    palette = guhwizard.extract_palette(img)
+    secs = time.perf_counter() - start
+    return (secs if palette else None), palette
+
+def time_pywal(img):
+    with tempfile.TemporaryDirectory() as cache:
+        env = dict(os.environ, PYWAL_CACHE_DIR=cache)
+        start = time.perf_counter()
+        result = subprocess.run(["wal", "-i", img, "-n", "-s", "-t", "-e", "-q", "--backend", "wal"],
+                                env=env, capture_output=True)
+        secs = time.perf_counter() - start
+    return secs if result.returncode == 0 else None
+
+def ms(samples):
+    samples = [s for s in samples if s is not None]
+    return f"{statistics.median(samples) * 1000:8.1f}" if samples else "     n/a"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("dir", nargs="?", default=str(ROOT / "assets" / "Wallpapers"))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    images = sorted(str(p) for p in Path(args.dir).glob("*")
+                    if p.suffix.lower() in guhwizard.WALLPAPER_EXTS)
+    if guhwizard.extract_palette(images[0]) is None:
+        sys.exit("built-in extractor unavailable (needs python-numpy and ImageMagick)")
+    has_wal = shutil.which("wal") is not None
+
+    print(f"{'image':<40} {'numpy ms':>8} {'pywal ms':>8}  background / color4")
+    builtin_all, pywal_all = [], []
+    for img in images:
+        builtin = [time_builtin(img) for _ in range(args.repeat)]
+        pywal = [time_pywal(img) for _ in range(args.repeat)] if has_wal else []
+        builtin_all += [secs for secs, _ in builtin]
+        pywal_all += pywal
+        palette = builtin[-1][1]
+        print(f"{Path(img).name[:40]:<40} {ms([s for s, _ in builtin])} {ms(pywal)}  "
+              f"{palette['special']['background']} / {palette['colors']['color4']}")
+    print(f"{'median':<40} {ms(builtin_all)} {ms(pywal_all)}")
+    if not has_wal:
+        print("(pywal16 `wal` not on PATH: comparison column skipped)")
+
+if __name__ == "__main__":
+    main()
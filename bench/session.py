@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""Time-to-desktop benchmark for the mango exec-once chain.
+
+Usage: python3 bench/session.py [--config FILE] [--attach] [--timeout S] [--json OUT]
+
+Starts mango on the headless wlroots backend (or, with --attach, uses the
+running Wayland session), launches every ``exec-once`` entry of the
+config the way mango does - all at once, each in its own shell - and
+records when each one becomes usable:
+
+    waybar        its "Bar configured" log line (the bar surface is mapped)
+    swww-daemon   `swww query` succeeds
+    swaync        org.freedesktop.Notifications is owned on the session bus
+    nm-applet     its StatusNotifierItem is on the session bus
+    wlsunset, polkit agent
+                  still running after --settle
+    anything else (scripts, one-shot commands) has exited
+
+Each entry runs with bash xtrace timestamped by $EPOCHREALTIME, so the
+report also lists the serial steps (sleeps, polling loops) inside the
+chain. Everything runs against a throw-away $HOME that links to the real
+configs, so the self-deleting default-wallpaper.sh only deletes a copy.
+"""
+
+import argparse
+import json
+import os
+import re
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+POLL = 0.02
+TRACE = re.compile(r"^\++(\d+\.\d+) (.*)$")
+SERIAL_MIN = 0.1         # report blocking steps at least this long (seconds)
+ESSENTIAL = ("waybar", "swww-daemon", "swaync")   # the desktop is usable once these are ready
+
+# ─── Readiness probes ─────────────────────────────────────────────────────────
+
+def _bus_names(env):
+    result = subprocess.run(["busctl", "--user", "--list", "--no-legend"], env=env,
+                            capture_output=True, text=True)
+    return {line.split()[0] for line in result.stdout.splitlines() if line.strip()}
+
+def probe_waybar(entry, env):
+    return "Bar configured" in entry.log_text()
+
+def probe_swww(entry, env):
+    return subprocess.run(["swww", "query"], env=env, capture_output=True).returncode == 0
+
+def probe_swaync(entry, env):
+    return "org.freedesktop.Notifications" in _bus_names(env)
+
+def probe_nm_applet(entry, env):
+    return any(n.startswith("org.kde.StatusNotifierItem-") for n in _bus_names(env))
+
+PROBES = {
+    "waybar": probe_waybar,
+    "swww-daemon": probe_swww,
+    "swaync": probe_swaync,
+    "nm-applet": probe_nm_applet,
+}
+DAEMONS = {"wlsunset", "polkit-gnome-authentication-agent-1"}   # no probe: alive counts
+
+# ─── exec-once entries ────────────────────────────────────────────────────────
+
+def exec_once_lines(config):
+    """The ``exec-once`` commands of a mango config, in order."""
+    lines = []
+    for line in Path(config).read_text().splitlines():
+        key, sep, value = line.partition("=")
+        if sep and key.strip() == "exec-once" and not line.lstrip().startswith("#"):
+            lines.append(value.strip())
+    return lines
+
+def label(cmd):
+    """Short component name: the program of the last ``&&`` segment."""
+    last = cmd.split("&&")[-1].strip()
+    try:
+        words = shlex.split(last)
+    except ValueError:
+        words = last.split()
+    if not words:
+        return cmd
+    name = os.path.basename(os.path.expandvars(words[0]))
+    if len(words) > 1 and not words[1].startswith("-") and name == "swww":
+        name += f" {words[1]}"
+    return name
+
+class Entry:
+    """One exec-once command being launched and watched."""
+
+    def __init__(self, cmd, logdir, index):
+        self.cmd = cmd
+        self.name = label(cmd)
+        self.log = Path(logdir) / f"{index:02d}-{self.name.replace(' ', '_')}.log"
+        self.proc = None
+        self.start = self.ready = self.exited = self.exited_wall = None
+        self.rc = None
+        self.how = ""
+
+    def launch(self, env):
+        self.start = time.monotonic()
+        with open(self.log, "wb") as log:
+            self.proc = subprocess.Popen(["bash", "-c", self.cmd], env=env, stdout=log,
+                                         stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                         start_new_session=True)
+
+    def log_text(self):
+        try:
+            return self.log.read_text(errors="replace")
+        except OSError:
+            return ""
+
+    def poll(self, env, now, settle):
+        """Update exit/readiness state; returns True once this entry is settled."""
+        if self.exited is None and self.proc.poll() is not None:
+            self.exited, self.rc = now, self.proc.returncode
+            self.exited_wall = time.time()
+        if self.ready is not None:
+            return True
+        probe = PROBES.get(self.name)
+        if probe and probe(self, env):
+            self.ready, self.how = now, "probe"
+        elif self.exited is not None:
+            self.ready, self.how = self.exited, "exit" if self.rc == 0 else f"exit {self.rc}"
+        elif self.name in DAEMONS and now - self.start >= settle:
+            self.ready, self.how = now, "alive"
+        return self.ready is not None
+
+    def serial_steps(self):
+        """(seconds, command) of traced shell steps that blocked the chain."""
+        trace = []
+        for line in self.log_text().splitlines():
+            m = TRACE.match(line)
+            if m:
+                trace.append((float(m.group(1)), m.group(2)))
+        # the last step only has an end if the shell exited (daemons never do)
+        steps = []
+        for (t, cmd), nxt in zip(trace, trace[1:] + [(self.exited_wall, None)]):
+            if nxt[0] is not None and nxt[0] - t >= SERIAL_MIN:
+                steps.append((nxt[0] - t, cmd))
+        return steps
+
+    def kill(self):
+        if self.proc and self.proc.poll() is None:
+            try:
+                os.killpg(self.proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+# ─── Sandbox & compositor ─────────────────────────────────────────────────────
+
+def sandbox_home(real_home, config):
+    """Temporary $HOME: links to the real configs, copies of anything the chain deletes."""
+    home = Path(tempfile.mkdtemp(prefix="guhwm-session-"))
+    real_conf = Path(real_home) / ".config"
+    conf = home / ".config"
+    conf.mkdir()
+    for item in (real_conf.iterdir() if real_conf.is_dir() else []):
+        if item.name != "mango":
+            (conf / item.name).symlink_to(item)
+    mango = conf / "mango"
+    src_mango = Path(config).parent
+    shutil.copytree(src_mango, mango, symlinks=True, dirs_exist_ok=True)
+    # mango itself gets a config without exec-once: the harness launches those
+    text = "\n".join(l for l in Path(config).read_text().splitlines()
+                     if not l.strip().startswith("exec-once"))
+    (mango / "config.conf").write_text(text + "\n")
+    for name in ("Wallpapers",):
+        if (Path(real_home) / name).exists():
+            (home / name).symlink_to(Path(real_home) / name)
+    (home / ".cache").mkdir()
+    for name in ("wal", "guhwm"):
+        if (Path(real_home) / ".cache" / name).exists():
+            (home / ".cache" / name).symlink_to(Path(real_home) / ".cache" / name)
+    return home
+
+def start_bus(env):
+    """Private session bus, so probes only see this run's services."""
+    proc = subprocess.Popen(["dbus-daemon", "--session", "--nofork", "--print-address=1"],
+                            env=env, stdout=subprocess.PIPE, text=True)
+    env["DBUS_SESSION_BUS_ADDRESS"] = proc.stdout.readline().strip()
+    return proc
+
+def start_compositor(compositor, env, timeout):
+    """Launch the compositor headless; returns (proc, seconds until its socket appeared)."""
+    runtime = Path(env["XDG_RUNTIME_DIR"])
+    before = set(runtime.glob("wayland-*"))
+    env.update(WLR_BACKENDS="headless", WLR_RENDERER="pixman", WLR_LIBINPUT_NO_DEVICES="1")
+    env.pop("WAYLAND_DISPLAY", None)
+    start = time.monotonic()
+    proc = subprocess.Popen(shlex.split(compositor), env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL, start_new_session=True)
+    while time.monotonic() - start < timeout:
+        new = [p for p in set(runtime.glob("wayland-*")) - before if not p.name.endswith(".lock")]
+        if new:
+            env["WAYLAND_DISPLAY"] = new[0].name
+            return proc, time.monotonic() - start
+        if proc.poll() is not None:
+            break
+        time.sleep(POLL)
+    proc.terminate()
+    sys.exit(f"{compositor} did not create a Wayland socket (rc={proc.poll()})")
+
+# ─── Report ───────────────────────────────────────────────────────────────────
+
+def report(entries, t0, compositor_secs):
+    rows = []
+    print(f"{'component':<38} {'start':>7} {'ready':>7} {'took':>7}  how")
+    if compositor_secs is not None:
+        print(f"{'compositor socket':<38} {'':>7} {compositor_secs:7.2f} {compositor_secs:7.2f}  socket")
+    for e in sorted(entries, key=lambda e: (e.ready is None, e.ready or 0)):
+        start = e.start - t0
+        ready = None if e.ready is None else e.ready - t0
+        took = None if ready is None else ready - start
+        print(f"{e.name[:38]:<38} {start:7.2f} "
+              f"{'-' if ready is None else f'{ready:7.2f}':>7} "
+              f"{'-' if took is None else f'{took:7.2f}':>7}  {e.how or 'timeout'}")
+        rows.append({"name": e.name, "cmd": e.cmd, "start": round(start, 3),
+                     "ready": None if ready is None else round(ready, 3),
+                     "how": e.how or "timeout", "rc": e.rc,
+                     "serial": [{"secs": round(s, 3), "cmd": c} for s, c in e.serial_steps()]})
+
+    essential = [e for e in entries if e.name in ESSENTIAL]
+    if essential and all(e.ready for e in essential):
+        print(f"\ntime to desktop ({', '.join(ESSENTIAL)} ready): "
+              f"{max(e.ready for e in essential) - t0:.2f}s")
+    done = [e.ready for e in entries if e.ready]
+    if done:
+        print(f"everything settled: {max(done) - t0:.2f}s")
+
+    serial = [(s, e.name, c) for e in entries for s, c in e.serial_steps()]
+    if serial:
+        print("\nserial steps inside the chain:")
+        for secs, name, cmd in sorted(serial, reverse=True)[:10]:
+            print(f"  {secs:6.2f}s  {name:<24} {cmd[:60]}")
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default=str(Path.home() / ".config" / "mango" / "config.conf"))
+    parser.add_argument("--compositor", default="mango", help="compositor command (headless mode)")
+    parser.add_argument("--attach", action="store_true",
+                        help="use the running Wayland session instead of a headless compositor")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--settle", type=float, default=0.5,
+                        help="seconds a probe-less daemon must stay up to count as ready")
+    parser.add_argument("--json", metavar="OUT", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    home = sandbox_home(Path.home(), args.config)
+    # Every bash in the chain sources BASH_ENV (PS4 itself is not inherited by root shells)
+    trace_rc = home / ".trace.bash"
+    trace_rc.write_text("PS4='+${EPOCHREALTIME} '\nset -x\n")
+    env = dict(os.environ, HOME=str(home), XDG_CONFIG_HOME=str(home / ".config"),
+               XDG_CACHE_HOME=str(home / ".cache"), BASH_ENV=str(trace_rc))
+    if "XDG_RUNTIME_DIR" not in env:
+        env["XDG_RUNTIME_DIR"] = tempfile.mkdtemp(prefix="guhwm-runtime-")
+    if args.attach and "WAYLAND_DISPLAY" not in env:
+        sys.exit("--attach needs a running Wayland session (WAYLAND_DISPLAY is unset)")
+
+    bus = start_bus(env)
+    compositor, compositor_secs = (None, None)
+    entries = [Entry(cmd, home, i) for i, cmd in enumerate(exec_once_lines(args.config))]
+    try:
+        if not args.attach:
+            compositor, compositor_secs = start_compositor(args.compositor, env, args.timeout)
+        t0 = time.monotonic()
+        for e in entries:
+            e.launch(env)
+        while time.monotonic() - t0 < args.timeout:
+            now = time.monotonic()
+            if all([e.poll(env, now, args.settle) for e in entries]):
+                break
+            time.sleep(POLL)
+        rows = report(entries, t0, compositor_secs)
+        if args.json:
+            Path(args.json).write_text(json.dumps({"compositor": compositor_secs, "entries": rows},
+                                                  indent=2))
+    finally:
+        for e in entries:
+            e.kill()
+        if compositor:
+            os.killpg(compositor.pid, signal.SIGTERM)
+        bus.terminate()
+        shutil.rmtree(home, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
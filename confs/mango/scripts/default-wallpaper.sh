@@ -46,6 +46,13 @@ fi
 # Wait for compositor to fully initialize
 sleep 2
 
+# --- Prefer the copy guhwizard pre-scaled for this output's resolution ---
+SIZE="$(swww query 2>/dev/null | grep -oE '[0-9]+x[0-9]+' | head -n 1 || true)"
+VARIANT="$HOME/.cache/guhwm/wallpapers/$SIZE/$(basename "$WALLPAPER")"
+if [ -n "$SIZE" ] && [ -f "$VARIANT" ]; then
+    WALLPAPER="$VARIANT"
+fi
+
 # --- Set wallpaper with transition animation ---
 echo "--> Setting wallpaper: $WALLPAPER"
 if swww img "$WALLPAPER" \
@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
 import atexit
+import grp
 import json
 import logging
 import os
+import pwd
 import shutil
 import subprocess
 import sys
 import tempfile
 import threading
 import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
 from pathlib import Path
 
 # ─── Colors ───────────────────────────────────────────────────────────────────
@@ -33,57 +39,338 @@ LAST_SELECTION = ""
 SUDO_KEEPALIVE_EVENT = threading.Event()
 TEMP_DIR = ""
 LOG_FILE = ""
+CACHE_DIR = Path.home() / ".cache" / "guhwizard"
+PLAN_MODE = False   # --plan: collect every menu first, install once
+PLAN = None         # {"pkgs": [...], "hooks": [...]} while a plan is being collected
+DB_SYNCED = False   # sync databases already refreshed during this run
+PROFILE = None      # --profile answers, {"menus": {...}, "options": {...}}
+LINK_CONFIGS = False  # --link-configs: symlink ~/.config files to a managed copy
+
+# Exit codes: 0 success, 1 generic failure (network, clone, build, ...)
+EXIT_PROFILE_ERROR = 2
+EXIT_NO_SUDO = 3
+EXIT_COMMAND_FAILED = 4
 
 # ─── State File (idempotency tracker) ─────────────────────────────────────────
 
 STATE_FILE = Path.home() / ".cache" / "guhwizard.state"
 
-def load_state():
-    """Load completed-phase set from disk."""
-    if STATE_FILE.is_file():
-        try:
-            return set(json.loads(STATE_FILE.read_text()))
-        except (json.JSONDecodeError, TypeError):
-            return set()
-    return set()
+def _now():
+    from datetime import datetime
+    return datetime.now().isoformat(timespec="seconds")
+
+class StateStore:
+    """Completed phases and per-step checkpoints, loaded once per run.
+
+    Layout of the state file::
+
+        {"version": 2,
+         "phases":  {phase: {"completed": ts, "steps": {...}}},
+         "steps":   {"phase:step": {"completed": ts, "installed": [...],
+                                    "enabled": [...], "deployed": [...], ...}},
+         "history": {phase: {"completed": ts, "steps": {...}}},
+         "units":   [units queued for apply_units(), not yet enabled],
+         "fingerprint": {"taken": ts, "components": {...}} or None}
+
+    Every change is written atomically (temp file, fsync, rename), so an
+    interrupted run never leaves a truncated file behind.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._load()
+        return self._data
 
-def save_state(state):
-    """Persist completed-phase set to disk."""
-    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-    STATE_FILE.write_text(json.dumps(sorted(state)))
+    def _load(self):
+        data = {"version": 2, "phases": {}, "steps": {}, "history": {}, "units": [],
+                "fingerprint": None}
+        try:
+            raw = json.loads(self.path.read_text())
+        except (OSError, json.JSONDecodeError):
+            return data
+        if isinstance(raw, list):
+            # Version 1: plain list of completed phase names
+            data["phases"] = {p: {"completed": None, "steps": {}} for p in raw}
+        elif isinstance(raw, dict):
+            for key in ("phases", "steps", "history"):
+                data[key] = raw.get(key, {})
+            data["units"] = raw.get("units", [])
+            data["fingerprint"] = raw.get("fingerprint")
+        return data
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name + ".")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.data, f, indent=1, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        dir_fd = os.open(self.path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _fold_steps(self, phase):
+        prefix = phase + ":"
+        steps = {k[len(prefix):]: v for k, v in self.data["steps"].items() if k.startswith(prefix)}
+        for k in steps:
+            del self.data["steps"][prefix + k]
+        return steps
+
+    # ── phases ──
+
+    def is_done(self, phase):
+        return phase in self.data["phases"]
+
+    def mark_done(self, phase):
+        self.data["phases"][phase] = {"completed": _now(), "steps": self._fold_steps(phase)}
+        self.save()
+
+    def reopen(self, phase):
+        """Forget that *phase* completed so the next run redoes it."""
+        if self.data["phases"].pop(phase, None) is not None:
+            self.save()
+
+    def finish(self, phase):
+        """Close out a repeatable phase: keep its steps as history, not as skips."""
+        self.data["history"][phase] = {"completed": _now(), "steps": self._fold_steps(phase)}
+        self.save()
+
+    # ── steps ──
+
+    def step_done(self, phase, step):
+        return f"{phase}:{step}" in self.data["steps"]
+
+    def checkpoint(self, phase, step, installed=(), enabled=(), deployed=(), **extra):
+        """Record that *step* of *phase* finished and what it changed."""
+        self.data["steps"][f"{phase}:{step}"] = {
+            "completed": _now(),
+            "installed": list(installed),
+            "enabled": list(enabled),
+            "deployed": list(deployed),
+            **extra,
+        }
+        self.save()
+
+STATE = StateStore(STATE_FILE)
 
 def mark_done(phase):
     """Mark a phase as completed."""
-    state = load_state()
-    state.add(phase)
-    save_state(state)
+    STATE.mark_done(phase)
 
 def is_done(phase):
     """Check whether a phase was already completed."""
-    return phase in load_state()
+    return STATE.is_done(phase)
+
+def checkpoint(phase, step, **record):
+    """Record a finished step inside *phase* (see StateStore.checkpoint)."""
+    STATE.checkpoint(phase, step, **record)
+
+def step_done(phase, step):
+    """Check whether *step* of an interrupted *phase* already finished."""
+    if STATE.step_done(phase, step):
+        print(f"{GRN}[OK] {step} already done in a previous run. Skipping...{NC}")
+        return True
+    return False
+
+# ─── Package database index ──────────────────────────────────────────────────
+
+PACMAN_DB_PATH = Path("/var/lib/pacman")
+PACMAN_CONF = Path("/etc/pacman.conf")
+
+def _parse_desc(text):
+    """Parse a pacman ``desc`` file into a {FIELD: [values]} dict."""
+    fields = {}
+    key = None
+    for line in text.splitlines():
+        if line.startswith("%") and line.endswith("%"):
+            key = line.strip("%")
+            fields[key] = []
+        elif line and key:
+            fields[key].append(line)
+    return fields
+
+def _strip_constraint(dep):
+    """Return the bare package name of a dependency like ``foo>=1.2``."""
+    for op in (">=", "<=", "=", ">", "<"):
+        dep = dep.split(op, 1)[0]
+    return dep.strip()
+
+class PackageIndex:
+    """In-memory view of the local and sync pacman databases.
+
+    Built once by reading ``local/`` and ``sync/*.db`` directly instead of
+    spawning ``pacman -Qq`` / ``pacman -Sp`` per package. Each side is
+    reloaded on its own when pacman touches it (mtime change); the local
+    side also explicitly after every transaction via invalidate().
+    """
+
+    def __init__(self, dbpath=PACMAN_DB_PATH):
+        self.dbpath = Path(dbpath)
+        self.installed = {}   # name -> version
+        self.local_provides = None  # provided name -> installed package, read on demand
+        self.sync = {}        # name -> {"repo", "version", "csize", "isize", "depends"}
+        self.provides = {}    # provided name -> real sync package name
+        self._local_stamp = None
+        self._sync_stamp = None
+
+    # ── loading ──
+
+    @staticmethod
+    def _stamp_of(paths):
+        stamp = []
+        for p in paths:
+            try:
+                stamp.append((str(p), p.stat().st_mtime_ns))
+            except OSError:
+                pass
+        return tuple(stamp)
+
+    def _load_local(self):
+        self.installed = {}
+        self.local_provides = None
+        local = self.dbpath / "local"
+        if not local.is_dir():
+            return
+        for entry in os.scandir(local):
+            # Entries are "<name>-<pkgver>-<pkgrel>"; names may contain dashes
+            parts = entry.name.rsplit("-", 2)
+            if entry.is_dir() and len(parts) == 3:
+                self.installed[parts[0]] = f"{parts[1]}-{parts[2]}"
+
+    def _load_local_provides(self):
+        self.local_provides = {}
+        for name, version in self.installed.items():
+            try:
+                text = (self.dbpath / "local" / f"{name}-{version}" / "desc").read_text(errors="replace")
+            except OSError:
+                continue
+            for prov in _parse_desc(text).get("PROVIDES", []):
+                self.local_provides.setdefault(_strip_constraint(prov), name)
+
+    def _load_sync_db(self, db):
+        import tarfile
+        repo = db.stem
+        with tarfile.open(db, "r:*") as tar:
+            for member in tar:
+                if not member.isfile() or not member.name.endswith("/desc"):
+                    continue
+                desc = _parse_desc(tar.extractfile(member).read().decode("utf-8", "replace"))
+                name = desc.get("NAME", [""])[0]
+                if not name or name in self.sync:
+                    continue  # first repo in pacman.conf order wins
+                self.sync[name] = {
+                    "repo": repo,
+                    "version": desc.get("VERSION", [""])[0],
+                    "csize": int(desc.get("CSIZE", ["0"])[0]),
+                    "isize": int(desc.get("ISIZE", ["0"])[0]),
+                    "depends": [_strip_constraint(d) for d in desc.get("DEPENDS", [])],
+                }
+                for prov in desc.get("PROVIDES", []):
+                    self.provides.setdefault(_strip_constraint(prov), name)
+
+    def _sync_repo_order(self):
+        """Return sync DB paths in pacman.conf order (falls back to glob order)."""
+        dbs = {p.stem: p for p in (self.dbpath / "sync").glob("*.db")}
+        ordered = []
+        try:
+            for line in PACMAN_CONF.read_text().splitlines():
+                line = line.strip()
+                if line.startswith("[") and line.endswith("]") and line[1:-1] in dbs:
+                    ordered.append(dbs.pop(line[1:-1]))
+        except OSError:
+            pass
+        return ordered + sorted(dbs.values())
+
+    def _load_sync(self):
+        self.sync = {}
+        self.provides = {}
+        for db in self._sync_repo_order():
+            try:
+                self._load_sync_db(db)
+            except Exception:
+                # Unreadable archive (e.g. zstd DB): one `pacman -Sl` covers all repos
+                self._load_sync_fallback()
+                return
+
+    def _load_sync_fallback(self):
+        self.sync = {}
+        self.provides = {}
+        result = run(["pacman", "-Sl"], capture_output=True, text=True, check=False)
+        for line in result.stdout.splitlines():
+            parts = line.split()
+            if len(parts) >= 3 and parts[1] not in self.sync:
+                self.sync[parts[1]] = {"repo": parts[0], "version": parts[2],
+                                       "csize": 0, "isize": 0, "depends": []}
+
+    def refresh(self):
+        """(Re)load whichever database pacman has changed since the last load."""
+        local = self._stamp_of([self.dbpath / "local"])
+        if local != self._local_stamp:
+            self._load_local()
+            self._local_stamp = local
+        sync = self._stamp_of(sorted((self.dbpath / "sync").glob("*.db")))
+        if sync != self._sync_stamp:
+            self._load_sync()
+            self._sync_stamp = sync
+
+    def invalidate(self):
+        """Force a reload of the local database on the next query.
+
+        The sync databases are only rewritten by a refresh, which always
+        changes their mtime.
+        """
+        self._local_stamp = None
+
+    # ── queries ──
+
+    def is_installed(self, pkg):
+        self.refresh()
+        return pkg in self.installed
+
+    def is_satisfied(self, dep):
+        """True if *dep* is installed, or provided by an installed package."""
+        self.refresh()
+        if dep in self.installed:
+            return True
+        if self.local_provides is None:
+            self._load_local_provides()
+        return dep in self.local_provides
+
+    def repo_of(self, pkg):
+        """Return the sync repo that provides *pkg*, or None (AUR / unknown)."""
+        self.refresh()
+        name = pkg if pkg in self.sync else self.provides.get(pkg)
+        return self.sync[name]["repo"] if name else None
+
+    def version_of(self, pkg):
+        """Return (installed_version, sync_version); either may be None."""
+        self.refresh()
+        sync = self.sync.get(pkg)
+        return self.installed.get(pkg), sync["version"] if sync else None
+
+PKG_INDEX = PackageIndex()
 
 # ─── Package query helpers ────────────────────────────────────────────────────
 
 def is_pkg_installed(pkg):
-    """Return True if *pkg* is already installed (pacman -Qq)."""
-    return subprocess.run(
-        ["pacman", "-Qq", pkg],
-        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-    ).returncode == 0
-
-def is_service_enabled(unit):
-    """Return True if a systemd unit is already enabled."""
-    return subprocess.run(
-        ["systemctl", "is-enabled", unit],
-        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-    ).returncode == 0
-
-def is_user_service_enabled(unit):
-    """Return True if a user-level systemd unit is already enabled."""
-    return subprocess.run(
-        ["systemctl", "--user", "is-enabled", unit],
-        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-    ).returncode == 0
+    """Return True if *pkg* is already installed (local pacman DB)."""
+    return PKG_INDEX.is_installed(pkg)
+
+def is_pkg_in_repos(pkg):
+    """Return True if *pkg* is available from a sync repository."""
+    return PKG_INDEX.repo_of(pkg) is not None
 
 # ─── Redirect stdin when piped ────────────────────────────────────────────────
 
@@ -96,59 +383,231 @@ def redirect_stdin():
             print(f"{RED}[!] Cannot open /dev/tty for interactive input.{NC}")
             sys.exit(1)
 
+# ─── Unattended Profile (--profile) ──────────────────────────────────────────
+
+MENU_TITLES = ("AUR Helpers", "Shells", "Terminals", "Browsers", "Chat Clients",
+               "File Managers", "Editors", "Graphics", "Media", "PDF Readers",
+               "Office Suites", "Utilities", "Emulators", "Display Manager")
+
+def load_profile(path):
+    """Load an answer file that pre-answers every menu.
+
+    Example::
+
+        [options]
+        plan = true      # one combined transaction
+        reboot = false
+
+        [menus]
+        "AUR Helpers" = "yay"
+        Shells = "zsh"
+        Browsers = ["firefox", "lynx"]
+        "Display Manager" = "ly"
+
+    Menus are keyed by their title (see MENU_TITLES), answers are package
+    or display names. Menus missing from the file are skipped; an unknown
+    title is an error so a typo cannot silently drop a menu.
+    """
+    try:
+        import tomllib
+    except ImportError:
+        print(f"{RED}[!] --profile needs Python 3.11+ (tomllib).{NC}")
+        sys.exit(EXIT_PROFILE_ERROR)
+    try:
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        print(f"{RED}[!] Cannot read profile {path}: {e}{NC}")
+        sys.exit(EXIT_PROFILE_ERROR)
+    profile = {"menus": data.get("menus", {}), "options": data.get("options", {})}
+    for title, answer in profile["menus"].items():
+        if title not in MENU_TITLES:
+            print(f"{RED}[!] Profile: unknown menu '{title}'. "
+                  f"Known menus: {', '.join(MENU_TITLES)}.{NC}")
+            sys.exit(EXIT_PROFILE_ERROR)
+        if not isinstance(answer, (str, list)):
+            print(f"{RED}[!] Profile: answer for '{title}' must be a name or a list of names.{NC}")
+            sys.exit(EXIT_PROFILE_ERROR)
+    return profile
+
+def profile_answer(title, mode, options):
+    """Translate the profile's answer for menu *title* into menu numbers."""
+    answer = PROFILE["menus"].get(title, [])
+    names = [answer] if isinstance(answer, str) else answer
+    names = [n for n in names if n and n.lower() != "none"]
+    if mode == "single" and len(names) > 1:
+        print(f"{RED}[!] Profile: '{title}' takes a single answer, got {names}.{NC}")
+        sys.exit(EXIT_PROFILE_ERROR)
+    picks = []
+    for n in names:
+        for i, (_, name, pkg, _) in enumerate(options, 1):
+            if n.lower() in (name.lower(), pkg.lower()):
+                picks.append(str(i))
+                break
+        else:
+            valid = ", ".join(pkg for _, _, pkg, _ in options)
+            print(f"{RED}[!] Profile: '{n}' is not an option of '{title}' ({valid}).{NC}")
+            sys.exit(EXIT_PROFILE_ERROR)
+    return " ".join(picks) or "0"
+
+def pause(msg=""):
+    """"Press Enter" gate; only prints *msg* when running unattended."""
+    if PROFILE is None:
+        input(f"{YLW}==> {msg}Press Enter to continue...{NC}")
+    elif msg:
+        print(f"{YLW}==> {msg.strip()}{NC}")
+
+def ask(prompt, default):
+    """Ask a yes/no style question; *default* answers it when unattended."""
+    if PROFILE is None:
+        return input(prompt)
+    print(f"{prompt}{default}")
+    return default
+
 # ─── Logging ──────────────────────────────────────────────────────────────────
 
-class TeeHandler(logging.Handler):
-    """Logging handler that writes to both a file and stdout (like tee)."""
-    def __init__(self, filepath):
-        super().__init__()
-        self.filepath = filepath
-        self.file = open(filepath, "a")
+LOG_KEEP = 5                 # rotated logs kept as guhwizard.log.N.gz
+LOG_QUEUE_MAX = 4096         # chunks buffered before writers block
+LOG_FLUSH_SECS = 0.5
+LOG_WRITER = None
 
-    def emit(self, record):
-        msg = self.format(record)
-        self.file.write(msg + "\n")
-        self.file.flush()
+class LogWriter:
+    """Single background writer for guhwizard.log.
 
-    def close(self):
+    Producers (the wizard's own stdout/stderr, logging, and child output
+    captured by run()) only enqueue; the thread splits chunks into lines,
+    drops colour codes and progress-bar redraws, prefixes each line with
+    time, phase and command, and flushes at most every LOG_FLUSH_SECS.
+    The queue is bounded, so a burst of output blocks briefly instead of
+    growing memory.
+    """
+    ANSI = None
+
+    def __init__(self, path):
+        import queue
+        import re
+        LogWriter.ANSI = re.compile(r"\x1b(\[[0-9;?]*[ -/]*[@-~]|\][^\x07]*\x07|[()][0-9A-B]|[=>])")
+        self.file = open(path, "a", buffering=1 << 16)
+        self.queue = queue.Queue(maxsize=LOG_QUEUE_MAX)
+        self.partial = {}
+        self.thread = threading.Thread(target=self._loop, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, source, data):
+        """Queue *data* (str or bytes) produced by *source* during the current phase.
+
+        Blocks while the queue is full, but gives up (dropping *data*) once
+        the writer thread has died, so producers never hang on it.
+        """
+        import queue
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", "replace")
+        item = (time.time(), CURRENT_PHASE, source, data)
+        while self.thread.is_alive():
+            try:
+                self.queue.put(item, timeout=LOG_FLUSH_SECS)
+                return
+            except queue.Full:
+                pass
+
+    def _line(self, stamp, phase, source, line):
+        # pty lines end in \r\n; any other \r is a progress-bar redraw: keep the last one
+        line = self.ANSI.sub("", line).rstrip("\r").rsplit("\r", 1)[-1].rstrip()
+        if line:
+            clock = time.strftime("%H:%M:%S", time.localtime(stamp))
+            self.file.write(f"{clock} [{phase}] [{source}] {line}\n")
+
+    def _loop(self):
+        import queue
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=LOG_FLUSH_SECS)
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            if item:
+                stamp, phase, source, data = item
+                lines = (self.partial.pop(source, "") + data).split("\n")
+                if lines[-1]:
+                    self.partial[source] = lines[-1]
+                for line in lines[:-1]:
+                    self._line(stamp, phase, source, line)
+            if self.queue.empty() or time.monotonic() - last_flush > LOG_FLUSH_SECS:
+                self.file.flush()
+                last_flush = time.monotonic()
+        for source, rest in self.partial.items():
+            self._line(time.time(), CURRENT_PHASE, source, rest)
         self.file.close()
-        super().close()
 
-def setup_logging():
-    global LOG_FILE
-    cache_dir = Path.home() / ".cache"
-    cache_dir.mkdir(parents=True, exist_ok=True)
-    LOG_FILE = str(cache_dir / "guhwizard.log")
+    def close(self):
+        import queue
+        while self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=LOG_FLUSH_SECS)
+                break
+            except queue.Full:
+                pass
+        self.thread.join(timeout=5)
 
-    tee = TeeHandler(LOG_FILE)
-    tee.setFormatter(logging.Formatter("%(message)s"))
-    logging.root.addHandler(tee)
-    logging.root.setLevel(logging.INFO)
+class LogStream:
+    """sys.stdout/sys.stderr replacement: terminal output unchanged, copy to the log."""
+    def __init__(self, original, source):
+        self.original = original
+        self.source = source
 
-    log_file_handle = open(LOG_FILE, "a")
+    def write(self, data):
+        self.original.write(data)
+        LOG_WRITER.write(self.source, data)
+        return len(data)
 
-    class TeeStream:
-        def __init__(self, original):
-            self.original = original
-            self.log = log_file_handle
+    def flush(self):
+        self.original.flush()
 
-        def write(self, data):
-            self.original.write(data)
-            self.log.write(data)
-            self.log.flush()
+    def fileno(self):
+        return self.original.fileno()
 
-        def flush(self):
-            self.original.flush()
-            self.log.flush()
+    def isatty(self):
+        return self.original.isatty()
 
-        def fileno(self):
-            return self.original.fileno()
+class LogWriterHandler(logging.Handler):
+    """logging handler feeding the shared LogWriter."""
+    def emit(self, record):
+        LOG_WRITER.write("log", self.format(record) + "\n")
 
-        def isatty(self):
-            return self.original.isatty()
+def rotate_logs(path):
+    """Shift guhwizard.log → .1.gz → .2.gz ..., keeping LOG_KEEP compressed copies."""
+    import gzip
+    path = Path(path)
+    if not path.is_file() or path.stat().st_size == 0:
+        return
+    oldest = path.with_name(f"{path.name}.{LOG_KEEP}.gz")
+    oldest.unlink(missing_ok=True)
+    for n in range(LOG_KEEP - 1, 0, -1):
+        older = path.with_name(f"{path.name}.{n}.gz")
+        if older.exists():
+            older.rename(path.with_name(f"{path.name}.{n + 1}.gz"))
+    with open(path, "rb") as src, gzip.open(path.with_name(f"{path.name}.1.gz"), "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    path.unlink()
 
-    sys.stdout = TeeStream(sys.__stdout__)
-    sys.stderr = TeeStream(sys.__stderr__)
+def setup_logging():
+    global LOG_FILE, LOG_WRITER
+    cache_dir = Path.home() / ".cache"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    LOG_FILE = str(cache_dir / "guhwizard.log")
+    rotate_logs(LOG_FILE)
+
+    LOG_WRITER = LogWriter(LOG_FILE)
+    atexit.register(LOG_WRITER.close)
+    handler = LogWriterHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.root.addHandler(handler)
+    logging.root.setLevel(logging.INFO)
+
+    sys.stdout = LogStream(sys.__stdout__, "guhwizard")
+    sys.stderr = LogStream(sys.__stderr__, "guhwizard")
 
     from datetime import datetime
     print(f"[{datetime.now()}]")
@@ -161,22 +620,33 @@ def check_root():
         print(f"{RED}==> AUR helpers cannot be built as root. "
               f"Please log in as a normal user with sudo privileges.{NC}")
         sys.exit(1)
+    # --root installs into an existing system (e.g. made by pacstrap), never /
+    if TARGET_ROOT is not None and not (target_path(PACMAN_DB_PATH) / "local").is_dir():
+        print(f"{RED}[!] {TARGET_ROOT} has no pacman database. "
+              f"Create the base system first, e.g. pacstrap -K {TARGET_ROOT} base{NC}")
+        sys.exit(1)
 
 # ─── Sudo Check ──────────────────────────────────────────────────────────────
 
 def check_sudo():
-    result = subprocess.run(["sudo", "-v"])
+    # Unattended runs cannot answer a password prompt: require cached/NOPASSWD sudo
+    cmd = ["sudo", "-v"] if PROFILE is None else ["sudo", "-n", "-v"]
+    result = run(cmd, check=False)
     if result.returncode != 0:
         print(f"{RED}[!] Please ensure you have sudo privileges "
               f"before running this script.{NC}")
-        sys.exit(1)
+        sys.exit(1 if PROFILE is None else EXIT_NO_SUDO)
+    if TARGET_ROOT is not None and run(["sudo", "-n", "test", "-w", str(TARGET_ROOT)],
+                                       check=False).returncode != 0:
+        print(f"{RED}[!] {TARGET_ROOT} is not writable, even with sudo.{NC}")
+        sys.exit(1 if PROFILE is None else EXIT_NO_SUDO)
 
 # ─── Sudo keep-alive ─────────────────────────────────────────────────────────
 
 def _sudo_keepalive_loop():
     while not SUDO_KEEPALIVE_EVENT.is_set():
-        subprocess.run(["sudo", "-n", "true"],
-                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        run(["sudo", "-n", "true"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
         SUDO_KEEPALIVE_EVENT.wait(60)
 
 def start_sudo_keepalive():
@@ -194,33 +664,466 @@ def cleanup():
     if TEMP_DIR and os.path.isdir(TEMP_DIR):
         shutil.rmtree(TEMP_DIR, ignore_errors=True)
 
+# ─── Target Root (--root) ────────────────────────────────────────────────────
+
+TARGET_ROOT = None      # --root: provision this sysroot instead of the running system
+_ON_HOST = False        # inside on_host(): commands act on the running system
+HOST_PKG_INDEX = PKG_INDEX
+
+def target_path(path):
+    """*path* (absolute, as seen inside the target) on the build host."""
+    if TARGET_ROOT is None:
+        return Path(path)
+    return TARGET_ROOT / Path(path).relative_to("/")
+
+def image_path(path):
+    """*path* on the build host as seen from inside TARGET_ROOT."""
+    if TARGET_ROOT is None:
+        return Path(path)
+    return Path("/") / Path(path).relative_to(TARGET_ROOT)
+
+def target_home():
+    """The user's home directory in the system being provisioned."""
+    return target_path(Path.home())
+
+@contextmanager
+def on_host():
+    """Run the enclosed commands against the build host even under --root.
+
+    Used for build tooling (base-devel, the AUR helper) that the image
+    does not need but makepkg on the host does.
+    """
+    global _ON_HOST, PKG_INDEX
+    saved = _ON_HOST, PKG_INDEX
+    _ON_HOST, PKG_INDEX = True, HOST_PKG_INDEX
+    try:
+        yield
+    finally:
+        _ON_HOST, PKG_INDEX = saved
+
+def _rooted(cmd):
+    """Point the pacman, systemctl or usermod call *cmd* at TARGET_ROOT.
+
+    The flags are appended, so argv[1] stays the operation for the run log.
+    """
+    if TARGET_ROOT is None or _ON_HOST or not isinstance(cmd, list):
+        return cmd
+    argv = cmd[1:] if cmd[:1] == ["sudo"] else cmd
+    tool = os.path.basename(str(argv[0])) if argv else ""
+    if tool == "pacman":
+        return cmd + ["--root", str(TARGET_ROOT)]
+    if tool == "systemctl":
+        # Per-user units cannot be enabled offline; enable them for every user
+        scope = ["--global"] if "--user" in cmd else []
+        return [c for c in cmd if c != "--user"] + [f"--root={TARGET_ROOT}"] + scope
+    if tool == "usermod":
+        return cmd + ["--root", str(TARGET_ROOT)]
+    return cmd
+
+def set_target_root(root):
+    """Switch every system-facing path and the state to the sysroot *root*."""
+    global TARGET_ROOT, PKG_INDEX, STATE, DEPLOY_MANIFEST, TEMPLATE_VARS_FILE
+    global GUHWM_SHARE, TEMPLATE_DIR, WALLPAPER_OUT, WAL_CACHE
+    TARGET_ROOT = Path(root).resolve()
+    # Each image keeps its own state and manifests, apart from the host's
+    cache = CACHE_DIR / "roots" / (str(TARGET_ROOT).strip("/").replace("/", "_") or "root")
+    STATE = StateStore(cache / "guhwizard.state")
+    DEPLOY_MANIFEST = cache / "deploy-manifest.json"
+    TEMPLATE_VARS_FILE = cache / "template-vars.json"
+    PKG_INDEX = PackageIndex(target_path(PACMAN_DB_PATH))
+    GUHWM_SHARE = target_home() / ".local" / "share" / "guhwm"
+    TEMPLATE_DIR = GUHWM_SHARE / "templates"
+    WALLPAPER_OUT = target_home() / ".cache" / "guhwm"
+    WAL_CACHE = target_home() / ".cache" / "wal"
+
+def prepare_target():
+    """Create the user's home in TARGET_ROOT, owned by the same uid/gid as here."""
+    home = target_home()
+    if home.is_dir() and os.access(home, os.W_OK):
+        return
+    print(f"{GRA}--> Creating {home}...{NC}")
+    run(["sudo", "install", "-d", "-o", str(os.getuid()), "-g", str(os.getgid()), str(home)])
+
 # ─── Run helper ──────────────────────────────────────────────────────────────
 
+PKG_TX_COMMANDS = {"pacman", "makepkg", "yay", "paru", "pikaur"}
+_PACMAN_QUERY_FLAGS = set("silpgc")     # -Si, -Ss, -Sl, -Sp, -Sg, -Sc install nothing
+_PACMAN_LONG_OPS = {"--sync": "S", "--upgrade": "U", "--remove": "R"}
+_MAKEPKG_INSTALLS = set("sir")          # --syncdeps, --install, --rmdeps
+
+def _changes_local_db(cmd):
+    """True if *cmd* is a package transaction that may change the local DB.
+
+    Read-only calls (``pacman -Q``/``-Sl``, ``makepkg --packagelist``,
+    ``yay --version``) leave the index alone.
+    """
+    argv = _argv(cmd)
+    if argv[0] == "sudo":
+        argv = argv[1:]
+    tool = os.path.basename(argv[0]) if argv else ""
+    if tool not in PKG_TX_COMMANDS:
+        return False
+    short = "".join(a[1:] for a in argv[1:] if a.startswith("-") and not a.startswith("--"))
+    longs = {a.split("=", 1)[0] for a in argv[1:] if a.startswith("--")}
+    if tool == "makepkg":
+        return bool(_MAKEPKG_INSTALLS & set(short)) or \
+            bool({"--syncdeps", "--install", "--rmdeps"} & longs)
+    ops = set(short) & set("SUR") | {_PACMAN_LONG_OPS[a] for a in longs & _PACMAN_LONG_OPS.keys()}
+    if ops != {"S"}:
+        return bool(ops)        # -U and -R always change it
+    queries = _PACMAN_QUERY_FLAGS & set(short) or \
+        {"--search", "--info", "--list", "--print", "--groups", "--clean"} & longs
+    return not queries
+
+_REDIRECTS = {"stdout", "stderr", "capture_output", "input"}
+
+def _command_label(cmd):
+    argv = _argv(cmd)
+    if argv[0] == "sudo" and len(argv) > 1:
+        argv = argv[1:]
+    return os.path.basename(argv[0])
+
+def _run_logged(cmd, **kwargs):
+    """Run *cmd* with its output relayed to the terminal and copied to the log.
+
+    On a terminal the child gets a pty sized like ours, so colours and
+    progress bars look exactly as they would without capture.
+    """
+    import pty
+    import select
+    timeout = kwargs.pop("timeout", None)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    tty = sys.__stdout__.isatty()
+    if tty:
+        master, slave = pty.openpty()
+        try:
+            import fcntl
+            import termios
+            size = fcntl.ioctl(sys.__stdout__.fileno(), termios.TIOCGWINSZ, b"\0" * 8)
+            fcntl.ioctl(slave, termios.TIOCSWINSZ, size)
+        except OSError:
+            pass
+    else:
+        master, slave = os.pipe()
+    try:
+        proc = subprocess.Popen(cmd, stdout=slave, stderr=slave, **kwargs)
+    finally:
+        os.close(slave)
+    import codecs
+    source = _command_label(cmd)
+    # Reads can end mid-character; the decoder carries the partial sequence
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    sys.stdout.flush()
+    out = sys.__stdout__.buffer
+    try:
+        while True:
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0 or not select.select([master], [], [], left)[0]:
+                    proc.kill()
+                    proc.wait()
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+            try:
+                chunk = os.read(master, 1 << 16)
+            except OSError:         # EIO: the pty closed with the child
+                break
+            if not chunk:
+                break
+            out.write(chunk)
+            out.flush()
+            LOG_WRITER.write(source, decoder.decode(chunk))
+    finally:
+        os.close(master)
+        LOG_WRITER.write(source, decoder.decode(b"", final=True))
+    left = None if deadline is None else max(deadline - time.monotonic(), 0)
+    try:
+        return subprocess.CompletedProcess(cmd, proc.wait(left))
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+        raise
+
 def run(cmd, check=True, **kwargs):
-    return subprocess.run(cmd, check=check, **kwargs)
+    """Run an external command. Every process the wizard starts goes through here.
+
+    Output not redirected by the caller is captured into guhwizard.log;
+    under --root, pacman, systemctl and usermod act on the target root.
+    """
+    cmd = _rooted(cmd)
+    start = time.time()
+    rc = None
+    try:
+        if LOG_WRITER and not _REDIRECTS & kwargs.keys():
+            result = _run_logged(cmd, **kwargs)
+            if check and result.returncode:
+                raise subprocess.CalledProcessError(result.returncode, cmd)
+        else:
+            result = subprocess.run(cmd, check=check, **kwargs)
+        rc = result.returncode
+        return result
+    except subprocess.CalledProcessError as e:
+        rc = e.returncode
+        raise
+    except OSError:
+        rc = 127
+        raise
+    finally:
+        record_command(cmd, start, time.time() - start, rc, kwargs.get("cwd"))
+        # A pacman/makepkg/AUR transaction may have changed the local DB
+        if isinstance(cmd, list) and _changes_local_db(cmd):
+            PKG_INDEX.invalidate()
+
+# ─── Run History ─────────────────────────────────────────────────────────────
+
+HISTORY_FILE = CACHE_DIR / "history.jsonl"
+HISTORY_REPORT_RUNS = 50       # runs considered by --report
+REGRESSION_RATIO = 1.25        # flag when the last run is this much slower...
+REGRESSION_MIN_SECS = 2.0      # ...and at least this many seconds slower
+
+CURRENT_PHASE = "startup"
+RUN_LOG = {"started": time.time(), "phases": {}, "phase_spans": [], "commands": [],
+           "transactions": [], "packages": {}}
+_RUN_LOG_LOCK = threading.Lock()
+
+def _argv(cmd):
+    return [str(c) for c in cmd] if isinstance(cmd, (list, tuple)) else [str(cmd)]
+
+def _transaction(argv, cwd=None):
+    """Return (kind, pkgs) if *argv* installs packages, else None."""
+    if argv and argv[0] == "sudo":
+        argv = argv[1:]
+    if len(argv) < 2:
+        return None
+    tool, op = os.path.basename(argv[0]), argv[1]
+    pkgs = [a for a in argv[2:] if not a.startswith("-")]
+    if tool == "pacman" and op.startswith("-S") and pkgs:
+        return "repo", pkgs
+    if tool == "pacman" and op == "-U":
+        return "local", [os.path.basename(p) for p in pkgs]
+    if tool in ("yay", "paru", "pikaur") and op.startswith("-S") and pkgs:
+        return "aur", pkgs
+    if tool == "makepkg" and not op.startswith("--packagelist"):
+        return "build", [os.path.basename(cwd or os.getcwd())]
+    return None
+
+def record_command(cmd, start, secs, rc, cwd=None):
+    """Add one finished external command to this run's log."""
+    argv = _argv(cmd)
+    entry = {"argv": argv, "phase": CURRENT_PHASE, "start": round(start - RUN_LOG["started"], 3),
+             "secs": round(secs, 3), "rc": rc, "thread": threading.current_thread().name}
+    tx = _transaction(argv, cwd)
+    with _RUN_LOG_LOCK:
+        RUN_LOG["commands"].append(entry)
+        if tx:
+            RUN_LOG["transactions"].append({"kind": tx[0], "pkgs": tx[1], "phase": CURRENT_PHASE,
+                                            "secs": entry["secs"], "rc": rc})
+
+def record_package(pkg, secs, rc, kind):
+    """Record the wall time spent producing a single package (e.g. an AUR build)."""
+    with _RUN_LOG_LOCK:
+        RUN_LOG["packages"][pkg] = {"kind": kind, "secs": round(secs, 3), "rc": rc}
+
+@contextmanager
+def phase(name):
+    """Time one top-level installer phase and tag commands run inside it."""
+    global CURRENT_PHASE
+    parent, CURRENT_PHASE = CURRENT_PHASE, name
+    start = time.time()
+    try:
+        yield
+    finally:
+        secs = round(time.time() - start, 3)
+        RUN_LOG["phases"][name] = secs
+        RUN_LOG["phase_spans"].append({"name": name, "parent": parent, "secs": secs,
+                                       "start": round(start - RUN_LOG["started"], 3)})
+        CURRENT_PHASE = parent
+
+def save_history(exit_code):
+    """Append this run's timings to the history file."""
+    record = dict(RUN_LOG, exit=exit_code, total=round(time.time() - RUN_LOG["started"], 3))
+    try:
+        HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(HISTORY_FILE, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"{ORA}[!] Could not write run history: {e}{NC}")
+
+def write_trace(path):
+    """Export this run as Chrome/Perfetto trace events (open in ui.perfetto.dev).
+
+    Phases are drawn on their own track; every external command is a
+    complete event on the track of the thread that started it.
+    """
+    pid = os.getpid()
+    tids = {"phases": 0, "MainThread": 1}
+    events = []
+    for span in RUN_LOG["phase_spans"]:
+        events.append({"name": span["name"], "cat": "phase", "ph": "X", "pid": pid, "tid": 0,
+                       "ts": int(span["start"] * 1e6), "dur": int(span["secs"] * 1e6),
+                       "args": {"parent": span["parent"]}})
+    for c in RUN_LOG["commands"]:
+        tid = tids.setdefault(c["thread"], len(tids))
+        argv = c["argv"][1:] if c["argv"][0] == "sudo" and len(c["argv"]) > 1 else c["argv"]
+        events.append({"name": os.path.basename(argv[0].split()[0]), "cat": c["phase"], "ph": "X",
+                       "pid": pid, "tid": tid, "ts": int(c["start"] * 1e6),
+                       "dur": max(1, int(c["secs"] * 1e6)),
+                       "args": {"argv": c["argv"], "phase": c["phase"], "exit_code": c["rc"]}})
+    events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "guhwizard"}})
+    for name, tid in tids.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                       "args": {"name": name}})
+    try:
+        Path(path).write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+        print(f"{GRA}--> Trace written to {path}{NC}")
+    except OSError as e:
+        print(f"{ORA}[!] Could not write trace {path}: {e}{NC}")
+
+def load_history():
+    runs = []
+    try:
+        with open(HISTORY_FILE) as f:
+            for line in f:
+                try:
+                    runs.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except OSError:
+        pass
+    return runs[-HISTORY_REPORT_RUNS:]
+
+def percentile(values, pct):
+    """Nearest-rank percentile of *values*."""
+    ordered = sorted(values)
+    idx = max(0, min(len(ordered) - 1, -(-pct * len(ordered) // 100) - 1))
+    return ordered[int(idx)]
+
+def _report_table(title, series):
+    """Print p50/p90/max per key and flag regressions of the last run."""
+    print(f"{YLW}==> {title}{NC}")
+    print(f"{GRA}{'':<28}{'runs':>5}{'p50':>9}{'p90':>9}{'max':>9}{'last':>9}{'prev':>9}{NC}")
+    for key, values in sorted(series.items()):
+        last = values[-1]
+        prev = values[-2] if len(values) > 1 else None
+        flag = ""
+        if prev is not None and last > prev * REGRESSION_RATIO and last - prev >= REGRESSION_MIN_SECS:
+            flag = f" {RED}REGRESSION (+{last - prev:.1f}s){NC}"
+        prev_s = f"{prev:>9.1f}" if prev is not None else f"{'-':>9}"
+        print(f"{key[:27]:<28}{len(values):>5}{percentile(values, 50):>9.1f}"
+              f"{percentile(values, 90):>9.1f}{max(values):>9.1f}{last:>9.1f}{prev_s}{flag}")
+    print()
+
+def show_report():
+    """Summarise recorded runs: percentiles per phase/package, regressions vs previous run."""
+    runs = load_history()
+    if not runs:
+        print(f"{ORA}[!] No run history in {HISTORY_FILE} yet.{NC}")
+        return 1
+
+    from datetime import datetime
+    last = runs[-1]
+    started = datetime.fromtimestamp(last["started"]).isoformat(timespec="seconds")
+    print(f"{YLW}==> guhwizard run history: {len(runs)} run(s), last at {started} "
+          f"(exit {last.get('exit')}, {last.get('total', 0):.1f}s){NC}")
+    print()
+
+    totals = {"total": [r.get("total", 0) for r in runs]}
+    _report_table("Total wall time (s)", totals)
+
+    phases = {}
+    for r in runs:
+        for name, secs in r.get("phases", {}).items():
+            phases.setdefault(name, []).append(secs)
+    _report_table("Phases (s)", phases)
+
+    tx_kinds = {}
+    for r in runs:
+        per_run = {}
+        for tx in r.get("transactions", []):
+            per_run[tx["kind"]] = per_run.get(tx["kind"], 0) + tx["secs"]
+        for kind, secs in per_run.items():
+            tx_kinds.setdefault(kind, []).append(secs)
+    _report_table("Transactions by kind (s per run)", tx_kinds)
+
+    packages = {}
+    for r in runs:
+        for pkg, rec in r.get("packages", {}).items():
+            packages.setdefault(pkg, []).append(rec["secs"])
+    if packages:
+        _report_table("Package builds (s)", packages)
+
+    slowest = sorted(last.get("commands", []), key=lambda c: c["secs"], reverse=True)[:10]
+    print(f"{YLW}==> Slowest commands in the last run{NC}")
+    for c in slowest:
+        rc = f"{RED}rc={c['rc']}{NC}" if c["rc"] else f"{GRA}rc={c['rc']}{NC}"
+        print(f"{c['secs']:>8.1f}s  {GRA}[{c['phase']}]{NC} {' '.join(c['argv'])[:90]} {rc}")
+    return 0
 
 # ─── User Group Setup ────────────────────────────────────────────────────────
 
+USER_GROUPS = ["seat", "video", "audio", "render", "dbus"]
+_GROUP_MEMO = {}    # user -> set of group names, cleared when we add groups
+
+def current_user():
+    """Name of the invoking user (works without a controlling terminal)."""
+    return os.environ.get("USER") or pwd.getpwuid(os.getuid()).pw_name
+
+def _read_db(name):
+    """Rows of /etc/*name* (passwd, group) inside TARGET_ROOT, split on ':'."""
+    try:
+        text = target_path(f"/etc/{name}").read_text()
+    except OSError:
+        return []
+    return [line.split(":") for line in text.splitlines() if line.count(":") >= 3]
+
+def user_entry(user):
+    """Return (gid, shell) of *user*, or None if the account does not exist."""
+    if TARGET_ROOT is None:
+        try:
+            entry = pwd.getpwnam(user)
+        except KeyError:
+            return None
+        return entry.pw_gid, entry.pw_shell
+    for row in _read_db("passwd"):
+        if row[0] == user and len(row) >= 7:
+            return int(row[3]), row[6]
+    return None
+
+def all_groups():
+    """Return [(name, gid, members)] for every group on the system."""
+    if TARGET_ROOT is None:
+        return [(g.gr_name, g.gr_gid, g.gr_mem) for g in grp.getgrall()]
+    return [(row[0], int(row[2]), [m for m in row[3].split(",") if m])
+            for row in _read_db("group")]
+
+def user_groups(user):
+    """Return every group *user* belongs to, memoized for the session."""
+    if user not in _GROUP_MEMO:
+        groups = all_groups()
+        names = {name for name, _, members in groups if user in members}
+        entry = user_entry(user)
+        if entry:
+            names.update(name for name, gid, _ in groups if gid == entry[0])
+        _GROUP_MEMO[user] = names
+    return _GROUP_MEMO[user]
+
 def user_in_group(user, group):
     """Return True if *user* is already a member of *group*."""
-    result = subprocess.run(
-        ["id", "-nG", user], capture_output=True, text=True
-    )
-    if result.returncode == 0:
-        return group in result.stdout.split()
-    return False
+    return group in user_groups(user)
+
+def group_exists(group):
+    return any(name == group for name, _, _ in all_groups())
 
 def setup_user_groups():
-    groups = ["seat", "video", "audio", "render", "dbus"]
-    user = os.environ.get("USER", os.getlogin())
-    for g in groups:
-        # Check group exists
-        result = subprocess.run(["getent", "group", g],
-                                stdout=subprocess.DEVNULL,
-                                stderr=subprocess.DEVNULL)
-        if result.returncode == 0 and not user_in_group(user, g):
-            subprocess.run(["sudo", "usermod", "-aG", g, user],
-                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    """Add the user to every missing USER_GROUPS entry with a single usermod."""
+    user = current_user()
+    if user_entry(user) is None:
+        print(f"{ORA}[!] No account '{user}' found; skipping group setup.{NC}")
+        return
+    missing = [g for g in USER_GROUPS if group_exists(g) and not user_in_group(user, g)]
+    if missing:
+        run(["sudo", "usermod", "-aG", ",".join(missing), user],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        _GROUP_MEMO.pop(user, None)
 
 # ─── AUR Helper Detection ────────────────────────────────────────────────────
 
@@ -234,15 +1137,454 @@ def detect_aur():
 
     for h, clr in helpers.items():
         if shutil.which(h):
-            result = subprocess.run([h, "--version"],
-                                    stdout=subprocess.DEVNULL,
-                                    stderr=subprocess.DEVNULL)
+            result = run([h, "--version"],
+                         stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, check=False)
             if result.returncode == 0:
                 AUR_HELPER = h
                 AUR_CLR = clr
                 return True
     return False
 
+# ─── AUR RPC Resolver ─────────────────────────────────────────────────────────
+
+AUR_RPC_URL = os.environ.get("GUHWIZARD_AUR_URL", "https://aur.archlinux.org/rpc/")
+AUR_RPC_CACHE = CACHE_DIR / "aur-rpc.json"
+AUR_RPC_TTL = 3600        # seconds a cached info response stays valid
+AUR_RPC_BATCH = 100       # names per request, keeps the URL well under the limit
+
+def _load_aur_cache():
+    try:
+        return json.loads(AUR_RPC_CACHE.read_text())
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def _save_aur_cache(cache):
+    AUR_RPC_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = AUR_RPC_CACHE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(cache))
+    os.replace(tmp, AUR_RPC_CACHE)
+
+def aur_info(names, fresh=False):
+    """Look up *names* via the AUR RPC ``info`` endpoint.
+
+    All uncached names (every name with *fresh*) go out in as few
+    multi-``arg[]`` requests as possible. Returns {name: info_dict or None};
+    None means the AUR has no package by that name. Raises
+    urllib.error.URLError on network failure.
+    """
+    cache = _load_aur_cache()
+    now = time.time()
+    result = {}
+    wanted = []
+    for name in dict.fromkeys(names):
+        hit = cache.get(name)
+        if hit and not fresh and now - hit["fetched"] < AUR_RPC_TTL:
+            result[name] = hit["info"]
+        else:
+            wanted.append(name)
+
+    for i in range(0, len(wanted), AUR_RPC_BATCH):
+        batch = wanted[i:i + AUR_RPC_BATCH]
+        query = urllib.parse.urlencode([("v", "5"), ("type", "info")] +
+                                       [("arg[]", n) for n in batch])
+        with urllib.request.urlopen(f"{AUR_RPC_URL}?{query}", timeout=10) as resp:
+            data = json.load(resp)
+        if data.get("type") == "error":
+            raise urllib.error.URLError(data.get("error", "AUR RPC error"))
+        found = {r["Name"]: r for r in data.get("results", [])}
+        for name in batch:
+            result[name] = found.get(name)
+            cache[name] = {"fetched": now, "info": result[name]}
+
+    if wanted:
+        _save_aur_cache(cache)
+    return result
+
+def aur_provider(dep):
+    """Return the name of an AUR package that provides *dep*, or None."""
+    query = urllib.parse.urlencode({"v": "5", "type": "search",
+                                    "by": "provides", "arg": dep})
+    with urllib.request.urlopen(f"{AUR_RPC_URL}?{query}", timeout=10) as resp:
+        results = json.load(resp).get("results", [])
+    names = sorted(r["Name"] for r in results)
+    return dep if dep in names else (names[0] if names else None)
+
+def _aur_deps(info):
+    """Everything makepkg needs present to build and check an RPC result."""
+    return info.get("Depends", []) + info.get("MakeDepends", []) + info.get("CheckDepends", [])
+
+def _build_satisfied(dep):
+    """True when *dep* needs no AUR build: makepkg on the build host finds it
+    installed or provided there (rustup for cargo, a JRE for java-runtime),
+    and under --root the target has it or its repos do."""
+    if not HOST_PKG_INDEX.is_satisfied(dep):
+        return False
+    return TARGET_ROOT is None or PKG_INDEX.is_satisfied(dep) or is_pkg_in_repos(dep)
+
+def resolve_aur(pkgs):
+    """Resolve *pkgs* and their dependencies against the repos and the AUR.
+
+    Dependencies are checked on the build host, where makepkg runs.
+
+    Returns (graph, repo_deps, missing):
+        graph     -- {aur_pkg: set of AUR packages it needs built first}
+        repo_deps -- repo packages the AUR builds will pull in
+        missing   -- names found neither in the repos nor in the AUR
+    """
+    infos = {}
+    aliases = {}          # virtual dep name -> AUR package providing it
+    missing = []
+    queried = set()       # every name is looked up once, so the loop ends
+    pending = list(dict.fromkeys(pkgs))
+
+    # One RPC round per dependency depth, every name of a level batched together
+    while pending:
+        next_pending = []
+        for name, info in aur_info(pending).items():
+            queried.add(name)
+            provider = None
+            if info is None and name not in pkgs:
+                provider = aur_provider(name)
+                if provider == name:
+                    # The cached "no such package" is out of date
+                    info, provider = aur_info([name], fresh=True)[name], None
+            if info is not None:
+                infos[name] = info
+            elif provider:
+                aliases[name] = provider
+                if provider not in infos:
+                    next_pending.append(provider)
+            else:
+                missing.append(name)
+        for info in infos.values():
+            for prov in info.get("Provides", []):
+                aliases.setdefault(_strip_constraint(prov), info["Name"])
+        for info in list(infos.values()):
+            for dep in map(_strip_constraint, _aur_deps(info)):
+                known = dep in infos or dep in aliases or dep in missing
+                if not known and not _build_satisfied(dep) and HOST_PKG_INDEX.repo_of(dep) is None:
+                    next_pending.append(dep)
+        pending = [n for n in dict.fromkeys(next_pending) if n not in queried]
+
+    graph = {}
+    repo_deps = set()
+    for name, info in infos.items():
+        graph[name] = set()
+        for dep in map(_strip_constraint, _aur_deps(info)):
+            if _build_satisfied(dep):
+                continue
+            if HOST_PKG_INDEX.repo_of(dep) is not None:
+                repo_deps.add(dep)
+            elif dep in infos or dep in aliases:
+                graph[name].add(aliases.get(dep, dep) if dep not in infos else dep)
+            else:
+                graph[name].add(dep)   # missing; keeps the edge for failure propagation
+
+    return graph, repo_deps, missing
+
+def topo_order(graph):
+    """Return *graph*'s nodes with every dependency before its dependents."""
+    order = []
+    seen = set()
+
+    def visit(node, stack=()):
+        if node in seen or node in stack:
+            return
+        for dep in sorted(graph[node] & graph.keys()):
+            visit(dep, stack + (node,))
+        seen.add(node)
+        order.append(node)
+
+    for node in sorted(graph):
+        visit(node)
+    return order
+
+# ─── Built Package Cache ─────────────────────────────────────────────────────
+
+PKG_BUILD_CACHE = CACHE_DIR / "pkgs"
+PKG_BUILD_CACHE_MAX_AGE = 30 * 86400     # evict entries unused for 30 days
+PKG_BUILD_CACHE_MAX_BYTES = 4 << 30      # keep the cache under 4 GiB
+VCS_SUFFIXES = ("-git", "-hg", "-svn", "-bzr", "-fossil", "-darcs")
+_BUILD_OUTPUTS = {".git", "src", "pkg"}
+
+def _pkgnames(src):
+    """pkgname(s) declared by the PKGBUILD in *src*."""
+    import re
+    try:
+        text = (Path(src) / "PKGBUILD").read_text(errors="replace")
+    except OSError:
+        return []
+    m = re.search(r"^pkgname=\(?([^)\n]*)", text, re.M)
+    return m.group(1).replace("'", " ").replace('"', " ").split() if m else []
+
+def pkg_cache_key(src):
+    """Content hash of a package source dir (PKGBUILD, local sources, arch).
+
+    Returns None for VCS packages (-git, ...): their real source is a
+    moving upstream HEAD that the PKGBUILD hash cannot capture.
+    """
+    import hashlib
+    if any(n.endswith(VCS_SUFFIXES) for n in _pkgnames(src)):
+        return None
+    h = hashlib.sha256(os.uname().machine.encode())
+    src = Path(src)
+    for dirpath, dirs, files in os.walk(src):
+        dirs[:] = sorted(d for d in dirs if d not in _BUILD_OUTPUTS)
+        for f in sorted(files):
+            if ".pkg.tar" in f or f.endswith(".log"):
+                continue
+            path = Path(dirpath) / f
+            h.update(str(path.relative_to(src)).encode() + b"\0")
+            h.update(path.read_bytes())
+    return h.hexdigest()
+
+def pkg_cache_lookup(key):
+    """Return cached package files for *key* (and mark the entry as used)."""
+    if not key:
+        return []
+    entry = PKG_BUILD_CACHE / key
+    files = sorted(str(p) for p in entry.glob("*.pkg.tar*")) if entry.is_dir() else []
+    if files:
+        os.utime(entry)
+    return files
+
+def pkg_cache_store(key, files):
+    """Copy freshly built *files* into the cache under *key*."""
+    if not key or not files:
+        return
+    entry = PKG_BUILD_CACHE / key
+    tmp = PKG_BUILD_CACHE / f".{key}.{os.getpid()}.{threading.get_ident()}"
+    tmp.mkdir(parents=True, exist_ok=True)
+    for f in files:
+        shutil.copy2(f, tmp)
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)   # a concurrent build stored it first
+
+def evict_pkg_cache():
+    """Drop entries older than the max age, then the least recently used over the size cap."""
+    if not PKG_BUILD_CACHE.is_dir():
+        return
+    now = time.time()
+    entries = []
+    for entry in PKG_BUILD_CACHE.iterdir():
+        if not entry.is_dir():
+            continue
+        age = now - entry.stat().st_mtime
+        if entry.name.startswith(".") or age > PKG_BUILD_CACHE_MAX_AGE:
+            shutil.rmtree(entry, ignore_errors=True)
+            continue
+        size = sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+        entries.append((entry.stat().st_mtime, size, entry))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= PKG_BUILD_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+def _packagelist(src, env=None):
+    result = run(["makepkg", "--packagelist"], cwd=src, env=env,
+                 capture_output=True, text=True, check=False)
+    return [f for f in result.stdout.split() if os.path.isfile(f)]
+
+def makepkg_install(src, env=None, asdeps=False):
+    """Cached replacement for ``makepkg -si`` in *src*.
+
+    A previous build of identical sources is installed straight from the
+    cache with ``pacman -U``; otherwise the package is built (pulling its
+    dependencies with -s), stored in the cache, then installed.
+    """
+    key = pkg_cache_key(src)
+    files = pkg_cache_lookup(key)
+    if files:
+        print(f"{GRN}[OK] Using cached build of {os.path.basename(src)}.{NC}")
+    else:
+        if run(["makepkg", "-sf", "--noconfirm"], cwd=src, env=env, check=False).returncode != 0:
+            return False
+        files = _packagelist(src, env)
+        pkg_cache_store(key, files)
+    if not files:
+        return False
+    cmd = ["sudo", "pacman", "-U", "--needed", "--noconfirm"] + (["--asdeps"] if asdeps else [])
+    return run(cmd + files, check=False).returncode == 0
+
+# ─── AUR Build Engine ─────────────────────────────────────────────────────────
+
+AUR_MAX_JOBS = 4                  # concurrent makepkg builds at most
+AUR_RAM_PER_THREAD = 1 << 30      # rough peak RSS of one C++ compile job
+AUR_MIN_THREADS_PER_JOB = 2
+
+def _meminfo(field):
+    """Return *field* from /proc/meminfo in bytes (0 if unknown)."""
+    try:
+        for line in Path("/proc/meminfo").read_text().splitlines():
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+def mem_available():
+    """Return MemAvailable from /proc/meminfo in bytes (0 if unknown)."""
+    return _meminfo("MemAvailable")
+
+def build_budget(n_builds):
+    """Return (jobs, threads_per_job) for *n_builds* independent builds.
+
+    Total compile threads are capped by both cores and available RAM, then
+    split between concurrent builds so they never oversubscribe the box.
+    """
+    cores = os.cpu_count() or 1
+    mem = mem_available()
+    threads = max(1, min(cores, mem // AUR_RAM_PER_THREAD)) if mem else cores
+    jobs = max(1, min(n_builds, AUR_MAX_JOBS, threads // AUR_MIN_THREADS_PER_JOB))
+    return jobs, max(1, threads // jobs)
+
+def build_env(threads):
+    """Environment for one makepkg job limited to *threads* compile threads."""
+    env = os.environ.copy()
+    env["MAKEFLAGS"] = f"-j{threads}"
+    env["CMAKE_BUILD_PARALLEL_LEVEL"] = str(threads)
+    env["CARGO_BUILD_JOBS"] = str(threads)
+    env["PKGEXT"] = ".pkg.tar"
+    return env
+
+def _build_base(base, threads):
+    """Clone and build one AUR package base. Returns (ok, pkg_files, seconds)."""
+    start = time.monotonic()
+    build_root = Path(TEMP_DIR) / "aur"
+    build_root.mkdir(parents=True, exist_ok=True)
+    src = build_root / base
+    log_path = build_root / f"{base}.log"
+    env = build_env(threads)
+    with open(log_path, "w") as log:
+        if not src.is_dir():
+            result = run(
+                ["git", "clone", "--depth", "1", f"https://aur.archlinux.org/{base}.git", str(src)],
+                stdout=log, stderr=subprocess.STDOUT, check=False
+            )
+            if result.returncode != 0:
+                return False, [], time.monotonic() - start
+        key = pkg_cache_key(src)
+        files = pkg_cache_lookup(key)
+        if files:
+            return True, files, time.monotonic() - start
+        result = run(["makepkg", "-f", "--noconfirm"],
+                     cwd=src, env=env, stdout=log, stderr=subprocess.STDOUT, check=False)
+    if result.returncode != 0:
+        return False, [], time.monotonic() - start
+    files = _packagelist(src, env)
+    pkg_cache_store(key, files)
+    return bool(files), files, time.monotonic() - start
+
+def _runtime_closure(graph, infos, explicit):
+    """*explicit* plus every package of *graph* they need at run time.
+
+    Under --root these are what goes into the target; make and check
+    dependencies are only needed on the build host.
+    """
+    if TARGET_ROOT is None:
+        return set(graph)
+    provides = {n: {n} | {_strip_constraint(p) for p in (infos.get(n) or {}).get("Provides", [])}
+                for n in graph}
+    closure = set()
+    stack = [n for n in explicit if n in graph]
+    while stack:
+        name = stack.pop()
+        if name in closure:
+            continue
+        closure.add(name)
+        depends = {_strip_constraint(d) for d in (infos.get(name) or {}).get("Depends", [])}
+        stack += [d for d in graph[name] if d in graph and provides[d] & depends]
+    return closure
+
+def _install_built(files, host, target, asdeps):
+    """``pacman -U`` built *files* on the build host and/or the target."""
+    cmd = ["sudo", "pacman", "-U", "--needed", "--noconfirm"]
+    if host:
+        with on_host():
+            if run(cmd + ["--asdeps"] + files, check=False).returncode != 0:
+                return False
+    return not target or run(cmd + asdeps + files, check=False).returncode == 0
+
+def build_aur(graph, explicit):
+    """Build and install the AUR packages in *graph* in dependency order.
+
+    Independent package bases build concurrently in a worker pool; each
+    finished base is installed (serially, pacman holds a lock) before any
+    base that depends on it is started. A failed build only fails its own
+    dependents. Returns the set of packages that were not installed.
+
+    Under --root, makepkg still runs on the host: bases other builds need
+    are installed there, and only *explicit* packages and their runtime
+    dependencies go into the target.
+    """
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+    infos = aur_info(list(graph))
+    base_of = {n: (infos.get(n) or {}).get("PackageBase", n) for n in graph}
+    members = {}
+    for name, base in base_of.items():
+        members.setdefault(base, []).append(name)
+    base_deps = {b: {base_of[d] for n in names for d in graph[n] if d in base_of} - {b}
+                 for b, names in members.items()}
+    host_bases = set().union(*base_deps.values()) if TARGET_ROOT is not None else set()
+    target_bases = {base_of[n] for n in _runtime_closure(graph, infos, explicit)}
+
+    jobs, threads = build_budget(len(members))
+    print(f"{GRA}--> Building {len(members)} AUR package(s): "
+          f"{jobs} parallel job(s), -j{threads} each...{NC}")
+
+    done, failed = set(), set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while True:
+            for base in topo_order(base_deps):
+                if base in done or base in failed or base in running.values():
+                    continue
+                if base_deps[base] & failed:
+                    failed.add(base)
+                    print(f"{ORA}[!] Skipping {base}: a dependency failed to build.{NC}")
+                elif base_deps[base] <= done and len(running) < jobs:
+                    print(f"{GRA}--> [build] {base}{NC}")
+                    running[pool.submit(_build_base, base, threads)] = base
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                base = running.pop(fut)
+                try:
+                    ok, files, secs = fut.result()
+                except OSError as e:
+                    ok, files, secs = False, [], 0
+                    print(f"{RED}[!] {base}: {e}{NC}")
+                if ok:
+                    asdeps = [] if explicit & set(members[base]) else ["--asdeps"]
+                    ok = _install_built(files, base in host_bases, base in target_bases, asdeps)
+                for name in members[base]:
+                    record_package(name, secs, 0 if ok else 1, "aur")
+                if ok:
+                    done.add(base)
+                    print(f"{GRN}[OK] {base} built and installed ({secs:.0f}s).{NC}")
+                else:
+                    failed.add(base)
+                    print(f"{RED}[!] {base} failed to build. Last lines of its log:{NC}")
+                    log = Path(TEMP_DIR) / "aur" / f"{base}.log"
+                    if log.is_file():
+                        for line in log.read_text(errors="replace").splitlines()[-10:]:
+                            print(f"{GRA}    {line}{NC}")
+
+    # Anything neither built nor failed sits on a dependency cycle
+    # topo_order could not break; nothing will ever start it.
+    for base in sorted(set(members) - done - failed):
+        failed.add(base)
+        print(f"{RED}[!] {base} is unresolvable (dependency cycle).{NC}")
+
+    return {n for b in failed for n in members[b]}
+
 # ─── Smart Installer (idempotent via --needed + pre-filter) ──────────────────
 
 def smart_install(pkgs):
@@ -258,10 +1600,7 @@ def smart_install(pkgs):
         if is_pkg_installed(pkg):
             continue
 
-        result = subprocess.run(["pacman", "-Sp", pkg],
-                                stdout=subprocess.DEVNULL,
-                                stderr=subprocess.DEVNULL)
-        if result.returncode == 0:
+        if is_pkg_in_repos(pkg):
             repo_pkgs.append(pkg)
         else:
             aur_pkgs.append(pkg)
@@ -273,11 +1612,81 @@ def smart_install(pkgs):
     if repo_pkgs:
         run(["sudo", "pacman", "-S", "--needed", "--noconfirm"] + repo_pkgs)
 
-    if aur_pkgs:
-        if AUR_HELPER:
-            run([AUR_HELPER, "-S", "--needed", "--noconfirm"] + aur_pkgs)
-        else:
-            print(f"{RED}[!] AUR helper missing. Skipping: {' '.join(aur_pkgs)}{NC}")
+    if aur_pkgs and not AUR_HELPER:
+        print(f"{RED}[!] AUR helper missing. Skipping: {' '.join(aur_pkgs)}{NC}")
+    elif aur_pkgs:
+        aur_pkgs, graph, repo_deps = check_aur_pkgs(aur_pkgs)
+        if aur_pkgs:
+            install_aur(aur_pkgs, graph, repo_deps)
+
+def check_aur_pkgs(aur_pkgs):
+    """Resolve *aur_pkgs* up front and drop those that cannot be built.
+
+    Surfaces missing or renamed packages before any compile starts.
+
+    Returns (buildable, graph, repo_deps); graph is None when the RPC could
+    not be reached and resolution has to be left to the AUR helper.
+    """
+    print(f"{GRA}--> Resolving AUR packages: {' '.join(aur_pkgs)}...{NC}")
+    try:
+        graph, repo_deps, missing = resolve_aur(aur_pkgs)
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        print(f"{ORA}[!] AUR RPC unavailable ({e}). Leaving resolution to {AUR_HELPER}.{NC}")
+        return aur_pkgs, None, set()
+
+    broken = set(missing)
+    # Anything that (transitively) needs a missing package cannot be built either
+    changed = True
+    while changed:
+        changed = False
+        for name, deps in graph.items():
+            if name not in broken and deps & broken:
+                broken.add(name)
+                changed = True
+
+    if missing:
+        print(f"{RED}[!] Not found in repos or AUR: {' '.join(sorted(missing))}{NC}")
+    skipped = [p for p in aur_pkgs if p in broken]
+    if skipped:
+        print(f"{RED}[!] Skipping unbuildable AUR packages: {' '.join(skipped)}{NC}")
+
+    buildable = [p for p in aur_pkgs if p not in broken]
+    aur_deps = set()
+    stack = list(buildable)
+    while stack:
+        for dep in graph.get(stack.pop(), ()):
+            if dep not in aur_deps:
+                aur_deps.add(dep)
+                stack.append(dep)
+    print(f"{GRA}--> AUR plan: {len(buildable)} package(s), "
+          f"{len(aur_deps)} AUR dep(s), {len(repo_deps)} repo dep(s).{NC}")
+    needed = set(buildable) | aur_deps
+    return buildable, {n: d for n, d in graph.items() if n in needed}, repo_deps
+
+def install_aur(aur_pkgs, graph, repo_deps):
+    """Install resolved AUR packages with the parallel build engine.
+
+    Falls back to the AUR helper when *graph* is None (RPC unavailable).
+    """
+    if graph is None:
+        if TARGET_ROOT is not None:
+            # The helper would install into the host; only the build engine honours --root
+            print(f"{RED}[!] AUR RPC unreachable; cannot build for {TARGET_ROOT}: "
+                  f"{' '.join(aur_pkgs)}{NC}")
+            return
+        run([AUR_HELPER, "-S", "--needed", "--noconfirm"] + aur_pkgs)
+        return
+    # Repo deps go in first, in one transaction, so concurrent makepkg runs
+    # never need pacman (and its lock) themselves. They are for makepkg, so
+    # under --root they go onto the host; pacman -U pulls runtime deps into
+    # the target by itself.
+    repo_deps = sorted(d for d in repo_deps if not HOST_PKG_INDEX.is_satisfied(d))
+    if repo_deps:
+        with on_host():
+            run(["sudo", "pacman", "-S", "--needed", "--noconfirm", "--asdeps"] + repo_deps)
+    failed = build_aur(graph, explicit=set(aur_pkgs))
+    if failed:
+        print(f"{RED}[!] AUR packages not installed: {' '.join(sorted(failed))}{NC}")
 
 # ─── Banner ──────────────────────────────────────────────────────────────────
 
@@ -291,66 +1700,256 @@ BANNER_ART = r"""
 """
 
 def print_banner():
-    os.system("clear")
+    if PROFILE is None:
+        run(["clear"], check=False)
     print(f"{YLW}{BANNER_ART}{NC}")
     print(f"{YLW}Thank you for trying guhwm! :3{NC}")
     if AUR_HELPER:
         print(f"{YLW}AUR Helper: {AUR_CLR}{AUR_HELPER}{NC}")
     print()
 
-# ─── Systemd Service Helper (idempotent) ─────────────────────────────────────
+# ─── Systemd Unit Manager ────────────────────────────────────────────────────
 
-def enable_service(service):
-    """Enable a systemd service. Skips if already enabled."""
+DISPLAY_MANAGERS = ["sddm", "gdm", "lightdm"]
+UNIT_READY_TIMEOUT = 15     # seconds to wait for started units to become active
+
+def enable_service(service, scope="system", now=False):
+    """Queue a systemd unit to be enabled by apply_units().
+
+    Wanted units are kept in the state file, so units queued by a phase
+    that finished before an interruption are still enabled on resume.
+    *now* also starts the unit (and waits for it to become active).
+    """
+    pending = STATE.data["units"]
+    if not any(u["unit"] == service and u["scope"] == scope for u in pending):
+        pending.append({"unit": service, "scope": scope, "now": now})
+        STATE.save()
+
+def _unit_files(names):
+    """Return the set of unit files systemd knows among *names* (one call)."""
+    result = run(["systemctl", "list-unit-files", "--no-legend", "--plain"] + names,
+                 capture_output=True, text=True, check=False)
+    return {line.split()[0] for line in result.stdout.splitlines() if line.strip()}
+
+def _enabled(units, user=False):
+    """Return the subset of *units* that is enabled (or static).
+
+    One call normally; a unit that does not exist makes systemctl print
+    no state at all, so then each unit is asked on its own.
+    """
+    if not units:
+        return set()
+    cmd = ["systemctl"] + (["--user"] if user else []) + ["is-enabled"]
+    states = run(cmd + units, capture_output=True, text=True, check=False).stdout.split()
+    if len(states) != len(units):
+        states = []
+        for unit in units:
+            out = run(cmd + [unit], capture_output=True, text=True, check=False).stdout.split()
+            states.append(out[0] if out else "not-found")
+    return {u for u, st in zip(units, states)
+            if st in ("enabled", "enabled-runtime", "static", "alias", "indirect")}
+
+def wait_active(units, timeout=UNIT_READY_TIMEOUT):
+    """Poll ``systemctl is-active`` with backoff until *units* are up.
+
+    Returns the units that failed or did not come up in *timeout* seconds.
+    """
+    waiting = list(units)
+    delay = 0.05
+    deadline = time.monotonic() + timeout
+    while waiting and time.monotonic() < deadline:
+        result = run(["systemctl", "is-active"] + waiting,
+                     capture_output=True, text=True, check=False)
+        states = dict(zip(waiting, result.stdout.split()))
+        failed = [u for u in waiting if states.get(u) == "failed"]
+        waiting = [u for u in waiting if states.get(u) not in ("active", "failed")]
+        if failed:
+            return failed + waiting
+        if waiting:
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+    return waiting
+
+def apply_units():
+    """Enable every queued unit: one daemon-reload, one enable per scope."""
+    pending = STATE.data["units"]
+    if not pending:
+        return
 
+    print_banner()
+    print(f"{YLW}==> Enabling services...{NC}")
     setup_user_groups()
 
-    if service == "ly":
+    system = [u for u in pending if u["scope"] == "system"]
+    user = [u["unit"] for u in pending if u["scope"] == "user"]
+
+    if any(u["unit"] == "ly" for u in system):
         print(f"{GRA}--> Deconflicting Display Managers...{NC}")
-        subprocess.run(["sudo", "systemctl", "disable", "sddm", "gdm", "lightdm"],
-                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        dm_service = Path("/etc/systemd/system/display-manager.service")
+        run(["sudo", "systemctl", "disable"] + DISPLAY_MANAGERS,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        dm_service = target_path("/etc/systemd/system/display-manager.service")
         if dm_service.exists():
-            subprocess.run(["sudo", "rm", "-f", str(dm_service)],
-                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        subprocess.run(["sudo", "systemctl", "mask", "getty@tty2.service"],
-                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            run(["sudo", "rm", "-f", str(dm_service)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        run(["sudo", "systemctl", "mask", "getty@tty2.service"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+
+    if TARGET_ROOT is None:
+        run(["sudo", "systemctl", "daemon-reload"])
+
+    # Template units (e.g. ly@.service) are enabled as an instance on tty2
+    known = _unit_files([f"{u['unit']}{sfx}" for u in system for sfx in (".service", "@.service")])
+    names = {}
+    missing = []
+    for u in system:
+        if f"{u['unit']}.service" in known:
+            names[u["unit"]] = u["unit"]
+        elif f"{u['unit']}@.service" in known:
+            names[u["unit"]] = f"{u['unit']}@tty2"
+            print(f"{GRA}--> Template unit detected. Using {names[u['unit']]}...{NC}")
+        else:
+            missing.append(u["unit"])
+            print(f"{ORA}[!] No unit file for {u['unit']}; skipping it.{NC}")
+    system = [u for u in system if u["unit"] in names]
+    sys_units = [names[u["unit"]] for u in system]
+    start_units = [names[u["unit"]] for u in system if u["now"]]
+
+    failed = []
+    already = _enabled(sys_units)
+    to_enable = [u for u in sys_units if u not in already]
+    for unit in sorted(already):
+        print(f"{GRN}[OK] {unit} is already enabled.{NC}")
+    if to_enable:
+        print(f"{GRA}--> Enabling: {' '.join(to_enable)}...{NC}")
+        if run(["sudo", "systemctl", "enable", "--force"] + to_enable, check=False).returncode != 0:
+            now_enabled = _enabled(to_enable)
+            failed += [u for u in to_enable if u not in now_enabled]
+
+    user_enabled = _enabled(user, user=True)
+    user_todo = [u for u in user if u not in user_enabled]
+    if user_todo:
+        print(f"{GRA}--> Enabling user services: {' '.join(user_todo)}...{NC}")
+        sudo = ["sudo"] if TARGET_ROOT is not None else []
+        cmd = sudo + ["systemctl", "--user", "enable"]
+        quiet = {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL, "check": False}
+        if run(cmd + user_todo, **quiet).returncode != 0:
+            # One missing unit fails the whole batch: retry the rest one by one
+            for unit in user_todo:
+                run(cmd + [unit], **quiet)
+            now_enabled = _enabled(user_todo, user=True)
+            failed += [u for u in user_todo if u not in now_enabled]
+    elif user:
+        print(f"{GRN}[OK] User services already enabled: {' '.join(user)}.{NC}")
+
+    if start_units and TARGET_ROOT is None:
+        run(["sudo", "systemctl", "start", "--no-block"] + start_units, check=False)
+        failed += wait_active(start_units)
+
+    for unit in failed:
+        print(f"{RED}[ERROR] Systemd could not enable/start {unit}{NC}")
+    enabled = [u for u in sys_units + user if u not in failed]
+    if enabled:
+        print(f"{GRN}[SUCCESS] Enabled: {' '.join(enabled)}{NC}")
+
+    checkpoint("services", "enable", enabled=enabled, failed=failed + missing,
+               queued=list(pending))
+    STATE.data["units"] = []
+    STATE.save()
+    if failed or missing:
+        pause()
+
+# ─── Transaction Planner (--plan) ────────────────────────────────────────────
+
+def plan_begin():
+    """Start collecting menu selections instead of installing them."""
+    global PLAN
+    PLAN = {"pkgs": [], "hooks": []}
+
+def plan_add(pkgs):
+    """Queue *pkgs* for the combined transaction."""
+    PLAN["pkgs"].extend(pkgs)
+
+def after_install(fn, *args, **kwargs):
+    """Run *fn* now, or after the combined transaction when planning."""
+    if PLAN is not None:
+        PLAN["hooks"].append((fn, args, kwargs))
+    else:
+        fn(*args, **kwargs)
+
+def _repo_closure(pkgs):
+    """Return *pkgs* plus every not-yet-installed repo dependency they pull in."""
+    closure = set()
+    stack = list(pkgs)
+    while stack:
+        pkg = stack.pop()
+        name = pkg if pkg in PKG_INDEX.sync else PKG_INDEX.provides.get(pkg)
+        if not name or name in closure or is_pkg_installed(name):
+            continue
+        closure.add(name)
+        stack.extend(PKG_INDEX.sync[name]["depends"])
+    return closure
+
+def _human_size(n):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if n < 1024 or unit == "GiB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
+
+def plan_commit():
+    """Show the collected plan, then run one repo and one AUR transaction."""
+    global PLAN
+    if PLAN is None:
+        return
+    plan, PLAN = PLAN, None
 
-    run(["sudo", "systemctl", "daemon-reload"])
+    pkgs = [p for p in dict.fromkeys(plan["pkgs"])
+            if p != "oh-my-zsh" and not is_pkg_installed(p)]
+    if "oh-my-zsh" in plan["pkgs"] and not is_pkg_installed("zsh"):
+        pkgs.append("zsh")
+    repo_pkgs = [p for p in pkgs if is_pkg_in_repos(p)]
+    aur_pkgs = [p for p in pkgs if not is_pkg_in_repos(p)]
 
-    unit_to_enable = service
-    result = subprocess.run(["systemctl", "list-unit-files", f"{service}.service"],
-                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    if result.returncode != 0:
-        result2 = subprocess.run(["systemctl", "list-unit-files", f"{service}@.service"],
-                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        if result2.returncode == 0:
-            unit_to_enable = f"{service}@tty2"
-            print(f"{GRA}--> Template unit detected. Using {unit_to_enable}...{NC}")
-
-    # ── Idempotency: skip if already enabled ──
-    if is_service_enabled(unit_to_enable):
-        print(f"{GRN}[OK] {unit_to_enable} is already enabled.{NC}")
-        # Still start dbus if needed
-        if service == "dbus":
-            subprocess.run(["sudo", "systemctl", "start", "dbus"],
-                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return
+    print_banner()
+    print(f"{YLW}==> Installation Plan{NC}")
+    graph, repo_deps = None, set()
+    if aur_pkgs and AUR_HELPER:
+        aur_pkgs, graph, repo_deps = check_aur_pkgs(aur_pkgs)
+        # Ly's AUR build needs zig before the helper runs
+        if "ly" in aur_pkgs and not HOST_PKG_INDEX.is_installed("zig"):
+            repo_deps.add("zig")
+    elif aur_pkgs:
+        print(f"{RED}[!] AUR helper missing. Skipping: {' '.join(aur_pkgs)}{NC}")
+        aur_pkgs = []
+    # Build deps are installed --asdeps by install_aur(), apart from the
+    # explicit transaction, so pacman -Qdt can clean them up later
+    repo_deps = {d for d in repo_deps if d not in repo_pkgs}
+
+    closure = _repo_closure(repo_pkgs + sorted(repo_deps))
+    download = sum(PKG_INDEX.sync[p]["csize"] for p in closure)
+    installed = sum(PKG_INDEX.sync[p]["isize"] for p in closure)
+    if repo_pkgs:
+        print(f"{GRA}--> Repo ({len(repo_pkgs)}): {WHT}{' '.join(repo_pkgs)}{NC}")
+    if aur_pkgs:
+        print(f"{GRA}--> AUR  ({len(aur_pkgs)}): {WHT}{' '.join(aur_pkgs)}{NC}")
+    if repo_deps:
+        print(f"{GRA}--> Build deps ({len(repo_deps)}): {WHT}{' '.join(sorted(repo_deps))}{NC}")
+    print(f"{GRA}--> {len(closure)} repo package(s) incl. dependencies | "
+          f"Download: {_human_size(download)} | Installed: {_human_size(installed)}{NC}")
 
-    print(f"{GRA}--> Enabling service: {service}...{NC}")
-    time.sleep(1)
-    result = subprocess.run(["sudo", "systemctl", "enable", "--force", unit_to_enable])
-    if result.returncode == 0:
-        print(f"{GRN}[SUCCESS] {unit_to_enable} enabled.{NC}")
-        if service == "dbus":
-            subprocess.run(["sudo", "systemctl", "start", "dbus"],
-                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            time.sleep(1)
+    if not repo_pkgs and not aur_pkgs:
+        print(f"{GRN}[OK] All packages already installed.{NC}")
+    elif ask("Proceed with installation? (Y/n): ", "y").strip().lower() not in ("", "y"):
+        print(f"{ORA}[!] Installation skipped.{NC}")
+        return
     else:
-        print(f"{RED}[ERROR] Systemd could not enable {unit_to_enable}{NC}")
-        input(f"{YLW}==> Press Enter to continue...{NC}")
+        if repo_pkgs:
+            sync_flag = "-S" if DB_SYNCED else "-Syu"
+            run(["sudo", "pacman", sync_flag, "--needed", "--noconfirm"] + repo_pkgs)
+        if aur_pkgs:
+            install_aur(aur_pkgs, graph, repo_deps)
 
-    time.sleep(2)
+    for fn, args, kwargs in plan["hooks"]:
+        fn(*args, **kwargs)
 
 # ─── Menu / Prompt Selection ─────────────────────────────────────────────────
 
@@ -369,12 +1968,15 @@ def prompt_selection(title, mode, options):
     # ── Show installed status next to each option ──
     print(f"{YLW}==> {title}{NC}")
     for i, (clr, name, pkg, desc) in enumerate(options, 1):
-        installed = is_pkg_installed(pkg) if pkg != "oh-my-zsh" else (Path.home() / ".oh-my-zsh").is_dir()
+        installed = is_pkg_installed(pkg) if pkg != "oh-my-zsh" else (target_home() / ".oh-my-zsh").is_dir()
         tag = f" {GRN}[installed]{NC}" if installed else ""
         print(f"{i}) {clr}{name}{GRA} -- {WHT}{desc}{tag}{NC}")
     print("0) None/Skip")
 
-    if mode == "multi":
+    if PROFILE is not None:
+        choice = profile_answer(title, mode, options)
+        print(f"Select: {choice}")
+    elif mode == "multi":
         choice = input("Enter numbers (e.g., 1 2 3 or 1,2,3): ")
         choice = choice.replace(",", " ")
     else:
@@ -405,44 +2007,432 @@ def prompt_selection(title, mode, options):
         LAST_SELECTION = ""
         return False, []
 
-    if title != "AUR Helpers":
+    if title != "AUR Helpers" and PLAN is not None:
+        plan_add(pkgs_to_install)
+    elif title != "AUR Helpers":
         for pkg in pkgs_to_install:
             if pkg == "ly" and not is_pkg_installed("ly"):
-                result = subprocess.run(["pacman", "-Si", "ly"],
-                                        stdout=subprocess.DEVNULL,
-                                        stderr=subprocess.DEVNULL)
-                if result.returncode != 0:
+                if not is_pkg_in_repos("ly"):
                     print(f"{GRA}--> Ly not in repos. Pre-installing Zig for AUR build...{NC}")
-                    run(["sudo", "pacman", "-S", "--needed", "--noconfirm", "zig"])
+                    with on_host():
+                        run(["sudo", "pacman", "-S", "--needed", "--noconfirm", "zig"])
 
         smart_install(pkgs_to_install)
 
     return True, pkgs_to_install
 
-# ─── Network Check ───────────────────────────────────────────────────────────
+# ─── Network Check & Mirror Ranking ──────────────────────────────────────────
+
+MIRRORLIST = Path("/etc/pacman.d/mirrorlist")
+AUR_PROBE_URL = "https://aur.archlinux.org/"
+MIRROR_PROBE_FILE = ("core", "core.db")   # small object fetched from every mirror
+MIRROR_PROBE_BYTES = 16 << 10             # read at most this much of it
+MIRROR_PROBE_TIMEOUT = 4.0                # deadline for the whole probe stage
+MIRROR_PROBE_CONCURRENCY = 32
+MIRROR_MIN_ACTIVE = 3                     # fewer active servers: also try the commented ones
+MIRROR_PROBE_INACTIVE = 64                # ...but at most this many of them, picked at random
+MIRROR_ENABLE = 10                        # ...and enable this many of the fastest
+RANK_MIRRORS = True                       # --keep-mirrorlist turns this off
+MIRROR_RANK_HEADER = "## Ranked by guhwizard (fastest first)"
+
+async def _fetch_probe(url, max_bytes):
+    """GET *url*; returns (latency, bytes_per_sec, status)."""
+    import asyncio
+    u = urllib.parse.urlsplit(url)
+    https = u.scheme == "https"
+    start = time.monotonic()
+    reader, writer = await asyncio.open_connection(u.hostname, u.port or (443 if https else 80),
+                                                   ssl=True if https else None)
+    try:
+        path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {u.netloc}\r\nUser-Agent: guhwizard\r\n"
+                     f"Connection: close\r\n\r\n".encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        latency = time.monotonic() - start
+        while (await reader.readline()).strip():
+            pass                                # headers
+        body_start, received = time.monotonic(), 0
+        while received < max_bytes:
+            chunk = await reader.read(min(1 << 16, max_bytes - received))
+            if not chunk:
+                break
+            received += len(chunk)
+        elapsed = max(time.monotonic() - body_start, 1e-6)
+        parts = status_line.split()
+        status = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+        return latency, received / elapsed, status
+    finally:
+        writer.close()
+
+async def _probe(url, max_bytes, timeout, limit):
+    """Probe one URL; None when it is dead, slow past *timeout*, or errors."""
+    import asyncio
+    async with limit:
+        try:
+            latency, rate, status = await asyncio.wait_for(_fetch_probe(url, max_bytes), timeout)
+        except (OSError, asyncio.TimeoutError, ValueError):
+            return None
+    return (latency, rate) if 200 <= status < 400 else None
+
+def probe_urls(urls, max_bytes=None, timeout=None):
+    """Probe every URL concurrently; returns {url: (latency, bytes_per_sec) or None}.
+
+    The whole stage takes at most about *timeout*, however many URLs
+    there are and however many are dead: probes still queued or running
+    at the deadline are cancelled and count as dead.
+    """
+    import asyncio
+    max_bytes = max_bytes or MIRROR_PROBE_BYTES
+    timeout = timeout or MIRROR_PROBE_TIMEOUT
+
+    async def probe_all():
+        limit = asyncio.Semaphore(MIRROR_PROBE_CONCURRENCY)
+        tasks = {asyncio.ensure_future(_probe(u, max_bytes, timeout, limit)): u for u in urls}
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return {u: None if task.cancelled() else task.result() for task, u in tasks.items()}
+
+    return asyncio.run(probe_all())
+
+def _mirror_servers(text):
+    """[(line index, server template, active)] for every Server line of a mirrorlist."""
+    servers = []
+    for i, line in enumerate(text.splitlines()):
+        stripped = line.strip()
+        active = not stripped.startswith("#")
+        key, sep, value = stripped.lstrip("#").partition("=")
+        if sep and key.strip() == "Server":
+            servers.append((i, value.split("#")[0].strip(), active))
+    return servers
+
+def _probe_url(server):
+    repo, name = MIRROR_PROBE_FILE
+    base = server.replace("$repo", repo).replace("$arch", os.uname().machine)
+    return f"{base.rstrip('/')}/{name}"
+
+def mirror_score(result):
+    """Estimated seconds to fetch the probe object (lower is better)."""
+    latency, rate = result
+    return latency + MIRROR_PROBE_BYTES / max(rate, 1)
+
+def rank_mirrorlist(text, results):
+    """Return *text* with Server lines ordered fastest first.
+
+    Live servers keep (or, when the list had too few, gain) an active
+    Server line; active servers that failed the probe are commented out
+    and unprobed ones follow unchanged. All other lines stay where they
+    were, above the ranked block.
+    """
+    servers = _mirror_servers(text)
+    live = sorted((mirror_score(results[_probe_url(s)]), s, active)
+                  for _, s, active in servers if results.get(_probe_url(s)))
+    enable_inactive = sum(1 for *_, active in live if active) < MIRROR_MIN_ACTIVE
+    ranked, enabled = [], 0
+    for score, server, active in live:
+        if active or (enable_inactive and enabled < MIRROR_ENABLE):
+            ranked.append(f"Server = {server}")
+            enabled += 1
+        else:
+            ranked.append(f"#Server = {server}")
+    lines = text.splitlines()
+    dead = [f"#Server = {s}  # unreachable" if active else lines[i]
+            for i, s, active in servers if not results.get(_probe_url(s))]
+    server_lines = {i for i, *_ in servers}
+    kept = [l for i, l in enumerate(lines)
+            if i not in server_lines and l != MIRROR_RANK_HEADER]
+    while kept and not kept[-1].strip():
+        kept.pop()
+    return "\n".join(kept + ["", MIRROR_RANK_HEADER] + ranked + dead) + "\n"
 
 def check_connection():
-    result = subprocess.run(
-        ["curl", "-Is", "--connect-timeout", "5", "https://www.google.com"],
-        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-    )
-    if result.returncode != 0:
+    """Probe the AUR and every mirror in parallel; rank the mirrorlist.
+
+    Runs before the first ``pacman -Sy`` so the refresh already uses the
+    fastest mirrors. The original list is kept as mirrorlist.guhwizard.bak.
+    """
+    try:
+        text = MIRRORLIST.read_text()
+    except OSError:
+        text = ""
+    import random
+    servers = _mirror_servers(text)
+    active = [s for _, s, a in servers if a]
+    candidates = list(active)
+    if len(active) < MIRROR_MIN_ACTIVE:
+        # A stock mirrorlist comments out every server: sample, don't probe hundreds
+        inactive = [s for _, s, a in servers if not a]
+        candidates += random.sample(inactive, min(len(inactive), MIRROR_PROBE_INACTIVE))
+    urls = [AUR_PROBE_URL] + list(dict.fromkeys(_probe_url(s) for s in candidates))
+    start = time.monotonic()
+    results = probe_urls(urls)
+    live = [u for u in urls[1:] if results[u]]
+    print(f"{GRA}--> Probed the AUR and {len(urls) - 1} mirrors in "
+          f"{time.monotonic() - start:.1f}s: {len(live)} reachable.{NC}")
+
+    if not results[AUR_PROBE_URL] and not live:
         print(f"{RED}[!] No internet connection.{NC}")
         return False
-
-    result = subprocess.run(
-        ["curl", "-Is", "--connect-timeout", "5", "https://aur.archlinux.org"],
-        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-    )
-    if result.returncode != 0:
+    if not results[AUR_PROBE_URL]:
         print(f"{RED}[!] Internet is fine, but AUR is currently unreachable.{NC}")
         return False
-
+    if not live:
+        print(f"{ORA}[!] No mirror answered the probe; leaving the mirrorlist alone.{NC}")
+        return True
+
+    best = min(live, key=lambda u: mirror_score(results[u]))
+    latency, rate = results[best]
+    print(f"{GRN}[OK] Fastest mirror: {urllib.parse.urlsplit(best).hostname} "
+          f"({latency * 1000:.0f} ms, {rate / (1 << 20):.1f} MiB/s){NC}")
+    if RANK_MIRRORS:
+        ranked = rank_mirrorlist(text, results)
+        if ranked != text:
+            backup = MIRRORLIST.with_name(MIRRORLIST.name + ".guhwizard.bak")
+            if not backup.exists():
+                run(["sudo", "cp", "-a", str(MIRRORLIST), str(backup)])
+            tmp = Path(TEMP_DIR) / "mirrorlist"
+            tmp.write_text(ranked)
+            run(["sudo", "install", "-m", "644", str(tmp), str(MIRRORLIST)])
+            print(f"{GRN}[OK] Mirrorlist ranked (backup: {backup.name}).{NC}")
     return True
 
+# ─── Fleet Package Repository ────────────────────────────────────────────────
+
+FLEET_REPO = "guhwm-fleet"
+PKG_CACHE_DIRS = [
+    Path("/var/cache/pacman/pkg"),
+    CACHE_DIR / "pkgs",
+    Path.home() / ".cache" / "yay",
+    Path.home() / ".cache" / "paru" / "clone",
+    Path.home() / ".cache" / "pikaur" / "pkg",
+]
+INSTALLED_AT_START = {}     # name -> version snapshot taken before the first phase
+
+def snapshot_installed():
+    """Remember what was installed before this run touched anything."""
+    PKG_INDEX.refresh()
+    INSTALLED_AT_START.update(PKG_INDEX.installed)
+
+def _find_pkg_files():
+    """Map package file name -> path across pacman's cache and all build dirs."""
+    found = {}
+    for root in PKG_CACHE_DIRS + [Path(TEMP_DIR)]:
+        if not root.is_dir():
+            continue
+        for dirpath, _, files in os.walk(root):
+            for f in files:
+                if ".pkg.tar" in f and not f.endswith(".sig"):
+                    found.setdefault(f, os.path.join(dirpath, f))
+    return found
+
+def export_repo(dest):
+    """Collect every package this run installed into a repo-add indexed repo.
+
+    Repo packages come from the pacman cache, AUR packages from the build
+    directories. Point other machines at it with --use-repo file://DEST.
+    """
+    print_banner()
+    print(f"{YLW}==> Exporting installed packages to {dest}...{NC}")
+    PKG_INDEX.refresh()
+    new = {n: v for n, v in PKG_INDEX.installed.items() if INSTALLED_AT_START.get(n) != v}
+    if not new:
+        print(f"{GRN}[OK] This run installed no new packages. Nothing to export.{NC}")
+        return
+
+    dest = Path(dest)
+    dest.mkdir(parents=True, exist_ok=True)
+    files = _find_pkg_files()
+    exported, missing = [], []
+    for name, version in sorted(new.items()):
+        prefix = f"{name}-{version}-"
+        # The remainder after name-version- is "<arch>.pkg.tar*" and has no dash
+        match = next((f for f in files if f.startswith(prefix) and "-" not in f[len(prefix):]), None)
+        if match is None:
+            missing.append(name)
+            continue
+        target = dest / match
+        if not target.exists():
+            shutil.copy2(files[match], target)
+        exported.append(str(target))
+
+    if exported:
+        run(["repo-add", "--new", "--remove", str(dest / f"{FLEET_REPO}.db.tar.gz")] + exported,
+            stdout=subprocess.DEVNULL, check=False)
+        print(f"{GRN}[SUCCESS] Exported {len(exported)} package(s) to {dest}.{NC}")
+        print(f"{GRA}--> Use it on other machines with: --use-repo file://{dest.resolve()}{NC}")
+    if missing:
+        print(f"{ORA}[!] No package file found for: {' '.join(missing)}{NC}")
+
+def use_repo(url):
+    """Add *url* as the first repository in pacman.conf so it wins over all others.
+
+    The original file is kept as pacman.conf.guhwizard.bak.
+    """
+    global DB_SYNCED
+    section = [f"[{FLEET_REPO}]", "SigLevel = Optional TrustAll", f"Server = {url.rstrip('/')}"]
+    lines = PACMAN_CONF.read_text().splitlines()
+
+    # Drop a previous copy of our section, then insert before the first repo
+    out, skip = [], False
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("["):
+            skip = stripped == f"[{FLEET_REPO}]"
+        if not skip:
+            out.append(line)
+    first_repo = next((i for i, l in enumerate(out)
+                       if l.strip().startswith("[") and l.strip() != "[options]"), len(out))
+    out[first_repo:first_repo] = section + [""]
+
+    if out == lines:
+        print(f"{GRN}[OK] {FLEET_REPO} repository already configured.{NC}")
+        return
+    print(f"{GRA}--> Preferring local repository {url}...{NC}")
+    backup = PACMAN_CONF.with_name(PACMAN_CONF.name + ".guhwizard.bak")
+    if not backup.exists():
+        run(["sudo", "cp", "-a", str(PACMAN_CONF), str(backup)])
+    tmp = Path(TEMP_DIR) / "pacman.conf"
+    tmp.write_text("\n".join(out) + "\n")
+    run(["sudo", "install", "-m", "644", str(tmp), str(PACMAN_CONF)])
+    run(["sudo", "pacman", "-Sy"])
+    DB_SYNCED = True
+
+# ─── System Tuning ───────────────────────────────────────────────────────────
+
+MAKEPKG_DROPIN = Path("/etc/makepkg.conf.d/guhwizard.conf")
+TUNING_STATE = CACHE_DIR / "tuning.json"        # original values, for --restore
+TUNE_DOWNLOADS_MIN = 5                           # pacman's own default
+TUNE_DOWNLOADS_MAX = 10
+TUNE_TMPFS_MIN_RAM = 16 << 30                    # build in /tmp only with this much RAM...
+TUNE_TMPFS_MIN_FREE = 8 << 30                    # ...and this much free tmpfs
+TUNE_UNCOMPRESSED_MIN_FREE = 50 << 30            # skip package compression above this free disk
+
+def tmpfs_free(path="/tmp"):
+    """Free bytes of *path* if it is a tmpfs mount, else 0."""
+    try:
+        mounts = Path("/proc/mounts").read_text().splitlines()
+    except OSError:
+        return 0
+    if not any(m.split()[1:3] == [path, "tmpfs"] for m in mounts):
+        return 0
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+def hardware():
+    """Cores, total RAM, free tmpfs and free disk under $HOME, in bytes."""
+    return {"cores": os.cpu_count() or 1, "ram": _meminfo("MemTotal"),
+            "tmpfs": tmpfs_free(), "disk": shutil.disk_usage(Path.home()).free}
+
+def tuned_settings(hw):
+    """Return (parallel_downloads, makepkg drop-in text) for *hw*."""
+    threads = max(1, min(hw["cores"], hw["ram"] // AUR_RAM_PER_THREAD)) if hw["ram"] else hw["cores"]
+    lines = [f"# Written by guhwizard for {hw['cores']} cores, "
+             f"{hw['ram'] / (1 << 30):.0f} GiB RAM; undo with --restore",
+             # keep the per-job -j build_env() sets for concurrent AUR builds
+             f'MAKEFLAGS="${{MAKEFLAGS:--j{threads}}}"',
+             "COMPRESSZST=(zstd -c -T0 -)"]
+    if hw["disk"] >= TUNE_UNCOMPRESSED_MIN_FREE:
+        lines.append("PKGEXT='.pkg.tar'")
+    if hw["ram"] >= TUNE_TMPFS_MIN_RAM and hw["tmpfs"] >= TUNE_TMPFS_MIN_FREE:
+        lines.append("BUILDDIR=/tmp/makepkg")
+    downloads = max(TUNE_DOWNLOADS_MIN, min(TUNE_DOWNLOADS_MAX, hw["cores"]))
+    return downloads, "\n".join(lines) + "\n"
+
+def _options_line(lines):
+    """Index of the ParallelDownloads line in [options], or of [options] itself."""
+    import re
+    setting = re.compile(r"#?\s*ParallelDownloads\s*=")
+    section, header = None, None
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith("["):
+            section = stripped
+            if section == "[options]":
+                header = i
+        elif section == "[options]" and setting.match(stripped):
+            return i, True
+    return header, False
+
+def _install_text(text, dest, mode="644"):
+    tmp = Path(TEMP_DIR) / dest.name
+    tmp.write_text(text)
+    run(["sudo", "install", "-D", "-m", mode, str(tmp), str(dest)])
+
+def _load_tuning():
+    try:
+        return json.loads(TUNING_STATE.read_text())
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def tune_system():
+    """Apply hardware-sized pacman and makepkg settings.
+
+    The makepkg settings live in their own drop-in; the only edit to
+    pacman.conf is ParallelDownloads, whose original line is remembered
+    in TUNING_STATE so --restore can put it back.
+    """
+    hw = hardware()
+    downloads, dropin = tuned_settings(hw)
+    print(f"{GRA}--> {hw['cores']} cores, {hw['ram'] / (1 << 30):.1f} GiB RAM, "
+          f"{hw['tmpfs'] / (1 << 30):.1f} GiB free tmpfs.{NC}")
+    state = _load_tuning()
+
+    lines = PACMAN_CONF.read_text().splitlines()
+    idx, found = _options_line(lines)
+    wanted = f"ParallelDownloads = {downloads}"
+    if idx is not None and not (found and lines[idx].strip() == wanted):
+        state.setdefault("parallel_downloads", lines[idx] if found else None)
+        if found:
+            lines[idx] = wanted
+        else:
+            lines.insert(idx + 1, wanted)
+        state["applied"] = wanted
+        _install_text("\n".join(lines) + "\n", PACMAN_CONF)
+
+    try:
+        current = MAKEPKG_DROPIN.read_text()
+    except OSError:
+        current = None
+    if current != dropin:
+        _install_text(dropin, MAKEPKG_DROPIN)
+    state["dropin"] = True
+
+    TUNING_STATE.parent.mkdir(parents=True, exist_ok=True)
+    TUNING_STATE.write_text(json.dumps(state, indent=1))
+    settings = [wanted] + dropin.splitlines()[1:]
+    print(f"{GRN}[OK] Tuned: {', '.join(settings)}{NC}")
+
+def restore_tuning():
+    """Undo tune_system(): drop the makepkg drop-in, restore ParallelDownloads."""
+    state = _load_tuning()
+    if not state and not MAKEPKG_DROPIN.exists():
+        print(f"{GRN}[OK] No tuned settings to restore.{NC}")
+        return 0
+    if MAKEPKG_DROPIN.exists():
+        run(["sudo", "rm", "-f", str(MAKEPKG_DROPIN)])
+        print(f"{GRN}[OK] Removed {MAKEPKG_DROPIN}.{NC}")
+
+    if "applied" in state:
+        lines = PACMAN_CONF.read_text().splitlines()
+        idx, found = _options_line(lines)
+        if found and lines[idx].strip() == state["applied"]:
+            if state.get("parallel_downloads") is None:
+                del lines[idx]
+            else:
+                lines[idx] = state["parallel_downloads"]
+            _install_text("\n".join(lines) + "\n", PACMAN_CONF)
+            print(f"{GRN}[OK] Restored ParallelDownloads in {PACMAN_CONF}.{NC}")
+        else:
+            print(f"{ORA}[!] ParallelDownloads was changed since tuning; left as is.{NC}")
+    TUNING_STATE.unlink(missing_ok=True)
+    return 0
+
 # ─── System Preparation (idempotent) ─────────────────────────────────────────
 
 def prepare_system():
+    global DB_SYNCED
     if is_done("prepare_system"):
         print(f"{GRN}[OK] System already prepared. Skipping...{NC}")
         return
@@ -455,21 +2445,94 @@ def prepare_system():
         sys.exit(1)
     print(f"{GRN}[OK] Network and AUR are available.{NC}")
 
-    print(f"{GRA}--> Refreshing Arch Keyring...{NC}")
-    run(["sudo", "pacman", "-Sy", "archlinux-keyring", "--noconfirm"])
+    print(f"{GRA}--> Tuning pacman and makepkg for this machine...{NC}")
+    tune_system()
 
-    print(f"{GRA}--> Installing base-devel and git...{NC}")
-    run(["sudo", "pacman", "-S", "--needed", "--noconfirm", "base-devel", "git"])
+    # Signatures are checked with the host keyring and packages are built
+    # on the host, so both stay on the host under --root as well
+    with on_host():
+        print(f"{GRA}--> Refreshing Arch Keyring...{NC}")
+        run(["sudo", "pacman", "-Sy", "archlinux-keyring", "--noconfirm"])
+
+        print(f"{GRA}--> Installing base-devel and git...{NC}")
+        run(["sudo", "pacman", "-S", "--needed", "--noconfirm", "base-devel", "git"])
+    if TARGET_ROOT is not None:
+        print(f"{GRA}--> Syncing package databases in {TARGET_ROOT}...{NC}")
+        run(["sudo", "pacman", "-Sy", "--noconfirm"])
+    DB_SYNCED = True
 
     mark_done("prepare_system")
 
 # ─── AUR Helper Setup (idempotent) ───────────────────────────────────────────
 
+HELPER_BIN_PKGS = {"yay": "yay-bin", "paru": "paru-bin"}
+HELPER_TOOLCHAINS = {"yay": "go", "paru": "rust"}
+
+def _has_checksums(src):
+    """True when the PKGBUILD in *src* pins at least one real (non-SKIP) checksum."""
+    import re
+    try:
+        text = (Path(src) / "PKGBUILD").read_text(errors="replace")
+    except OSError:
+        return False
+    arrays = re.findall(r"^(?:sha\d+|b2|md5|ck)sums(?:_\w+)?=\(([^)]*)\)", text, re.M)
+    return any(s.strip("'\"") not in ("", "SKIP") for a in arrays for s in a.split())
+
+def bootstrap_helper_bin(helper, env=None):
+    """Install the prebuilt ``<helper>-bin`` package instead of compiling.
+
+    The PKGBUILD must pin checksums for its release tarball; makepkg
+    verifies them before packaging. Returns False (so the caller falls
+    back to the source build) on any failure.
+    """
+    bin_pkg = HELPER_BIN_PKGS.get(helper)
+    if not bin_pkg:
+        return False
+    try:
+        if not aur_info([bin_pkg]).get(bin_pkg):
+            return False
+    except (urllib.error.URLError, OSError, ValueError):
+        pass    # RPC unreachable: let the clone below decide
+    print(f"{GRA}--> Bootstrapping {helper} from the prebuilt {bin_pkg}...{NC}")
+    bin_dir = os.path.join(TEMP_DIR, bin_pkg)
+    result = run(["git", "clone", "--depth", "1", f"https://aur.archlinux.org/{bin_pkg}.git", bin_dir],
+                 check=False)
+    if result.returncode != 0:
+        print(f"{ORA}[!] Could not fetch {bin_pkg}, building {helper} from source.{NC}")
+        return False
+    if not _has_checksums(bin_dir):
+        print(f"{ORA}[!] {bin_pkg} has no pinned checksums, building {helper} from source.{NC}")
+        return False
+    if not makepkg_install(bin_dir, env=env):
+        print(f"{ORA}[!] {bin_pkg} failed to install, building {helper} from source.{NC}")
+        return False
+    print(f"{GRN}[OK] Installed {bin_pkg} (no toolchain needed).{NC}")
+    return True
+
+def remove_toolchain(toolchain):
+    """Offer to remove a compiler installed only to build the AUR helper."""
+    if not toolchain or toolchain in INSTALLED_AT_START:
+        return
+    PKG_INDEX.refresh()
+    if not PKG_INDEX.is_installed(toolchain):
+        return
+    default = "y" if PROFILE and PROFILE["options"].get("remove_toolchain") else "n"
+    answer = ask(f"{YLW}==> Remove the {toolchain} toolchain to reclaim disk space? (y/n): {NC}",
+                 default).strip()
+    if answer.lower() == "y":
+        run(["sudo", "pacman", "-Rns", "--noconfirm", toolchain], check=False)
+
 def setup_aur_helper():
-    global AUR_HELPER, AUR_CLR, LAST_SELECTION
+    global AUR_HELPER, AUR_CLR, LAST_SELECTION, DB_SYNCED
 
-    print(f"{GRA}--> Syncing package databases...{NC}")
-    run(["sudo", "pacman", "-Syu", "--noconfirm"])
+    # prepare_system already refreshed the databases this run: upgrade only
+    if DB_SYNCED:
+        print(f"{GRA}--> Upgrading system packages...{NC}")
+        run(["sudo", "pacman", "-Su", "--noconfirm"])
+    else:
+        print(f"{GRA}--> Syncing package databases...{NC}")
+        run(["sudo", "pacman", "-Syu", "--noconfirm"])
+        DB_SYNCED = True
 
     # ── Idempotency: if a working AUR helper exists, skip entirely ──
     if AUR_HELPER:
@@ -496,9 +2559,9 @@ def setup_aur_helper():
 
     # ── Idempotency: if the chosen helper binary already works, skip build ──
     if shutil.which(AUR_HELPER):
-        result = subprocess.run([AUR_HELPER, "--version"],
-                                stdout=subprocess.DEVNULL,
-                                stderr=subprocess.DEVNULL)
+        result = run([AUR_HELPER, "--version"],
+                     stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, check=False)
         if result.returncode == 0:
             print(f"{GRN}[OK] {AUR_HELPER} is already installed and functional.{NC}")
             detect_aur()
@@ -506,44 +2569,37 @@ def setup_aur_helper():
 
     # Conflict handling
     print(f"{GRA}--> Preparing environment for {AUR_HELPER}...{NC}")
-    result = subprocess.run(
-        f"pacman -Qq | grep -E '^{AUR_HELPER}'",
-        shell=True, capture_output=True, text=True
-    )
-    conflicts = result.stdout.strip()
+    PKG_INDEX.refresh()
+    conflict_pkgs = sorted(p for p in PKG_INDEX.installed if p.startswith(AUR_HELPER))
 
-    if conflicts:
+    if conflict_pkgs:
         print(f"{GRN}[+] Cleaning up existing {AUR_HELPER} files for a fresh start...{NC}")
-        conflict_pkgs = conflicts.split()
-        subprocess.run(
-            ["sudo", "pacman", "-Rns", "--noconfirm"] + conflict_pkgs,
-            stderr=subprocess.DEVNULL
-        )
+        run(["sudo", "pacman", "-Rns", "--noconfirm"] + conflict_pkgs,
+            check=False, stderr=subprocess.DEVNULL)
 
-    # Pre-install compilers
-    if AUR_HELPER == "yay":
-        run(["sudo", "pacman", "-S", "--needed", "--noconfirm", "go"])
-    elif AUR_HELPER == "paru":
-        run(["sudo", "pacman", "-S", "--needed", "--noconfirm", "rust"])
+    # Sole build running: the whole thread budget goes to this one job
+    env = build_env(build_budget(1)[1])
 
-    os.chdir(TEMP_DIR)
-    run(["git", "clone", f"https://aur.archlinux.org/{aur_helper_pkg}.git"])
-    os.chdir(aur_helper_pkg)
+    path = "bin" if bootstrap_helper_bin(aur_helper_pkg, env) else "source"
+    if path == "source":
+        helper_dir = os.path.join(TEMP_DIR, aur_helper_pkg)
+        run(["git", "clone", f"https://aur.archlinux.org/{aur_helper_pkg}.git", helper_dir])
 
-    env = os.environ.copy()
-    nproc = subprocess.run(["nproc"], capture_output=True, text=True).stdout.strip()
-    env["MAKEFLAGS"] = f"-j{nproc}"
-    env["PKGEXT"] = ".pkg.tar"
+        # Pre-install compilers (not needed when a cached build can be reused)
+        toolchain = HELPER_TOOLCHAINS.get(AUR_HELPER)
+        if toolchain and not pkg_cache_lookup(pkg_cache_key(helper_dir)):
+            run(["sudo", "pacman", "-S", "--needed", "--noconfirm", toolchain])
 
-    result = subprocess.run(["makepkg", "-si", "--noconfirm"], env=env)
-    if result.returncode != 0:
-        print(f"{RED}[!] Failed to build AUR helper. Please try manually.{NC}")
-        sys.exit(1)
+        if not makepkg_install(helper_dir, env=env):
+            print(f"{RED}[!] Failed to build AUR helper. Please try manually.{NC}")
+            sys.exit(1)
+        remove_toolchain(toolchain)
 
-    os.chdir(Path.home())
+    RUN_LOG["aur_helper"] = {"name": AUR_HELPER, "path": path}
+    checkpoint("aur_helper", "bootstrap", installed=[AUR_HELPER], path=path)
     detect_aur()
     print()
-    input(f"{YLW}==> {AUR_HELPER} is ready. Press Enter to continue...{NC}")
+    pause(f"{AUR_HELPER} is ready. ")
 
 # ─── Install Base Packages (idempotent) ──────────────────────────────────────
 
@@ -571,7 +2627,7 @@ def install_base():
         "wl-clipboard", "wlsunset", "xorg-xwayland", "mangowc-git",
         
         # UI Components
-        "waybar", "rofi", "swaync", "libnotify", "adw-gtk-theme",
+        "waybar", "rofi", "swaync", "libnotify", "adw-gtk-theme", "imagemagick",
         
         # Audio Stack
         "alsa-utils", "pipewire", "pipewire-pulse", "wireplumber",
@@ -581,51 +2637,661 @@ def install_base():
         "ttf-jetbrains-mono-nerd", "cantarell-fonts",
     ]
 
-    smart_install(base_pkgs)
+    if not step_done("install_base", "packages"):
+        smart_install(base_pkgs)
 
-    # Initialize standard user directories (idempotent)
-    subprocess.run(["xdg-user-dirs-update"],
-                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # Initialize standard user directories (idempotent)
+        run(["xdg-user-dirs-update"], env=dict(os.environ, HOME=str(target_home())),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
 
-    home = Path.home()
-    for d in ["Public", "Templates"]:
-        p = home / d
-        if p.is_dir():
-            shutil.rmtree(p, ignore_errors=True)
+        home = target_home()
+        for d in ["Public", "Templates"]:
+            p = home / d
+            if p.is_dir():
+                shutil.rmtree(p, ignore_errors=True)
 
-    setup_user_groups()
+        setup_user_groups()
+        checkpoint("install_base", "packages", installed=base_pkgs)
 
-    print()
-    input(f"{YLW}==> Base packages are installed. Press Enter to continue...{NC}")
+        print()
+        pause("Base packages are installed. ")
 
+    # Enabled together with the rest of the run's units by apply_units()
     enable_service("seatd")
-    print()
+    enable_service("NetworkManager", now=True)
+    enable_service("bluetooth")
+    enable_service("dbus", now=True)
+    for unit in ("pipewire", "pipewire-pulse", "wireplumber"):
+        enable_service(unit, scope="user")
 
-    # ── PipeWire user services (skip if already enabled) ──
-    pw_units = ["pipewire", "pipewire-pulse", "wireplumber"]
-    units_to_enable = [u for u in pw_units if not is_user_service_enabled(u)]
-    if units_to_enable:
-        print(f"{GRA}--> Enabling PipeWire user services...{NC}")
-        subprocess.run(
-            ["systemctl", "--user", "enable"] + units_to_enable,
-            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-        )
-    else:
-        print(f"{GRN}[OK] PipeWire user services already enabled.{NC}")
+    mark_done("install_base")
 
-    # Enable NetworkManager (idempotent via enable_service guard)
-    print(f"{GRA}--> Enabling NetworkManager...{NC}")
-    if not is_service_enabled("NetworkManager"):
-        run(["sudo", "systemctl", "enable", "--now", "NetworkManager"])
+# ─── Config Deployment ───────────────────────────────────────────────────────
+
+DEPLOY_MANIFEST = CACHE_DIR / "deploy-manifest.json"
+DEPLOY_BASE_DIR = CACHE_DIR / "deploy-base"     # pristine upstream blobs, by hash
+GUHWM_SHARE = Path.home() / ".local" / "share" / "guhwm"
+DEPLOY_BASE_MAX = 1 << 20                       # keep merge bases for text files up to 1 MiB
+
+def _file_hash(path):
+    import hashlib
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _is_text(path):
+    with open(path, "rb") as f:
+        return b"\0" not in f.read(8192)
+
+def _atomic_copy(src, dst):
+    """Copy *src* over *dst* via a temp file in the same dir (mode and mtime kept)."""
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{dst.name}.", dir=dst.parent)
+    os.close(fd)
+    try:
+        shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def _backup_numbered(path):
+    """Rename *path* to the next free ``path.~N~`` (like cp --backup=numbered)."""
+    n = 1
+    while os.path.lexists(f"{path}.~{n}~"):
+        n += 1
+    os.rename(path, f"{path}.~{n}~")
+    return f"{path}.~{n}~"
+
+def _save_base(src, digest):
+    """Keep the upstream version of a text file as the base for later merges."""
+    blob = DEPLOY_BASE_DIR / digest
+    if not blob.exists() and os.path.getsize(src) <= DEPLOY_BASE_MAX and _is_text(src):
+        DEPLOY_BASE_DIR.mkdir(parents=True, exist_ok=True)
+        _atomic_copy(src, blob)
+
+def _merge(current, base_digest, upstream):
+    """Three-way merge of a user-edited file; returns merged bytes or None on conflict."""
+    base = DEPLOY_BASE_DIR / base_digest
+    if not base.is_file() or not shutil.which("git"):
+        return None
+    result = run(["git", "merge-file", "-p", "--quiet", str(current), str(base), str(upstream)],
+                 capture_output=True, check=False)
+    return result.stdout if result.returncode == 0 else None
+
+class ConfigDeployer:
+    """Incremental, manifest-driven copy of an upstream tree into $HOME.
+
+    The manifest records the upstream hash last written to each target:
+
+    * target missing, or untouched since the last deploy → write upstream
+    * target already identical to upstream → nothing to do
+    * target edited by the user, upstream unchanged since → left alone
+    * target edited by the user, upstream changed → three-way merge against the recorded
+      base; on conflict the user's file stays and upstream lands next to
+      it as ``<file>.guhwm-new``
+    * target present but never deployed by us → numbered backup, then write
+
+    In link mode the content lives under ~/.local/share/guhwm and every
+    target is a symlink to it, so later deploys update configs in place.
+    A rerun with unchanged upstream performs no writes at all.
+    """
+    def __init__(self, path=None):
+        self.path = Path(path or DEPLOY_MANIFEST)
+        try:
+            self.files = json.loads(self.path.read_text()).get("files", {})
+        except (OSError, ValueError):
+            self.files = {}
+        self.dirty = False
+        self.stats = {"written": 0, "merged": 0, "kept": 0, "unchanged": 0}
+
+    def save(self):
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"version": 1, "files": self.files}, indent=1))
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def _record(self, target, digest, link):
+        entry = {"hash": digest, "link": link}
+        if self.files.get(target) != entry:
+            self.files[target] = entry
+            self.dirty = True
+
+    def _deploy_file(self, src, content, digest):
+        """Bring *content* (the file holding the config) up to upstream *src*."""
+        key = str(content)
+        recorded = self.files.get(key, {}).get("hash")
+        if not os.path.lexists(content) or os.path.islink(content) and not content.exists():
+            if os.path.islink(content):
+                os.unlink(content)
+            _atomic_copy(src, content)
+            self.stats["written"] += 1
+            return
+        current = _file_hash(content)
+        if current == digest:
+            self.stats["unchanged"] += 1
+        elif current == recorded:
+            _atomic_copy(src, content)
+            self.stats["written"] += 1
+        elif recorded == digest:
+            self.stats["kept"] += 1     # edited here, nothing new upstream: leave it
+        elif recorded is None:
+            print(f"{GRA}--> Backing up existing {content} to {_backup_numbered(content)}{NC}")
+            _atomic_copy(src, content)
+            self.stats["written"] += 1
+        else:
+            merged = _merge(content, recorded, src)
+            if merged is not None and merged == content.read_bytes():
+                self.stats["unchanged"] += 1
+            elif merged is not None:
+                fd, tmp = tempfile.mkstemp(prefix=f".{content.name}.", dir=content.parent)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(merged)
+                shutil.copymode(content, tmp)
+                os.replace(tmp, content)
+                self.stats["merged"] += 1
+            else:
+                new = content.with_name(content.name + ".guhwm-new")
+                if not new.is_file() or _file_hash(new) != digest:
+                    _atomic_copy(src, new)
+                print(f"{ORA}[!] Kept your edited {content}; upstream version is in {new.name}{NC}")
+                self.stats["kept"] += 1
+                return      # keep the old base so the next deploy can retry the merge
+
+    def install(self, src, content, link=False):
+        """Bring the single file *content* up to date with upstream *src*."""
+        digest = _file_hash(src)
+        before = self.stats["kept"]
+        self._deploy_file(src, content, digest)
+        if self.stats["kept"] == before:
+            _save_base(src, digest)
+            self._record(str(content), digest, link)
+
+    def deploy(self, src_root, dest_root, link=False, store=None, templates=()):
+        """Deploy every file under *src_root* to the same path under *dest_root*.
+
+        With *link*, content goes to *store* (default GUHWM_SHARE/<dest name>)
+        and each target becomes a symlink to it. Paths listed in *templates*
+        (relative to *src_root*) go to TEMPLATE_DIR instead; render_templates()
+        produces their real targets.
+        """
+        src_root, dest_root = Path(src_root), Path(dest_root)
+        store = Path(store) if store else GUHWM_SHARE / dest_root.name.lstrip(".")
+        for dirpath, dirs, files in os.walk(src_root):
+            dirs[:] = [d for d in dirs if d != ".git"]
+            for name in files:
+                src = Path(dirpath) / name
+                rel = src.relative_to(src_root)
+                if str(rel) in templates:
+                    self.install(src, TEMPLATE_DIR / rel)
+                    continue
+                target = dest_root / rel
+                content = store / rel if link else target
+                self.install(src, content, link)
+                if link and not (target.is_symlink() and os.readlink(target) == str(image_path(content))):
+                    if os.path.lexists(target):
+                        ours = self.files.get(str(target), {}).get("hash")
+                        if target.is_symlink() or ours == _file_hash(target):
+                            os.unlink(target)       # a link or an unedited copy of ours
+                            self.files.pop(str(target), None)
+                            self.dirty = True
+                        else:
+                            print(f"{GRA}--> Backing up existing {target} to "
+                                  f"{_backup_numbered(target)}{NC}")
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    os.symlink(image_path(content), target)
+                    self.stats["written"] += 1
+        self.save()
+        return self.stats
+
+# ─── Config Templates ────────────────────────────────────────────────────────
+
+TEMPLATE_DIR = GUHWM_SHARE / "templates"           # pristine templates, relative to ~/.config
+TEMPLATE_VARS_FILE = CACHE_DIR / "template-vars.json"
+TEMPLATE_FILES = ["mango/config.conf"]
+GUI_FILE_MANAGERS = {"nautilus", "nemo", "dolphin"}
+TEMPLATE_VARS = None
+
+def template_vars():
+    """Placeholder bindings collected so far (persisted across runs)."""
+    global TEMPLATE_VARS
+    if TEMPLATE_VARS is None:
+        try:
+            TEMPLATE_VARS = json.loads(TEMPLATE_VARS_FILE.read_text())
+        except (OSError, ValueError):
+            TEMPLATE_VARS = {}
+    return TEMPLATE_VARS
+
+def save_template_vars():
+    TEMPLATE_VARS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = TEMPLATE_VARS_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(template_vars(), indent=1))
+    os.replace(tmp, TEMPLATE_VARS_FILE)
+
+def bind(placeholder, value):
+    """Bind *placeholder* to *value* for the next render_templates()."""
+    template_vars()[placeholder] = value
+    save_template_vars()
+
+def bind_terminal(selection):
+    bind("YOURTERMINAL", selection)
+
+def bind_editor(selection):
+    bind("YOUREDITOR", selection)
+
+def bind_file_manager(selection):
+    """Point the mango file-manager keybind at *selection*."""
+    if selection in GUI_FILE_MANAGERS:
+        # GUI file managers don't need a terminal wrapper
+        bind("YOURTERMINAL -e YOURFILEMANAGER", selection)
     else:
-        print(f"{GRN}[OK] NetworkManager already enabled.{NC}")
+        # TUI file managers need to run inside a terminal
+        template_vars().pop("YOURTERMINAL -e YOURFILEMANAGER", None)
+    bind("YOURFILEMANAGER", selection)
 
-    # Enable Bluetooth
-    print(f"{GRA}--> Enabling Bluetooth service...{NC}")
-    enable_service("bluetooth")
-    time.sleep(2)
+TEMPLATE_BINDERS = {"terminal": bind_terminal, "editor": bind_editor,
+                    "filemanager": bind_file_manager}
 
-    mark_done("install_base")
+def render(text, bindings):
+    """Substitute every bound placeholder in one pass, longest match first.
+
+    Longest-first makes composite keys such as ``YOURTERMINAL -e
+    YOURFILEMANAGER`` win over their parts regardless of binding order.
+    """
+    import re
+    if not bindings:
+        return text
+    pattern = re.compile("|".join(re.escape(k) for k in sorted(bindings, key=len, reverse=True)))
+    return pattern.sub(lambda m: bindings[m.group(0)], text)
+
+def render_templates(deployer=None):
+    """Render every template into ~/.config with the current bindings.
+
+    Each output goes through ConfigDeployer, so it is written atomically,
+    only when it changed, and edits made to the rendered file are merged.
+    Returns the number of templates rendered.
+    """
+    import hashlib
+    deployer = deployer or ConfigDeployer()
+    bindings = template_vars()
+    rendered = 0
+    for rel in TEMPLATE_FILES:
+        template = TEMPLATE_DIR / rel
+        if not template.is_file():
+            continue
+        target = target_home() / ".config" / rel
+        text = render(template.read_text(), bindings)
+        rendered += 1
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        if target.is_file() and deployer.files.get(str(target), {}).get("hash") == digest \
+                and _file_hash(target) == digest:
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=f".{target.name}.", dir=target.parent)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            shutil.copymode(template, tmp)
+            deployer.install(tmp, target)
+        finally:
+            os.unlink(tmp)
+    deployer.save()
+    return rendered
+
+def rerender(assignments):
+    """``--render terminal=foot ...``: rebind and re-render without reinstalling."""
+    for item in assignments:
+        name, sep, value = item.partition("=")
+        binder = TEMPLATE_BINDERS.get(name.strip().lower())
+        if not sep or not binder or not value.strip():
+            print(f"{RED}[!] --render expects NAME=VALUE with NAME one of: "
+                  f"{', '.join(TEMPLATE_BINDERS)}.{NC}")
+            return 1
+        binder(value.strip())
+    if not render_templates():
+        print(f"{RED}[!] No templates in {TEMPLATE_DIR}; run the installer once first.{NC}")
+        return 1
+    print(f"{GRN}[OK] Configs re-rendered.{NC}")
+    return 0
+
+# ─── Wallpaper Variants ──────────────────────────────────────────────────────
+
+WALLPAPER_CACHE = CACHE_DIR / "wallpapers"      # <image hash>/<WxH>.<ext> and thumb.jpg
+WALLPAPER_OUT = Path.home() / ".cache" / "guhwm"  # wallpapers/<WxH>/<name>, thumbnails/<name>.jpg
+WALLPAPER_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+WALLPAPER_MAX_JOBS = 4
+THUMB_SIZE = "320x180"
+DRM_CLASS = Path("/sys/class/drm")
+
+def output_resolutions():
+    """Preferred mode of every connected output, e.g. ["1920x1080", "2560x1440"]."""
+    import re
+    sizes = set()
+    for conn in DRM_CLASS.glob("card*-*"):
+        try:
+            if (conn / "status").read_text().strip() != "connected":
+                continue
+            modes = (conn / "modes").read_text().split()
+        except OSError:
+            continue
+        m = re.match(r"(\d+x\d+)", modes[0]) if modes else None
+        if m:
+            sizes.add(m.group(1))
+    return sorted(sizes)
+
+def _scale_image(src, out, size, thumb=False):
+    """Cover-scale *src* to exactly *size* (crop to centre, like swww's default)."""
+    tmp = out.with_name(f".{out.name}.{threading.get_ident()}")
+    cmd = ["magick", str(src), "-thumbnail" if thumb else "-resize", f"{size}^",
+           "-gravity", "center", "-extent", size, "-strip"]
+    if out.suffix in (".jpg", ".jpeg"):
+        cmd += ["-quality", "85" if thumb else "92"]
+    result = run(cmd + [f"{out.suffix[1:]}:{tmp}"], capture_output=True, check=False)
+    if result.returncode != 0:
+        tmp.unlink(missing_ok=True)
+        return False
+    os.replace(tmp, out)
+    return True
+
+def _publish(link, target):
+    """Point *link* at *target*, writing only if it does not already.
+
+    Under --root the cache stays on the build host, so *link* is a copy.
+    """
+    if TARGET_ROOT is not None:
+        if not link.is_symlink() and link.is_file() \
+                and os.stat(link).st_mtime == os.stat(target).st_mtime:
+            return
+        if link.is_symlink():
+            link.unlink()
+        _atomic_copy(target, link)
+        return
+    if link.is_symlink() and os.readlink(link) == str(target):
+        return
+    link.parent.mkdir(parents=True, exist_ok=True)
+    if os.path.lexists(link):
+        link.unlink()
+    os.symlink(target, link)
+
+def prepare_wallpapers(src_dir):
+    """Pre-scale every wallpaper to each connected output and make thumbnails.
+
+    Results are cached by image content hash and size, so only new
+    images or new resolutions are scaled; swww and the guhwall picker
+    then load small files instead of decoding full-size originals.
+    Returns the published directories.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    src_dir = Path(src_dir)
+    if not shutil.which("magick"):
+        print(f"{ORA}[!] ImageMagick not found, skipping wallpaper pre-scaling.{NC}")
+        return []
+    images = sorted(p for p in src_dir.glob("*") if p.suffix.lower() in WALLPAPER_EXTS)
+    sizes = output_resolutions()
+    print(f"{GRA}--> Preparing {len(images)} wallpapers for "
+          f"{', '.join(sizes) or 'no detected outputs'}...{NC}")
+
+    jobs, links = [], []
+    for img in images:
+        entry = WALLPAPER_CACHE / _file_hash(img)[:32]
+        entry.mkdir(parents=True, exist_ok=True)
+        ext = ".png" if img.suffix.lower() == ".png" else ".jpg"
+        wanted = [(entry / f"{size}{ext}", size, False, WALLPAPER_OUT / "wallpapers" / size / img.name)
+                  for size in sizes]
+        wanted.append((entry / "thumb.jpg", THUMB_SIZE, True,
+                       WALLPAPER_OUT / "thumbnails" / f"{img.stem}.jpg"))
+        for out, size, thumb, link in wanted:
+            if not out.is_file():
+                jobs.append((img, out, size, thumb))
+            links.append((link, out))
+
+    failed = set()
+    if jobs:
+        workers = min(WALLPAPER_MAX_JOBS, os.cpu_count() or 1, len(jobs))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(lambda job: _scale_image(*job), jobs)
+            failed = {job[1] for job, ok in zip(jobs, results) if not ok}
+    for link, out in links:
+        if out not in failed:
+            _publish(link, out)
+
+    made = len(jobs) - len(failed)
+    print(f"{GRN}[OK] Wallpapers: {made} scaled, {len(links) - len(jobs)} reused"
+          f"{f', {len(failed)} failed' if failed else ''}.{NC}")
+    return [str(WALLPAPER_OUT / "wallpapers"), str(WALLPAPER_OUT / "thumbnails")]
+
+# ─── Wallpaper Palettes ──────────────────────────────────────────────────────
+
+PALETTE_STORE = CACHE_DIR / "palettes"          # <image md5>.json, pywal's colors.json schema
+WAL_CACHE = Path.home() / ".cache" / "wal"
+PALETTE_BACKEND = "wal"                         # --palette-backend: "wal" (pywal) or "numpy"
+
+# Runs inside pywal16's pipx venv. For each image: reuse a stored palette
+# (content-keyed, same md5 pywal checks) by writing it as pywal's own
+# scheme cache entry, or let pywal compute it once and store the result.
+PALETTE_HELPER = r"""
+import json, os, sys
+from concurrent.futures import ThreadPoolExecutor
+from pywal import colors, util
+
+args = json.loads(sys.argv[1])
+
+def one(img):
+    saved = os.path.join(args["store"], util.get_img_checksum(img) + ".json")
+    scheme = os.path.join(*colors.cache_fname(img, args["backend"], False, args["wal_dir"], "", c16=False))
+    if os.path.isfile(saved) and not os.path.isfile(scheme):
+        with open(saved) as f:
+            palette = json.load(f)
+        palette["wallpaper"] = colors.normalize_img_path(img)
+        util.save_file_json(palette, scheme)
+        return "hit"
+    palette = colors.get(img, backend=args["backend"], cache_dir=args["wal_dir"])
+    if os.path.isfile(saved):
+        return "hit"
+    util.save_file_json(palette, saved)
+    return "new"
+
+with ThreadPoolExecutor(max_workers=args["jobs"]) as pool:
+    print(json.dumps(list(pool.map(one, args["images"]))))
+"""
+
+def pywal_python():
+    """Interpreter of the pywal16 pipx venv, or None if it is not installed."""
+    venvs = Path.home() / ".local" / "share" / "pipx" / "venvs"
+    if shutil.which("pipx"):
+        result = run(["pipx", "environment", "--value", "PIPX_LOCAL_VENVS"],
+                     capture_output=True, text=True, check=False)
+        if result.returncode == 0 and result.stdout.strip():
+            venvs = Path(result.stdout.strip())
+    python = venvs / "pywal16" / "bin" / "python"
+    return str(python) if python.is_file() else None
+
+def precompute_palettes_numpy(images):
+    """Fill the palette store with the built-in extractor; returns how many it computed."""
+    import hashlib
+    from concurrent.futures import ThreadPoolExecutor
+
+    def one(img):
+        with open(img, "rb") as f:
+            saved = PALETTE_STORE / (hashlib.md5(f.read(), usedforsecurity=False).hexdigest() + ".json")
+        if saved.is_file():
+            return False
+        palette = extract_palette(img)
+        if palette is None:
+            return False
+        saved.write_text(json.dumps(palette, indent=4))
+        return True
+
+    with ThreadPoolExecutor(max_workers=min(WALLPAPER_MAX_JOBS, os.cpu_count() or 1)) as pool:
+        return sum(pool.map(one, images))
+
+def cache_palettes(src_dir):
+    """Precompute pywal palettes for every image in *src_dir*.
+
+    Palettes are stored by image content hash and also written to
+    pywal's ~/.cache/wal/schemes, so choosing one of these wallpapers
+    later never runs colour extraction again. Returns (new, reused).
+    """
+    images = sorted(str(p) for p in Path(src_dir).glob("*") if p.suffix.lower() in WALLPAPER_EXTS)
+    if not images:
+        return 0, 0
+    print(f"{GRA}--> Precomputing colour palettes for {len(images)} wallpapers...{NC}")
+    PALETTE_STORE.mkdir(parents=True, exist_ok=True)
+    computed = precompute_palettes_numpy(images) if PALETTE_BACKEND == "numpy" else 0
+    python = pywal_python()
+    if not python:
+        print(f"{ORA}[!] pywal16 not found, palettes were not added to its cache.{NC}")
+        return computed, 0
+    # Built-in palettes are filed under pywal's default backend so `wal -i` finds them
+    args = {"images": images, "store": str(PALETTE_STORE), "wal_dir": str(WAL_CACHE),
+            "backend": "wal", "jobs": min(WALLPAPER_MAX_JOBS, os.cpu_count() or 1)}
+    result = run([python, "-c", PALETTE_HELPER, json.dumps(args)],
+                 capture_output=True, text=True, check=False)
+    if result.returncode != 0:
+        print(f"{ORA}[!] Palette precomputation failed: "
+              f"{(result.stderr.strip().splitlines() or ['unknown error'])[-1]}{NC}")
+        return computed, 0
+    outcome = json.loads(result.stdout.strip().splitlines()[-1])
+    new, reused = outcome.count("new") + computed, outcome.count("hit") - computed
+    print(f"{GRN}[OK] Palettes: {new} computed, {reused} reused.{NC}")
+    return new, reused
+
+# ─── Built-in Palette Extractor ──────────────────────────────────────────────
+
+PALETTE_SAMPLE = "128x128"          # pixels fed to k-means after downscaling
+PALETTE_KMEANS_ITERS = 12
+
+def _hex(rgb):
+    return "#%02x%02x%02x" % tuple(int(c) for c in rgb)
+
+def _rgb(color):
+    return tuple(bytes.fromhex(color.strip("#")))
+
+def _darken(color, amount):
+    return _hex(c * (1 - amount) for c in _rgb(color))
+
+def _lighten(color, amount):
+    return _hex(c + (255 - c) * amount for c in _rgb(color))
+
+def _saturate(color, amount):
+    import colorsys
+    h, l, _ = colorsys.rgb_to_hls(*(c / 255 for c in _rgb(color)))
+    return _hex(c * 255 for c in colorsys.hls_to_rgb(h, l, amount))
+
+def _sample_pixels(img):
+    """Decode *img* already shrunk to PALETTE_SAMPLE, as raw RGB bytes.
+
+    ``jpeg:size`` lets libjpeg scale while decoding, so a 4K JPEG never
+    gets fully decompressed.
+    """
+    result = run(["magick", "-define", f"jpeg:size={PALETTE_SAMPLE}", f"{img}[0]",
+                  "-thumbnail", f"{PALETTE_SAMPLE}>", "-alpha", "off", "-depth", "8", "rgb:-"],
+                 capture_output=True, check=False)
+    return result.stdout if result.returncode == 0 else b""
+
+def extract_palette(img):
+    """pywal-compatible 16-colour palette for *img* using NumPy k-means.
+
+    Mirrors pywal's "wal" backend: 16 clusters ordered by luminance,
+    then the same dark-theme adjustment. Returns the colors.json dict,
+    or None when NumPy or ImageMagick is unavailable.
+    """
+    import hashlib
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    raw = _sample_pixels(img)
+    if len(raw) < 3 * 16:
+        return None
+    pixels = np.frombuffer(raw, dtype=np.uint8)[:len(raw) // 3 * 3].reshape(-1, 3).astype(np.float32)
+
+    # k-means, seeded at luminance quantiles so the result is deterministic
+    luma = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    order = np.argsort(luma)
+    centers = pixels[order[np.linspace(0, len(order) - 1, 16).astype(int)]]
+    for _ in range(PALETTE_KMEANS_ITERS):
+        dist = (pixels ** 2).sum(1)[:, None] - 2 * pixels @ centers.T + (centers ** 2).sum(1)[None]
+        labels = dist.argmin(1)
+        counts = np.bincount(labels, minlength=16)[:, None]
+        sums = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=16) for c in range(3)], 1)
+        moved = np.where(counts > 0, sums / np.maximum(counts, 1), centers)
+        if np.allclose(moved, centers, atol=0.5):
+            break
+        centers = moved.astype(np.float32)
+    centers = centers[np.argsort(centers @ np.array([0.299, 0.587, 0.114], dtype=np.float32))]
+    cols = [_hex(c) for c in centers]
+
+    # pywal wal backend: cols[:1] + cols[8:16] + cols[8:-1], then generic_adjust (dark)
+    colors = cols[:1] + cols[8:16] + cols[8:-1]
+    if colors[0][1] != "0":
+        colors[0] = _darken(colors[0], 0.40)
+    if "0" in (colors[0][1], colors[0][3], colors[0][5]):
+        colors[0] = _saturate(_lighten(colors[0], 0.03), 0.40)
+    colors[7] = _lighten(colors[0], 0.75)
+    colors[8] = _saturate(_lighten(colors[0], 0.35), 0.10)
+    colors[15] = colors[7]
+
+    with open(img, "rb") as f:
+        checksum = hashlib.md5(f.read(), usedforsecurity=False).hexdigest()
+    return {
+        "checksum": checksum,
+        "wallpaper": str(img),
+        "alpha": "100",
+        "special": {"background": colors[0], "foreground": colors[15], "cursor": colors[15]},
+        "colors": {f"color{i}": c for i, c in enumerate(colors)},
+    }
+
+def write_wal_files(palette, wal_dir=None):
+    """Write the pywal outputs guhwm reads (waybar/swaync/GTK CSS, colors, ...)."""
+    wal_dir = Path(wal_dir or WAL_CACHE)
+    wal_dir.mkdir(parents=True, exist_ok=True)
+    named = dict(palette["special"], **palette["colors"])
+    cols = [palette["colors"][f"color{i}"] for i in range(16)]
+    files = {
+        "colors.json": json.dumps(palette, indent=4),
+        "colors": "\n".join(cols) + "\n",
+        "colors-waybar.css": "".join(f"@define-color {k} {named[k]};\n"
+                                     for k in ("foreground", "background", "cursor"))
+                             + "\n" + "".join(f"@define-color color{i} {c};\n" for i, c in enumerate(cols)),
+        "colors.css": ":root {\n"
+                      f"  --wallpaper: url(\"{palette['wallpaper']}\");\n\n"
+                      + "".join(f"  --{k}: {named[k]};\n" for k in ("background", "foreground", "cursor"))
+                      + "\n" + "".join(f"  --color{i}: {c};\n" for i, c in enumerate(cols)) + "}\n",
+        "colors.properties": "".join(f"{k}={named[k]}\n" for k in ("background", "foreground", "cursor"))
+                             + "\n" + "".join(f"color{i}={c}\n" for i, c in enumerate(cols)),
+        "wal": palette["wallpaper"],
+    }
+    for name, text in files.items():
+        tmp = wal_dir / f".{name}.tmp"
+        tmp.write_text(text)
+        os.replace(tmp, wal_dir / name)
+
+def apply_palette(img):
+    """``--wal IMG``: theme from *img* with the built-in extractor (cached by content)."""
+    import hashlib
+    img = os.path.abspath(img)
+    with open(img, "rb") as f:
+        saved = PALETTE_STORE / (hashlib.md5(f.read(), usedforsecurity=False).hexdigest() + ".json")
+    try:
+        palette = json.loads(saved.read_text())
+        palette["wallpaper"] = img
+    except (OSError, ValueError):
+        palette = extract_palette(img)
+        if palette is None:
+            print(f"{RED}[!] The built-in extractor needs python-numpy and ImageMagick.{NC}")
+            return 1
+        PALETTE_STORE.mkdir(parents=True, exist_ok=True)
+        saved.write_text(json.dumps(palette, indent=4))
+    write_wal_files(palette)
+    print(f"{GRN}[OK] Colours from {os.path.basename(img)} written to {WAL_CACHE}.{NC}")
+    return 0
 
 # ─── Install Custom Repos (idempotent) ───────────────────────────────────────
 
@@ -637,211 +3303,249 @@ def install_custom_repos():
     print_banner()
     print(f"{YLW}==> Setting up guhwm...{NC}")
 
-    guhwm_dir = os.path.join(TEMP_DIR, "guhwm")
-
-    # 1. Clone guhwm (only configs/wallpapers matter — always clone to temp)
-    result = subprocess.run(
-        ["git", "clone", "--depth", "1",
-         "https://github.com/Tapi-Mandy/guhwm.git", guhwm_dir]
-    )
-    if result.returncode != 0:
-        print(f"{RED}[!] Failed to clone guhwm repository.{NC}")
-        sys.exit(1)
+    if not step_done("install_custom_repos", "configs"):
+        guhwm_dir = os.path.join(TEMP_DIR, "guhwm")
 
-    # 2. Copy configs (cp --backup=numbered won't overwrite destructively)
-    confs_dir = os.path.join(guhwm_dir, "confs")
-    if os.path.isdir(confs_dir):
-        print(f"{GRA}--> Deploying configuration files...{NC}")
-        config_dest = os.path.join(str(Path.home()), ".config")
-        run(["cp", "-ra", "--backup=numbered",
-             confs_dir + "/.", config_dest])
-
-    # 3. Copy wallpapers
-    wallpapers_dest = Path.home() / "Wallpapers"
-    wallpapers_dest.mkdir(parents=True, exist_ok=True)
-    wallpapers_src = os.path.join(guhwm_dir, "Wallpapers")
-    run(["cp", "-ra", "--backup=numbered",
-         wallpapers_src + "/.", str(wallpapers_dest)])
-
-    # 4. Default wallpaper script
-    default_wp = Path.home() / ".config" / "mango" / "scripts" / "default-wallpaper.sh"
-    if default_wp.is_file():
-        default_wp.chmod(0o755)
-        print(f"{GRA}--> Setting default wallpaper...{NC}")
-        result = subprocess.run(["bash", str(default_wp)], stderr=subprocess.DEVNULL)
+        # 1. Clone guhwm (only configs/wallpapers matter — always clone to temp)
+        result = run(
+            ["git", "clone", "--depth", "1",
+             "https://github.com/Tapi-Mandy/guhwm.git", guhwm_dir], check=False
+        )
         if result.returncode != 0:
-            print(f"{GRA}--> Wallpaper is ready.{NC}")
+            print(f"{RED}[!] Failed to clone guhwm repository.{NC}")
+            sys.exit(1)
 
-    # 5. Nightlight script
-    nightlight = Path.home() / ".config" / "mango" / "scripts" / "nightlight-toggle.sh"
-    if nightlight.is_file():
-        nightlight.chmod(0o755)
-        print(f"{GRA}--> Nightlight is ready.{NC}")
+        # 2. Deploy configs (only files whose upstream changed; user edits are merged or kept)
+        deployer = ConfigDeployer()
+        confs_dir = os.path.join(guhwm_dir, "confs")
+        if os.path.isdir(confs_dir):
+            print(f"{GRA}--> Deploying configuration files...{NC}")
+            deployer.deploy(confs_dir, target_home() / ".config", link=LINK_CONFIGS,
+                            templates=TEMPLATE_FILES)
+
+        # 3. Copy wallpapers
+        wallpapers_dest = target_home() / "Wallpapers"
+        wallpapers_dest.mkdir(parents=True, exist_ok=True)
+        for wallpapers_src in (os.path.join(guhwm_dir, "assets", "Wallpapers"),
+                               os.path.join(guhwm_dir, "Wallpapers")):
+            if os.path.isdir(wallpapers_src):
+                deployer.deploy(wallpapers_src, wallpapers_dest)
+                break
+        st = deployer.stats
+        print(f"{GRN}[OK] Configs: {st['written']} written, {st['merged']} merged, "
+              f"{st['kept']} kept, {st['unchanged']} unchanged.{NC}")
+
+        # 4. Default wallpaper script
+        default_wp = target_home() / ".config" / "mango" / "scripts" / "default-wallpaper.sh"
+        if default_wp.is_file():
+            default_wp.chmod(0o755)
+            print(f"{GRA}--> Setting default wallpaper...{NC}")
+            result = run(["bash", str(default_wp)], stderr=subprocess.DEVNULL, check=False)
+            if result.returncode != 0:
+                print(f"{GRA}--> Wallpaper is ready.{NC}")
+
+        # 5. Nightlight script
+        nightlight = target_home() / ".config" / "mango" / "scripts" / "nightlight-toggle.sh"
+        if nightlight.is_file():
+            nightlight.chmod(0o755)
+            print(f"{GRA}--> Nightlight is ready.{NC}")
+
+        checkpoint("install_custom_repos", "configs",
+                   deployed=[str(target_home() / ".config"), str(wallpapers_dest)])
 
     # 6. guhwall — skip if already installed
     print()
-    if is_pkg_installed("guhwall"):
+    if step_done("install_custom_repos", "guhwall"):
+        pass
+    elif is_pkg_installed("guhwall"):
         print(f"{GRN}[OK] guhwall is already installed.{NC}")
     else:
         print(f"{YLW}==> Installing guhwall | Guh?? Set a Wallpaper!...{NC}")
         guhwall_dir = os.path.join(TEMP_DIR, "guhwall")
-        result = subprocess.run(
+        result = run(
             ["git", "clone", "--depth", "1",
-             "https://github.com/Tapi-Mandy/guhwall.git", guhwall_dir]
+             "https://github.com/Tapi-Mandy/guhwall.git", guhwall_dir], check=False
         )
         if result.returncode == 0:
-            subprocess.run(["makepkg", "-si", "--noconfirm"], cwd=guhwall_dir)
-            print(f"{GRN}[SUCCESS] guhwall is installed.{NC}")
+            if makepkg_install(guhwall_dir):
+                checkpoint("install_custom_repos", "guhwall", installed=["guhwall"])
+                print(f"{GRN}[SUCCESS] guhwall is installed.{NC}")
+            else:
+                print(f"{RED}[!] Failed to build or install guhwall.{NC}")
         else:
             print(f"{RED}[!] Failed to clone guhwall repository.{NC}")
             sys.exit(1)
 
     # 6b. Install pywal16 via pipx
     print()
-    result = subprocess.run(
-        ["pipx", "list"], capture_output=True, text=True
+    result = run(
+        ["pipx", "list"], capture_output=True, text=True, check=False
     )
-    if result.returncode == 0 and "pywal16" in result.stdout:
+    if step_done("install_custom_repos", "pywal16"):
+        pass
+    elif TARGET_ROOT is not None:
+        # A pipx venv hardcodes its own path, so it cannot be built for another root
+        print(f"{ORA}[!] pywal16 is a per-user pipx install; run "
+              f"'pipx install pywal16' on the installed system.{NC}")
+    elif result.returncode == 0 and "pywal16" in result.stdout:
         print(f"{GRN}[OK] pywal16 is already installed via pipx.{NC}")
     else:
         print(f"{YLW}==> Installing pywal16 via pipx...{NC}")
-        subprocess.run(["pipx", "install", "pywal16"])
+        if run(["pipx", "install", "pywal16"], check=False).returncode == 0:
+            checkpoint("install_custom_repos", "pywal16", installed=["pywal16"])
         # make sure pipx bin dir is on PATH for this session
         pipx_bin = Path.home() / ".local" / "bin"
         if str(pipx_bin) not in os.environ.get("PATH", ""):
             os.environ["PATH"] = f"{pipx_bin}:{os.environ.get('PATH', '')}"
 
+    # 6c. Pre-scaled wallpaper variants, picker thumbnails and palettes
+    print()
+    if not step_done("install_custom_repos", "wallpapers"):
+        made = prepare_wallpapers(target_home() / "Wallpapers")
+        checkpoint("install_custom_repos", "wallpapers", deployed=made)
+    if not step_done("install_custom_repos", "palettes"):
+        cache_palettes(target_home() / "Wallpapers")
+        checkpoint("install_custom_repos", "palettes", deployed=[str(PALETTE_STORE)])
+
     # 7. guhShot — skip if already installed
     print()
-    if is_pkg_installed("guhshot"):
+    if step_done("install_custom_repos", "guhshot"):
+        pass
+    elif is_pkg_installed("guhshot"):
         print(f"{GRN}[OK] guhShot is already installed.{NC}")
     else:
         print(f"{YLW}==> Installing guhShot | Guh?? Take a Screenshot!...{NC}")
         guhshot_dir = os.path.join(TEMP_DIR, "guhShot")
-        result = subprocess.run(
+        result = run(
             ["git", "clone", "--depth", "1",
-             "https://github.com/Tapi-Mandy/guhShot.git", guhshot_dir]
+             "https://github.com/Tapi-Mandy/guhShot.git", guhshot_dir], check=False
         )
         if result.returncode == 0:
-            subprocess.run(["makepkg", "-si", "--noconfirm"], cwd=guhshot_dir)
-            print(f"{GRN}[SUCCESS] guhShot is installed.{NC}")
+            if makepkg_install(guhshot_dir):
+                checkpoint("install_custom_repos", "guhshot", installed=["guhshot"])
+                print(f"{GRN}[SUCCESS] guhShot is installed.{NC}")
+            else:
+                print(f"{RED}[!] Failed to build or install guhShot.{NC}")
         else:
             print(f"{RED}[!] Failed to clone guhShot repository.{NC}")
             sys.exit(1)
 
     print()
-    input(f"{YLW}==> guhwm & guhwall & guhShot are installed. Press Enter to continue...{NC}")
+    pause("guhwm & guhwall & guhShot are installed. ")
     mark_done("install_custom_repos")
 
 # ─── Optional Software (idempotent) ──────────────────────────────────────────
 
-def sed_config(placeholder, replacement):
-    """Replace a placeholder in mango config.conf.
-    Idempotent: no-op if placeholder is already gone."""
-    config = Path.home() / ".config" / "mango" / "config.conf"
-    if config.is_file():
+def apply_shell(selection):
+    """Install Oh-My-Zsh if chosen and make *selection* the login shell."""
+    target_shell = "bash"
+    if selection == "fish":
+        target_shell = "fish"
+    elif selection in ("zsh", "oh-my-zsh"):
+        target_shell = "zsh"
+
+    if selection == "oh-my-zsh":
+        omz_dir = target_home() / ".oh-my-zsh"
+        if omz_dir.is_dir():
+            # ── Idempotency: Oh-My-Zsh already present ──
+            print(f"{GRN}[OK] Oh-My-Zsh is already installed.{NC}")
+        else:
+            print(f"{MAG}--> Running official Oh-My-Zsh installer...{NC}")
+            run(["sudo", "pacman", "-S", "--needed", "--noconfirm", "zsh"])
+            run(
+                ["sh", "-c",
+                 'sh -c "$(curl -fsSL https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/install.sh)" "" --unattended'],
+                env=dict(os.environ, HOME=str(target_home())), check=False
+            )
+        zshrc = target_home() / ".zshrc"
+        if zshrc.is_file():
+            text = zshrc.read_text()
+            if 'ZSH_THEME="robbyrussell"' in text:
+                text = text.replace('ZSH_THEME="robbyrussell"', 'ZSH_THEME="agnoster"')
+                zshrc.write_text(text)
+
+    shell_path = shutil.which(target_shell)
+    if TARGET_ROOT is not None:
+        found = shutil.which(target_shell, path=str(target_path("/usr/bin")))
+        shell_path = found and str(image_path(found))
+    if shell_path:
+        user = current_user()
+
+        # Add to /etc/shells if not there (idempotent check)
         try:
-            text = config.read_text()
-            if placeholder in text:
-                text = text.replace(placeholder, replacement)
-                config.write_text(text)
+            shells = target_path("/etc/shells")
+            shells_text = shells.read_text()
+            if shell_path not in shells_text.splitlines():
+                print(f"{GRA}--> Adding {shell_path} to /etc/shells...{NC}")
+                run(
+                    f"echo '{shell_path}' | sudo tee -a {shells} > /dev/null",
+                    shell=True, check=False
+                )
             else:
-                print(f"{GRN}[OK] Config already updated (no '{placeholder}' placeholder found).{NC}")
+                print(f"{GRN}[OK] {shell_path} already in /etc/shells.{NC}")
         except Exception:
             pass
 
-def optional_software():
+        # Change shell only if different (already idempotent)
+        entry = user_entry(user)
+        current_shell = entry[1] if entry else None
+        if current_shell is not None:
+            if current_shell != shell_path:
+                print(f"{GRA}--> Changing default shell to {target_shell}...{NC}")
+                # chsh has no --root; usermod does
+                tool = "chsh" if TARGET_ROOT is None else "usermod"
+                run(["sudo", tool, "-s", shell_path, user])
+            else:
+                print(f"{GRN}[OK] Shell is already {target_shell}.{NC}")
+
+def optional_menu(title, mode, options, then=None):
+    """Show one optional-software menu as a resumable checkpointed step.
+
+    *then* is called with the selected package once it is installed.
+    Returns None if the step already finished in an interrupted run,
+    otherwise whether anything was selected.
+    """
     global LAST_SELECTION
+    if step_done("optional_software", title):
+        return None
 
-    mango_dir = Path.home() / ".config" / "mango"
+    selected, pkgs = prompt_selection(title, mode, options)
+    selection, LAST_SELECTION = LAST_SELECTION, ""
+    if selection and then:
+        after_install(then, selection)
+    after_install(checkpoint, "optional_software", title, installed=pkgs, selection=selection)
+    return selected
+
+def optional_software():
+    mango_dir = target_home() / ".config" / "mango"
     mango_dir.mkdir(parents=True, exist_ok=True)
 
     print_banner()
+    if PLAN_MODE:
+        plan_begin()
 
     # ── SHELLS ──
-    prompt_selection("Shells", "single", [
+    shells = optional_menu("Shells", "single", [
         (GRA, "Bash",      "bash",       "GNU Bourne Again Shell"),
         (RED, "Fish",      "fish",       "Friendly Interactive Shell"),
         (ORA, "Zsh",       "zsh",        "Z Shell"),
         (MAG, "Oh-My-Zsh", "oh-my-zsh",  "Community-driven framework for Zsh"),
-    ])
-
-    if LAST_SELECTION:
-        target_shell = "bash"
-        if LAST_SELECTION == "fish":
-            target_shell = "fish"
-        elif LAST_SELECTION in ("zsh", "oh-my-zsh"):
-            target_shell = "zsh"
-
-        if LAST_SELECTION == "oh-my-zsh":
-            omz_dir = Path.home() / ".oh-my-zsh"
-            if omz_dir.is_dir():
-                # ── Idempotency: Oh-My-Zsh already present ──
-                print(f"{GRN}[OK] Oh-My-Zsh is already installed.{NC}")
-            else:
-                print(f"{MAG}--> Running official Oh-My-Zsh installer...{NC}")
-                run(["sudo", "pacman", "-S", "--needed", "--noconfirm", "zsh"])
-                subprocess.run(
-                    ["sh", "-c",
-                     'sh -c "$(curl -fsSL https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/install.sh)" "" --unattended']
-                )
-            zshrc = Path.home() / ".zshrc"
-            if zshrc.is_file():
-                text = zshrc.read_text()
-                if 'ZSH_THEME="robbyrussell"' in text:
-                    text = text.replace('ZSH_THEME="robbyrussell"', 'ZSH_THEME="agnoster"')
-                    zshrc.write_text(text)
-
-        shell_path = shutil.which(target_shell)
-        if shell_path:
-            user = os.environ.get("USER", os.getlogin())
-
-            # Add to /etc/shells if not there (idempotent check)
-            try:
-                shells_text = Path("/etc/shells").read_text()
-                if shell_path not in shells_text.splitlines():
-                    print(f"{GRA}--> Adding {shell_path} to /etc/shells...{NC}")
-                    subprocess.run(
-                        f"echo '{shell_path}' | sudo tee -a /etc/shells > /dev/null",
-                        shell=True
-                    )
-                else:
-                    print(f"{GRN}[OK] {shell_path} already in /etc/shells.{NC}")
-            except Exception:
-                pass
+    ], then=apply_shell)
 
-            # Change shell only if different (already idempotent)
-            result = subprocess.run(
-                ["getent", "passwd", user],
-                capture_output=True, text=True
-            )
-            if result.returncode == 0:
-                current_shell = result.stdout.strip().split(":")[-1]
-                if current_shell != shell_path:
-                    print(f"{GRA}--> Changing default shell to {target_shell}...{NC}")
-                    run(["sudo", "chsh", "-s", shell_path, user])
-                else:
-                    print(f"{GRN}[OK] Shell is already {target_shell}.{NC}")
-
-        LAST_SELECTION = ""
-
-    print()
-    input(f"{YLW}==> Press Enter to continue...{NC}")
+    if shells is not None and not PLAN_MODE:
+        print()
+        pause()
 
     # ── TERMINALS ──
-    prompt_selection("Terminals", "single", [
+    optional_menu("Terminals", "single", [
         (ORA, "Alacritty", "alacritty", "Cross-platform, OpenGL terminal"),
         (YLW, "Foot",      "foot",      "Fast, lightweight Wayland terminal"),
         (BLU, "Ghostty",   "ghostty",   "Bleeding edge. Modern, fast, and feature-rich"),
         (MAG, "Kitty",     "kitty",     "For people who live inside the terminal"),
-    ])
-
-    if LAST_SELECTION:
-        sed_config("YOURTERMINAL", LAST_SELECTION)
-        LAST_SELECTION = ""
+    ], then=bind_terminal)
 
     # ── BROWSERS ──
-    prompt_selection("Browsers", "multi", [
+    optional_menu("Browsers", "multi", [
         (ORA, "Brave",       "brave-bin",       "Privacy-focused browser"),
         (ORA, "Firefox",     "firefox",         "Fast, Private & Safe"),
         (PUR, "Floorp",      "floorp-bin",      "Firefox fork focused on performance"),
@@ -851,7 +3555,7 @@ def optional_software():
     ])
 
     # ── CHAT CLIENTS ──
-    prompt_selection("Chat Clients", "multi", [
+    optional_menu("Chat Clients", "multi", [
         (BLU, "Discord",  "discord",         "All-in-one voice and text chat"),
         (BLU, "Dissent",  "dissent-bin",     "Discord client written in Go/GTK4"),
         (CYN, "Telegram", "telegram-desktop", "Official Telegram Desktop client"),
@@ -860,47 +3564,33 @@ def optional_software():
     ])
 
     # ── FILE MANAGERS ──
-    gui_file_managers = {"nautilus", "nemo", "dolphin"}
-    prompt_selection("File Managers", "single", [
+    optional_menu("File Managers", "single", [
         (BLU, "Nautilus", "nautilus", "GNOME's file manager"),
         (WHT, "Nemo",    "nemo",     "Cinnamon's file manager"),
         (GRA, "nnn",     "nnn",      "The unorthodox terminal file manager"),
         (ORA, "ranger",  "ranger",   "Vim-inspired terminal file manager"),
         (YLW, "Yazi",    "yazi",     "Blazing fast terminal file manager written in Rust"),
-    ])
-
-    if LAST_SELECTION:
-        if LAST_SELECTION in gui_file_managers:
-            # GUI file managers don't need a terminal wrapper
-            sed_config("YOURTERMINAL -e YOURFILEMANAGER", LAST_SELECTION)
-        else:
-            # TUI file managers need to run inside a terminal
-            sed_config("YOURFILEMANAGER", LAST_SELECTION)
-        LAST_SELECTION = ""
+    ], then=bind_file_manager)
 
     # ── EDITORS ──
-    prompt_selection("Editors", "multi", [
+    optional_menu("Editors", "multi", [
         (PUR, "Emacs",        "emacs",          "The extensible, self-documenting editor"),
         (YLW, "Geany",        "geany",          "Flyweight IDE"),
         (GRN, "Neovim",       "neovim",         "Vim-fork focused on extensibility"),
         (GRA, "Sublime Text", "sublime-text-4", "Sophisticated text editor"),
         (GRN, "Vim",          "vim",            "The ubiquitous text editor"),
         (BLU, "VSCodium",     "vscodium-bin",   "Free/Libre Open Source VSCode"),
-    ])
-
-    if LAST_SELECTION:
-        sed_config("YOUREDITOR", LAST_SELECTION)
-        LAST_SELECTION = ""
+    ], then=bind_editor)
 
     # ── GRAPHICS ──
-    prompt_selection("Graphics", "multi", [
+    optional_menu("Graphics", "multi", [
         (ORA, "Blender", "blender", "3D creation suite for modeling, rigging, and animation"),
         (GRA, "GIMP",    "gimp",    "GNU Image Manipulation Program"),
         (MAG, "Krita",   "krita",   "Professional digital painting for everyone"),
     ])
 
     # ── MEDIA ──
-    prompt_selection("Media", "multi", [
+    optional_menu("Media", "multi", [
         (WHT, "imv",        "imv",        "Command-line image viewer for Wayland and X11"),
         (BLU, "Loupe",      "loupe",      "Simple and modern image viewer from GNOME"),
         (PUR, "mpv",        "mpv",        "Free, open source, and cross-platform media player"),
@@ -910,21 +3600,21 @@ def optional_software():
     ])
 
     # ── PDF READERS ──
-    prompt_selection("PDF Readers", "multi", [
+    optional_menu("PDF Readers", "multi", [
         (WHT, "Evince",  "evince",  "GNOME document viewer"),
         (ORA, "MuPDF",   "mupdf",   "Lightweight PDF and XPS viewer"),
         (GRA, "Zathura", "zathura", "Minimalist document viewer"),
     ])
 
     # ── OFFICE SUITES ──
-    prompt_selection("Office Suites", "multi", [
+    optional_menu("Office Suites", "multi", [
         (BLU, "LibreOffice Fresh", "libreoffice-fresh", "Latest LibreOffice release"),
         (GRN, "LibreOffice Still", "libreoffice-still", "Stable LibreOffice release"),
         (BLU, "OpenOffice",        "openoffice-bin",   "Free and Open Productivity Suite"),
     ])
 
     # ── UTILITIES ──
-    prompt_selection("Utilities", "multi", [
+    optional_menu("Utilities", "multi", [
         (GRA, "Fastfetch", "fastfetch", "Like neofetch, but much faster"),
         (MAG, "fzf",       "fzf",       "Command-line fuzzy finder"),
         (GRA, "htop",      "htop",      "Interactive process viewer"),
@@ -934,7 +3624,7 @@ def optional_software():
     ])
 
     # ── EMULATORS ──
-    prompt_selection("Emulators", "multi", [
+    optional_menu("Emulators", "multi", [
         (BLU, "Dolphin",     "dolphin-emu-git",   "Gamecube & Wii emulator"),
         (YLW, "DuckStation", "duckstation-git",   "PS1 Emulator aiming for accuracy and support"),
         (GRN, "melonDS",     "melonds-bin",       "DS emulator, sorta"),
@@ -945,20 +3635,23 @@ def optional_software():
     ])
 
     # ── DISPLAY MANAGER ──
-    selected, pkgs = prompt_selection("Display Manager", "single", [
+    optional_menu("Display Manager", "single", [
         (PUR, "Ly", "ly", "TUI display manager"),
-    ])
-
-    if selected and LAST_SELECTION:
-        print(f"{GRA}--> Verifying installation...{NC}")
-        if is_pkg_installed("ly"):
-            enable_service("ly")
-            print()
-            input(f"{YLW}==> Ly setup finished. Press Enter to continue...{NC}")
-        else:
-            print(f"{RED}[ERROR] Ly package not found in database.{NC}")
-            input(f"{YLW}==> Press Enter to continue...{NC}")
-        LAST_SELECTION = ""
+    ], then=lambda sel: setup_display_manager())
+
+    plan_commit()
+    render_templates()
+    STATE.finish("optional_software")
+
+def setup_display_manager():
+    """Enable Ly once its package is confirmed installed."""
+    print(f"{GRA}--> Verifying installation...{NC}")
+    if is_pkg_installed("ly"):
+        enable_service("ly")
+        print(f"{GRN}[OK] Ly will be enabled together with the other services.{NC}")
+    else:
+        print(f"{RED}[ERROR] Ly package not found in database.{NC}")
+        pause()
 
 # ─── Outro ────────────────────────────────────────────────────────────────────
 
@@ -990,28 +3683,286 @@ def print_outro():
     print(OUTRO_ART)
     print(f"{GRN}System setup complete! Everything is ready.{NC}")
     print()
-    rb = input("Would you like to reboot now? (y/n): ").strip()
+    if TARGET_ROOT is not None:
+        print(f"{GRA}--> {TARGET_ROOT} is provisioned and can be imaged or cloned.{NC}")
+        return
+    reboot = "y" if PROFILE and PROFILE["options"].get("reboot") else "n"
+    rb = ask("Would you like to reboot now? (y/n): ", reboot).strip()
 
     if rb.lower() == "y":
-        subprocess.run(["systemctl", "reboot"])
+        run(["systemctl", "reboot"], check=False)
+
+# ─── System Fingerprint (--verify) ───────────────────────────────────────────
+
+# Components each phase provisions; a phase reruns only when one of them drifted
+PHASE_COMPONENTS = {
+    "prepare_system":       ["packages"],
+    "setup_aur_helper":     ["packages"],
+    "install_base":         ["packages", "groups"],
+    "install_custom_repos": ["packages", "configs"],
+    "optional_software":    ["packages", "configs", "shell"],
+    "services":             ["units", "groups"],
+}
+
+def _checkpoints():
+    """Every checkpoint record: pending steps, completed phases and history."""
+    data = STATE.data
+    steps = list(data["steps"].values())
+    for section in ("phases", "history"):
+        for record in data[section].values():
+            steps += record.get("steps", {}).values()
+    return steps
+
+def _recorded(kind):
+    """Every name listed under *kind* ("installed", "enabled") by any checkpoint."""
+    return sorted({name for step in _checkpoints() for name in step.get(kind, [])})
+
+def requeue_units():
+    """Queue every unit a previous run enabled again, for apply_units() to repair."""
+    for step in _checkpoints():
+        for u in step.get("queued", []):
+            enable_service(u["unit"], u["scope"], u["now"])
+
+def _local_packages():
+    """Names in the local pacman DB, read from its directory listing alone."""
+    try:
+        entries = os.listdir(PKG_INDEX.dbpath / "local")
+    except OSError:
+        return set()
+    return {e.rsplit("-", 2)[0] for e in entries if e.count("-") >= 2}
+
+def fingerprint():
+    """Snapshot everything guhwizard provisioned, cheaply enough to run every time."""
+    local = _local_packages()
+    units = _recorded("enabled")
+    enabled = _enabled(units)
+    enabled |= _enabled([u for u in units if u not in enabled], user=True)
+    configs = {}
+    for path in ConfigDeployer().files:
+        configs[path] = _file_hash(path) if os.path.isfile(path) else None
+    user = current_user()
+    entry = user_entry(user)
+    return {
+        "packages": [p for p in _recorded("installed") if p in local],
+        "configs": configs,
+        "units": sorted(enabled),
+        "groups": sorted(g for g in USER_GROUPS if user_in_group(user, g)),
+        "shell": entry[1] if entry else None,
+    }
+
+def drift(old, new):
+    """Return {component: description} for every component that changed."""
+    changes = {}
+    for key in ("packages", "units", "groups"):
+        gone = [x for x in old.get(key, []) if x not in new[key]]
+        added = [x for x in new[key] if x not in old.get(key, [])]
+        parts = ([f"missing {' '.join(gone)}"] if gone else []) + \
+                ([f"new {' '.join(added)}"] if added else [])
+        if parts:
+            changes[key] = "; ".join(parts)
+    configs = old.get("configs", {})
+    changed = sorted(p for p in set(configs) | set(new["configs"])
+                     if configs.get(p) != new["configs"].get(p))
+    if changed:
+        changes["configs"] = "changed " + " ".join(changed)
+    if old.get("shell") != new["shell"]:
+        changes["shell"] = f"{old.get('shell')} -> {new['shell']}"
+    return changes
+
+def unrestored(old, new):
+    """Return {component: description} for what *new* still lacks from *old*.
+
+    Only losses count: a rerun puts back missing packages, units, groups
+    and the login shell, but leaves additions and locally edited configs
+    alone.
+    """
+    left = {}
+    for key in ("packages", "units", "groups"):
+        gone = [x for x in old.get(key, []) if x not in new[key]]
+        if gone:
+            left[key] = f"missing {' '.join(gone)}"
+    if old.get("shell") != new["shell"]:
+        left["shell"] = f"{new['shell']}, expected {old.get('shell')}"
+    return left
+
+def save_fingerprint(components=None):
+    """Remember the fingerprint of a successful run for the next --verify."""
+    STATE.data["fingerprint"] = {"taken": _now(), "components": components or fingerprint()}
+    STATE.save()
+
+def drifted_phases():
+    """Compare the system with the fingerprint of the last successful run.
+
+    Prints every drifted component and returns the phases that depend on
+    one (empty when nothing drifted), or None without a fingerprint.
+    """
+    old = STATE.data["fingerprint"]
+    if not old:
+        print(f"{ORA}[!] No fingerprint from a previous run; running every phase.{NC}")
+        return None
+    start = time.monotonic()
+    changes = drift(old["components"], fingerprint())
+    secs = time.monotonic() - start
+    if not changes:
+        print(f"{GRN}[OK] Nothing drifted since the run of {old['taken']} "
+              f"(checked in {secs:.2f}s).{NC}")
+        return []
+    for component, what in changes.items():
+        print(f"{ORA}[!] Drifted {component}: {what}{NC}")
+    return [p for p, comps in PHASE_COMPONENTS.items() if set(comps) & set(changes)]
 
 # ─── Main ─────────────────────────────────────────────────────────────────────
 
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="guhwm installer for Arch Linux")
+    parser.add_argument("--plan", action="store_true",
+                        help="collect every optional-software choice first, "
+                             "then install them in one transaction")
+    parser.add_argument("--profile", metavar="ANSWERS.toml",
+                        help="run unattended: answer every menu from ANSWERS.toml "
+                             "and skip all 'Press Enter' pauses")
+    parser.add_argument("--trace", metavar="OUT.json",
+                        help="write every external command as a Chrome/Perfetto "
+                             "trace-event timeline to OUT.json")
+    parser.add_argument("--export-repo", metavar="DIR",
+                        help="after installing, collect every package this run "
+                             "installed into a local pacman repository in DIR")
+    parser.add_argument("--use-repo", metavar="URL",
+                        help="prefer a repository made by --export-repo, "
+                             "e.g. file:///srv/guhwm-repo")
+    parser.add_argument("--link-configs", action="store_true",
+                        help="symlink ~/.config files to a managed copy in "
+                             "~/.local/share/guhwm instead of copying them")
+    parser.add_argument("--render", metavar="NAME=VALUE", nargs="+",
+                        help="rebind terminal=, editor= or filemanager= and "
+                             "re-render the templated configs, then exit")
+    parser.add_argument("--palettes", metavar="DIR",
+                        help="precompute pywal palettes for new images in DIR, "
+                             "then exit")
+    parser.add_argument("--palette-backend", choices=["wal", "numpy"], default="wal",
+                        help="compute palettes with pywal (default) or the built-in "
+                             "NumPy extractor (needs python-numpy)")
+    parser.add_argument("--wal", metavar="IMAGE",
+                        help="write pywal colour files for IMAGE with the built-in "
+                             "extractor, then exit")
+    parser.add_argument("--keep-mirrorlist", action="store_true",
+                        help="probe mirrors but do not rewrite /etc/pacman.d/mirrorlist")
+    parser.add_argument("--root", metavar="DIR",
+                        help="install into the system at DIR (e.g. made by pacstrap) "
+                             "instead of the running one, to build a golden image")
+    parser.add_argument("--verify", action="store_true",
+                        help="compare the system with the last successful run and "
+                             "only rerun the phases whose components drifted")
+    parser.add_argument("--restore", action="store_true",
+                        help="undo the pacman/makepkg tuning applied during "
+                             "system preparation, then exit")
+    parser.add_argument("--report", action="store_true",
+                        help="show timing percentiles and regressions from "
+                             "previous runs, then exit")
+    return parser.parse_args(argv)
+
 def main():
-    redirect_stdin()
+    global PLAN_MODE, PROFILE, LINK_CONFIGS, PALETTE_BACKEND, RANK_MIRRORS
+    args = parse_args()
+    RANK_MIRRORS = not args.keep_mirrorlist
+    PALETTE_BACKEND = args.palette_backend
+    PLAN_MODE = args.plan
+    LINK_CONFIGS = args.link_configs
+    if args.root and Path(args.root).resolve() != Path("/"):
+        set_target_root(args.root)
+
+    if args.report:
+        sys.exit(show_report())
+    if args.render:
+        sys.exit(rerender(args.render))
+    if args.wal:
+        sys.exit(apply_palette(args.wal))
+    if args.palettes:
+        cache_palettes(args.palettes)
+        sys.exit(0)
+
+    if args.profile:
+        PROFILE = load_profile(args.profile)
+        PLAN_MODE = PLAN_MODE or bool(PROFILE["options"].get("plan"))
+        LINK_CONFIGS = LINK_CONFIGS or bool(PROFILE["options"].get("link_configs"))
+    else:
+        redirect_stdin()
     check_root()
+    rerun = None            # --verify: only these phases, None for all of them
+    if args.verify:
+        rerun = drifted_phases()
+        if rerun == []:
+            sys.exit(0)
+        for name in rerun or ():
+            STATE.reopen(name)
+        if rerun and "services" in rerun:
+            requeue_units()    # the queue was emptied once the units were enabled
+    wanted = lambda name: rerun is None or name in rerun
     check_sudo()
     start_sudo_keepalive()
     setup_logging()
     setup_temp_dir()
     atexit.register(cleanup)
+    if TARGET_ROOT is not None:
+        prepare_target()
+    if args.restore:
+        sys.exit(restore_tuning())
+
+    snapshot_installed()
+    evict_pkg_cache()
+
+    exit_code = 0
+    try:
+        if args.use_repo:
+            with phase("use_repo"):
+                use_repo(args.use_repo)
+        if wanted("prepare_system"):
+            with phase("prepare_system"):
+                prepare_system()       # Refresh keys, install git/base-devel
+        with phase("setup_aur_helper"), on_host():
+            detect_aur()               # Check if a helper is already there
+            if wanted("setup_aur_helper"):
+                setup_aur_helper()     # Repair or Install AUR helper
+        if wanted("install_base"):
+            with phase("install_base"):
+                install_base()         # System utils, Wayland, Audio, Fonts
+        if wanted("install_custom_repos"):
+            with phase("install_custom_repos"):
+                install_custom_repos() # Clone configs, Wallpapers, guhwall, guhShot
+        if wanted("optional_software"):
+            with phase("optional_software"):
+                optional_software()    # Shells, Browsers, Apps, and 'sed' tweaks
+        if wanted("services"):
+            with phase("services"):
+                apply_units()          # Enable every queued systemd unit at once
+        current = fingerprint()
+        left = unrestored(STATE.data["fingerprint"]["components"], current) if rerun else {}
+        for component, what in left.items():
+            print(f"{RED}[!] Still drifted {component}: {what}{NC}")
+        if not left:
+            save_fingerprint(current)
+        if args.export_repo:
+            with phase("export_repo"):
+                export_repo(args.export_repo)
+        if left:
+            sys.exit(1)
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+        raise
+    except subprocess.CalledProcessError as e:
+        exit_code = EXIT_COMMAND_FAILED
+        print(f"{RED}[!] Command failed with exit code {e.returncode}: "
+              f"{' '.join(_argv(e.cmd))}{NC}")
+        sys.exit(exit_code)
+    except BaseException:
+        exit_code = 1
+        raise
+    finally:
+        save_history(exit_code)
+        if args.trace:
+            write_trace(args.trace)
 
-    prepare_system()       # Refresh keys, install git/base-devel
-    detect_aur()           # Check if a helper is already there
-    setup_aur_helper()     # Repair or Install AUR helper
-    install_base()         # System utils, Wayland, Audio, Fonts
-    install_custom_repos() # Clone configs, Wallpapers, guhwall, guhShot
-    optional_software()    # Shells, Browsers, Apps, and 'sed' tweaks
     print_outro()          # Final ASCII and reboot prompt
 
 if __name__ == "__main__":